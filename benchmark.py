@@ -0,0 +1,431 @@
+# benchmark.py
+# 推理基准测试集合：在一小份带标注的样本上比较不同推理配置的吞吐与得分。
+# 用法:
+#   python benchmark.py prompts                 # 真实模型 (4bit + LoRA)
+#   python benchmark.py prompts --tiny --limit 8  # CPU上用微型替身模型只比较开销
+import argparse
+import json
+import time
+
+from prompts import FEW_SHOT_IDS, PROMPTS, count_prompt_tokens
+from scorer import format_scores, score_pairs
+
+GOLD_FILE_PATH = "./train.json"
+
+
+def load_eval_items(path: str = GOLD_FILE_PATH, limit: int = 50):
+    """取带 output 的样本做评测集，排除长版 prompt 中已经用作 few-shot 的ID。"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    items = [item for item in data if int(item['id']) not in FEW_SHOT_IDS]
+    # 从末尾取样，与常见的"前90%训练"划分尽量错开
+    return items[-limit:] if limit else items
+
+
+def setup_model(args):
+    """根据命令行参数加载 (model, tokenizer)。"""
+    from inference_utils import load_model, load_tiny_model, load_tokenizer
+
+    tokenizer = load_tokenizer()
+    if args.tiny:
+        return load_tiny_model(tokenizer), tokenizer
+    return load_model(backend=args.backend), tokenizer
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def print_table(rows, columns):
+    widths = [max(len(str(c)), *(len(str(r.get(c, ''))) for r in rows)) for c in columns]
+    print("  ".join(str(c).ljust(w) for c, w in zip(columns, widths)))
+    for r in rows:
+        print("  ".join(str(r.get(c, '')).ljust(w) for c, w in zip(columns, widths)))
+
+
+# --- 各项基准 ---
+
+def bench_prompts(args, model, tokenizer, items):
+    """比较注册表中各个 prompt 的 prefill 开销、吞吐和得分。"""
+    from inference_utils import apply_fallback, generate_responses
+
+    contents = [item['content'] for item in items]
+    golds = [item['output'] for item in items]
+    rows = []
+    for name in args.prompts or list(PROMPTS):
+        responses, elapsed = timed(generate_responses, model, tokenizer, contents, name,
+                                   batch_size=args.batch_size, max_new_tokens=args.max_new_tokens)
+        scores = score_pairs([apply_fallback(r) for r in responses], golds)
+        rows.append({
+            "prompt": name,
+            "prompt_tokens": count_prompt_tokens(tokenizer, name),
+            "items/s": f"{len(items) / elapsed:.2f}",
+            "sec": f"{elapsed:.1f}",
+            "hard_f1": f"{scores['hard_f1']:.4f}",
+            "soft_f1": f"{scores['soft_f1']:.4f}",
+        })
+        print(f"[{name}] {format_scores(scores)}")
+    print_table(rows, ["prompt", "prompt_tokens", "items/s", "sec", "hard_f1", "soft_f1"])
+    return rows
+
+
+def bench_fewshot(args, model, tokenizer, items):
+    """固定6个few-shot (full_v1) 与检索式动态few-shot (retrieval_v1) 的对比。"""
+    from fewshot_retriever import FewShotRetriever
+    from inference_utils import apply_fallback, generate_responses
+
+    contents = [item['content'] for item in items]
+    golds = [item['output'] for item in items]
+    retriever = FewShotRetriever()
+    # 评测样本来自 train.json，检索时排除样本自身
+    system_prompts, retrieve_sec = timed(retriever.build_prompts, contents, tokenizer,
+                                         k=args.fewshot_k, token_budget=args.fewshot_budget,
+                                         exclude_ids=[item['id'] for item in items])
+    retriever.close()
+    print(f"批量检索+组装 {len(items)} 条 prompt 耗时 {retrieve_sec * 1000:.1f} ms")
+
+    rows = []
+    for name, prompts_for_items in (("full_v1", None), ("retrieval_v1", system_prompts)):
+        responses, elapsed = timed(generate_responses, model, tokenizer, contents, name,
+                                   batch_size=args.batch_size, max_new_tokens=args.max_new_tokens,
+                                   system_prompts=prompts_for_items)
+        scores = score_pairs([apply_fallback(r) for r in responses], golds)
+        if prompts_for_items is None:
+            avg_tokens = count_prompt_tokens(tokenizer, name)
+        else:
+            avg_tokens = sum(len(tokenizer(p)['input_ids']) for p in prompts_for_items) / len(prompts_for_items)
+        rows.append({
+            "prompt": name,
+            "avg_system_tokens": f"{avg_tokens:.0f}",
+            "items/s": f"{len(items) / elapsed:.2f}",
+            "hard_f1": f"{scores['hard_f1']:.4f}",
+            "soft_f1": f"{scores['soft_f1']:.4f}",
+        })
+    print_table(rows, ["prompt", "avg_system_tokens", "items/s", "hard_f1", "soft_f1"])
+    return rows
+
+
+def bench_labels(args, model, tokenizer, items):
+    """逐 token 生成标签 vs 两阶段标签打分 (label_scoring.py)，逐条推理，比较速度、非法标签数和得分。"""
+    from inference_utils import apply_fallback, generate_responses
+    from label_scoring import LabelScorer, generate_with_label_scoring, label_candidates
+    from prompts import render_prompt
+    from scorer import parse_quadruplets
+
+    valid = set(label_candidates())
+    golds = [item['output'] for item in items]
+
+    def invalid_count(responses):
+        return sum(1 for r in responses for q in parse_quadruplets(r) if f"{q[2]} | {q[3]}" not in valid)
+
+    def run_scoring():
+        scorer = LabelScorer(tokenizer)
+        responses, steps = [], 0
+        for item in items:
+            prompt = render_prompt(tokenizer, item['content'], args.prompts[0] if args.prompts else "full_v1")
+            input_ids = tokenizer(prompt, return_tensors="pt")['input_ids'].to(model.device)
+            response, stats = generate_with_label_scoring(model, tokenizer, input_ids, scorer, args.max_new_tokens)
+            responses.append(response)
+            steps += stats["decode_steps"]
+        return responses, steps
+
+    rows = []
+    baseline, elapsed = timed(generate_responses, model, tokenizer, [item['content'] for item in items],
+                              args.prompts[0] if args.prompts else "full_v1", batch_size=1,
+                              max_new_tokens=args.max_new_tokens)
+    base_steps = sum(len(tokenizer(r, add_special_tokens=False)['input_ids']) for r in baseline)
+    for name, (responses, steps), sec in (("generate", (baseline, base_steps), elapsed),
+                                          ("label_scoring", *timed(run_scoring))):
+        scores = score_pairs([apply_fallback(r) for r in responses], golds)
+        rows.append({
+            "mode": name,
+            "items/s": f"{len(items) / sec:.2f}",
+            "decode_steps": steps,
+            "invalid_labels": invalid_count(responses),
+            "hard_f1": f"{scores['hard_f1']:.4f}",
+            "soft_f1": f"{scores['soft_f1']:.4f}",
+        })
+    print_table(rows, ["mode", "items/s", "decode_steps", "invalid_labels", "hard_f1", "soft_f1"])
+    return rows
+
+
+def bench_static(args, model, tokenizer, items):
+    """默认动态 cache (eager) vs 静态 KV cache + torch.compile (static_decode.py)，比较吞吐和输出一致性。"""
+    from inference_utils import generate_responses
+    from static_decode import StaticDecoder
+
+    contents = [item['content'] for item in items]
+    prompt_name = args.prompts[0] if args.prompts else "full_v1"
+    eager, eager_sec = timed(generate_responses, model, tokenizer, contents, prompt_name,
+                             batch_size=args.batch_size, max_new_tokens=args.max_new_tokens)
+
+    decoder = StaticDecoder(model, tokenizer, max_new_tokens=args.max_new_tokens)
+    # 第一轮包含各个形状桶的编译时间，单独计时；第二轮才是稳态吞吐
+    _, warmup_sec = timed(decoder.generate_responses, contents, prompt_name, batch_size=args.batch_size)
+    static, static_sec = timed(decoder.generate_responses, contents, prompt_name, batch_size=args.batch_size)
+
+    rows = [
+        {"mode": "eager", "items/s": f"{len(items) / eager_sec:.2f}", "sec": f"{eager_sec:.2f}", "warmup_sec": "-"},
+        {"mode": "static+compile", "items/s": f"{len(items) / static_sec:.2f}", "sec": f"{static_sec:.2f}",
+         "warmup_sec": f"{warmup_sec:.2f}"},
+    ]
+    print_table(rows, ["mode", "items/s", "sec", "warmup_sec"])
+    same = sum(a == b for a, b in zip(eager, static))
+    compiled = "编译" if decoder.compiled_forward is not None else "未编译 (eager)"
+    print(f"{compiled}形状桶 {sorted(decoder.shapes_seen)}；输出一致 {same}/{len(items)}；加速 {eager_sec / static_sec:.2f}x")
+    return rows
+
+
+def bench_vocab(args, model, tokenizer, items):
+    """完整词表 generate / 完整 logits+屏蔽 / 受限词表 lm_head 切片 (restricted_vocab.py)，比较速度与一致性。"""
+    from inference_utils import generate_responses
+    from prompts import render_prompt
+    from restricted_vocab import allowed_token_ids, format_token_ids, generate_masked_full, generate_restricted
+
+    prompt_name = args.prompts[0] if args.prompts else "full_v1"
+    base_ids = format_token_ids(tokenizer)
+    batches = []
+    for start in range(0, len(items), args.batch_size):
+        contents = [item['content'] for item in items[start:start + args.batch_size]]
+        prompts = [render_prompt(tokenizer, c, prompt_name) for c in contents]
+        inputs = tokenizer(prompts, return_tensors="pt", padding=True).to(model.device)
+        batches.append((contents, inputs, allowed_token_ids(tokenizer, contents, base_ids)))
+
+    def run(fn):
+        return [r for contents, inputs, allowed in batches for r in fn(contents, inputs, allowed)]
+
+    full, full_sec = timed(generate_responses, model, tokenizer, [item['content'] for item in items], prompt_name,
+                           batch_size=args.batch_size, max_new_tokens=args.max_new_tokens)
+    masked, masked_sec = timed(run, lambda c, inputs, allowed: generate_masked_full(
+        model, tokenizer, inputs, allowed, args.max_new_tokens))
+    restricted, restricted_sec = timed(run, lambda c, inputs, allowed: generate_restricted(
+        model, tokenizer, inputs, allowed, args.max_new_tokens)[0])
+
+    vocab = model.get_output_embeddings().weight.shape[0]
+    avg_allowed = sum(len(allowed) for _, _, allowed in batches) / len(batches)
+    print(f"词表 {vocab}，每个 batch 平均允许 {avg_allowed:.0f} 个 token ({avg_allowed / vocab:.2%})")
+    rows = [
+        {"mode": "full", "items/s": f"{len(items) / full_sec:.2f}", "same_as_masked": "-",
+         "same_as_full": f"{len(items)}/{len(items)}"},
+        {"mode": "masked_full", "items/s": f"{len(items) / masked_sec:.2f}", "same_as_masked": f"{len(items)}/{len(items)}",
+         "same_as_full": f"{sum(a == b for a, b in zip(masked, full))}/{len(items)}"},
+        {"mode": "restricted", "items/s": f"{len(items) / restricted_sec:.2f}",
+         "same_as_masked": f"{sum(a == b for a, b in zip(restricted, masked))}/{len(items)}",
+         "same_as_full": f"{sum(a == b for a, b in zip(restricted, full))}/{len(items)}"},
+    ]
+    print_table(rows, ["mode", "items/s", "same_as_masked", "same_as_full"])
+    print(f"受限词表相对完整词表加速 {full_sec / restricted_sec:.2f}x")
+    return rows
+
+
+def bench_stream(args, model, tokenizer, items):
+    """增量输出四元组 (quad_streamer.py)：逐条推理，分别统计首个四元组延迟与总延迟。"""
+    from prompts import render_prompt
+    from quad_streamer import start_streaming
+
+    prompt_name = args.prompts[0] if args.prompts else "full_v1"
+    first, total, quads = [], [], 0
+    for item in items:
+        prompt = render_prompt(tokenizer, item['content'], prompt_name)
+        inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
+        streamer = start_streaming(model, tokenizer, inputs, max_new_tokens=args.max_new_tokens)
+        quads += sum(1 for _ in streamer)
+        streamer.thread.join()
+        stats = streamer.stats()
+        total.append(stats["total_sec"])
+        if stats["first_quad_sec"] is not None:
+            first.append(stats["first_quad_sec"])
+
+    def pct(values, p):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(p / 100 * len(values)))] * 1000 if values else float("nan")
+
+    rows = [{"latency": name, "n": len(values), "mean_ms": f"{sum(values) / max(1, len(values)) * 1000:.0f}",
+             "p50_ms": f"{pct(values, 50):.0f}", "p90_ms": f"{pct(values, 90):.0f}"}
+            for name, values in (("first_quad", first), ("total", total))]
+    print_table(rows, ["latency", "n", "mean_ms", "p50_ms", "p90_ms"])
+    print(f"共输出 {quads} 个四元组；{len(items) - len(first)} 条没有解析出任何四元组。")
+    return rows
+
+
+def bench_long(args, model, tokenizer, items):
+    """超长评论整条推理 vs 分块推理 (long_comments.py)：逐条计时，比较延迟尾部和得分。"""
+    from inference_utils import apply_fallback, generate_responses
+    from long_comments import LONG_INPUT_TOKENS, extract_long, is_long
+
+    prompt_name = args.prompts[0] if args.prompts else "full_v1"
+    golds = [item['output'] for item in items]
+    long_flags = [is_long(tokenizer, item['content'], args.long_budget) for item in items]
+    print(f"{sum(long_flags)}/{len(items)} 条超过 {args.long_budget} token (默认预算 {LONG_INPUT_TOKENS})")
+
+    def run(chunking):
+        responses, latencies = [], []
+        for item, long_item in zip(items, long_flags):
+            start = time.perf_counter()
+            if chunking and long_item:
+                response, _ = extract_long(model, tokenizer, item['content'], prompt_name,
+                                           batch_size=args.batch_size, max_new_tokens=args.max_new_tokens)
+            else:
+                response = generate_responses(model, tokenizer, [item['content']], prompt_name, batch_size=1,
+                                              max_new_tokens=args.max_new_tokens)[0]
+            latencies.append(time.perf_counter() - start)
+            responses.append(apply_fallback(response))
+        return responses, sorted(latencies)
+
+    rows = []
+    for name, chunking in (("whole", False), ("chunked", True)):
+        responses, latencies = run(chunking)
+        scores = score_pairs(responses, golds)
+        row = {"mode": name, "hard_f1": f"{scores['hard_f1']:.4f}", "soft_f1": f"{scores['soft_f1']:.4f}"}
+        for p in (50, 90, 99):
+            row[f"p{p}_ms"] = f"{latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000:.0f}"
+        row["max_ms"] = f"{latencies[-1] * 1000:.0f}"
+        rows.append(row)
+    print_table(rows, ["mode", "p50_ms", "p90_ms", "p99_ms", "max_ms", "hard_f1", "soft_f1"])
+    return rows
+
+
+def bench_backends(args, model, tokenizer, items):
+    """
+    不同加载后端 (默认 bf16 vs int8) 的吞吐、权重内存与得分；以第一个后端为基准做输出一致性检查。
+    各后端依次加载、测完即释放；--tiny 时用同一份随机权重的微型模型分别转成各后端。
+    """
+    import copy
+    import gc
+
+    import torch
+
+    from inference_utils import (apply_fallback, generate_responses, load_model, load_tiny_model,
+                                 model_memory_bytes, quantize_int8)
+
+    contents = [item['content'] for item in items]
+    golds = [item['output'] for item in items]
+    prompt_name = args.prompts[0] if args.prompts else "full_v1"
+    tiny = load_tiny_model(tokenizer) if args.tiny else None
+
+    rows, reference = [], None
+    for backend in args.backends:
+        if tiny is not None:
+            candidate = copy.deepcopy(tiny)
+            candidate = quantize_int8(candidate) if backend == "int8" else candidate.to(torch.bfloat16)
+        else:
+            candidate = load_model(backend=backend)
+        responses, elapsed = timed(generate_responses, candidate, tokenizer, contents, prompt_name,
+                                   batch_size=args.batch_size, max_new_tokens=args.max_new_tokens)
+        reference = reference or responses
+        scores = score_pairs([apply_fallback(r) for r in responses], golds)
+        rows.append({
+            "backend": backend,
+            "weights_MB": f"{model_memory_bytes(candidate) / 2 ** 20:.0f}",
+            "items/s": f"{len(items) / elapsed:.2f}",
+            "parity": f"{sum(a == b for a, b in zip(responses, reference))}/{len(items)}",
+            "hard_f1": f"{scores['hard_f1']:.4f}",
+            "soft_f1": f"{scores['soft_f1']:.4f}",
+        })
+        del candidate
+        gc.collect()
+    print_table(rows, ["backend", "weights_MB", "items/s", "parity", "hard_f1", "soft_f1"])
+    print(f"parity 为与 '{args.backends[0]}' 输出完全一致的条数；int8 的 weights_MB 中 embedding 仍为 bf16，其余为 int8 权重 + fp32 norm")
+    return rows
+
+
+def bench_probe(args, model, tokenizer, items):
+    """
+    prefill 探针 (prefill_probe.py) 开/关：实际执行的解码 (行, 步) 数、吞吐与得分。
+    generate 行是生产环境的 model.generate 贪心解码，F1 变化相对它计算；no_probe 行用探针的解码循环但不跳过，
+    它与 generate 的 parity 说明解码循环本身没有改变输出，省下的解码步数则是 probe 相对 no_probe 的差。
+    """
+    from cascade_classifier import short_circuit_output
+    from inference_utils import apply_fallback, generate_responses
+    from prefill_probe import PrefillProbe, generate_with_probe, probe_path
+    from prompts import render_prompt
+
+    probe = PrefillProbe.load(probe_path(args.tiny), hidden_size=model.config.hidden_size)
+    golds = [item['output'] for item in items]
+
+    def run_generate():
+        responses = generate_responses(model, tokenizer, [item['content'] for item in items], probe.prompt_name,
+                                       batch_size=args.batch_size, max_new_tokens=args.max_new_tokens)
+        return [apply_fallback(r) for r in responses], None, 0
+
+    def run(use_probe):
+        responses, row_steps, skipped = [], 0, 0
+        for start in range(0, len(items), args.batch_size):
+            batch = items[start:start + args.batch_size]
+            prompts = [render_prompt(tokenizer, item['content'], probe.prompt_name) for item in batch]
+            inputs = tokenizer(prompts, return_tensors="pt", padding=True).to(model.device)
+            outs, stats = generate_with_probe(model, tokenizer, inputs, probe if use_probe else None,
+                                              args.max_new_tokens)
+            responses.extend(short_circuit_output(item['content']) if out is None else apply_fallback(out)
+                             for item, out in zip(batch, outs))
+            row_steps += stats["row_steps"]
+            skipped += stats["skipped"]
+        return responses, row_steps, skipped
+
+    rows, outputs = [], {}
+    for name, fn in (("generate", run_generate), ("no_probe", lambda: run(False)), ("probe", lambda: run(True))):
+        (responses, row_steps, skipped), sec = timed(fn)
+        outputs[name] = responses
+        scores = score_pairs(responses, golds)
+        rows.append({"mode": name, "skipped": skipped, "decode_row_steps": "-" if row_steps is None else row_steps,
+                     "items/s": f"{len(items) / sec:.2f}", "avg_f1": scores['avg_f1'],
+                     "parity": f"{sum(a == b for a, b in zip(responses, outputs['generate']))}/{len(items)}"})
+    saved = 1 - rows[2]["decode_row_steps"] / max(1, rows[1]["decode_row_steps"])
+    f1_delta = rows[2]["avg_f1"] - rows[0]["avg_f1"]
+    for row in rows:
+        row["avg_f1"] = f"{row['avg_f1']:.4f}"
+    print_table(rows, ["mode", "skipped", "decode_row_steps", "items/s", "avg_f1", "parity"])
+    print("parity 为与 model.generate 输出完全一致的条数")
+    print(f"探针阈值 {probe.threshold}：省去 {saved:.1%} 的解码步，avg F1 相对 model.generate 变化 {f1_delta:+.4f}")
+    return rows
+
+
+BENCHMARKS = {
+    "prompts": bench_prompts,
+    "fewshot": bench_fewshot,
+    "labels": bench_labels,
+    "static": bench_static,
+    "vocab": bench_vocab,
+    "stream": bench_stream,
+    "long": bench_long,
+    "backends": bench_backends,
+    "probe": bench_probe,
+}
+# 这些基准自行加载模型，main 中不再预先加载
+SELF_LOADING = {"backends"}
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="推理基准测试")
+    parser.add_argument("bench", choices=sorted(BENCHMARKS), help="要运行的基准")
+    parser.add_argument("--gold", default=GOLD_FILE_PATH, help="带 output 字段的标注文件")
+    parser.add_argument("--limit", type=int, default=50, help="评测样本数")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--max-new-tokens", type=int, default=256)
+    parser.add_argument("--backend", default="4bit", help="真实模型的加载方式，见 inference_utils.load_model")
+    parser.add_argument("--tiny", action="store_true", help="使用随机初始化的微型替身模型 (CPU)")
+    parser.add_argument("--prompts", nargs="*", help="只比较这些 prompt (默认全部)")
+    parser.add_argument("--fewshot-k", type=int, default=6, help="检索式 few-shot 的候选数")
+    parser.add_argument("--fewshot-budget", type=int, default=600, help="检索样例的 token 预算")
+    parser.add_argument("--backends", nargs="+", default=["bf16", "int8"], help="backends 基准要比较的后端")
+    parser.add_argument("--long-budget", type=int, default=256, help="超过该 token 数的评论走分块模式")
+    return parser
+
+
+def main():
+    args = build_arg_parser().parse_args()
+    items = load_eval_items(args.gold, args.limit)
+    print(f"评测样本 {len(items)} 条，来自 '{args.gold}'。")
+    if args.bench in SELF_LOADING:
+        from inference_utils import load_tokenizer
+
+        model, tokenizer = None, load_tokenizer()
+    else:
+        model, tokenizer = setup_model(args)
+    BENCHMARKS[args.bench](args, model, tokenizer, items)
+
+
+if __name__ == "__main__":
+    main()
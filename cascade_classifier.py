@@ -0,0 +1,159 @@
+# cascade_classifier.py
+# 两级级联的第一级：CPU 上的 hate / non-hate 快速分类器。
+# 字符 n-gram 哈希特征 (ngram_features.py) + 逻辑回归，权重只是一个 float32 数组，存成 .npz；
+# 预测是一次稀疏矩阵乘法。模型很有把握判为 non-hate 的评论直接输出 non-hate 四元组，其余才交给 Qwen。
+# 阈值在验证集上用本地评测 (scorer.py) 调：在得分下降不超过 MAX_F1_DROP 的前提下，尽量多地省掉 LLM 调用。
+# 用法:
+#   python cascade_classifier.py train                       # 训练 + 调阈值 (LLM 部分按标准答案计，即只衡量级联本身的损失)
+#   python cascade_classifier.py train --llm-preds xxx.txt   # 用真实 LLM 在验证集上的输出调阈值
+import argparse
+import json
+import re
+
+import numpy as np
+
+from data_split import split_train_validation
+from ngram_features import NGRAM_RANGE, texts_to_csr
+from scorer import load_predictions, parse_quadruplets, score_pairs
+
+TRAIN_FILE_PATH = "./train.json"
+MODEL_PATH = "./cascade_model.npz"
+N_FEATURES = 2 ** 18
+L2_REG = 1e-4
+LEARNING_RATE = 0.5
+EPOCHS = 300
+MAX_F1_DROP = 0.005
+THRESHOLD_GRID = [0.01, 0.02, 0.03, 0.05, 0.08, 0.1, 0.15, 0.2, 0.25, 0.3]
+
+
+def is_hate(output: str) -> int:
+    return int(any(q[3] == 'hate' for q in parse_quadruplets(output)))
+
+
+def short_circuit_output(content: str) -> str:
+    """
+    一级分类器判定为 non-hate 时的输出：评论对象 NULL，论点取整条评论 (为软匹配保留得分机会)。
+    提交文件一条一行，所以空白 (含换行) 折叠为单个空格，去掉评论中字面的 [SEP] / [END]，'|' 换成全角。
+    """
+    argument = re.sub(r'\[(SEP|END)\]', ' ', content, flags=re.IGNORECASE)
+    argument = re.sub(r'\s+', ' ', argument.replace('|', '｜')).strip() or "NULL"
+    return f"NULL | {argument} | non-hate | non-hate [END]"
+
+
+def featurize(contents):
+    """计数 -> log(1+tf) -> 行 L2 归一化。"""
+    X = texts_to_csr(contents, NGRAM_RANGE, N_FEATURES)
+    X.data = np.log1p(X.data)
+    norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    X.data /= np.repeat(norms, np.diff(X.indptr)).astype(X.data.dtype)
+    return X
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -30, 30)))
+
+
+class CascadeClassifier:
+    def __init__(self, weights, bias: float, threshold: float):
+        self.weights = weights
+        self.bias = bias
+        self.threshold = threshold
+
+    @classmethod
+    def train(cls, contents, labels, epochs: int = EPOCHS):
+        """全批量梯度下降训练带 L2 正则的逻辑回归 (每步两次稀疏矩阵乘法)。"""
+        X = featurize(contents)
+        y = np.asarray(labels, dtype=np.float32)
+        w = np.zeros(N_FEATURES, dtype=np.float32)
+        b = 0.0
+        n = len(y)
+        for epoch in range(epochs):
+            p = _sigmoid(X @ w + b)
+            err = (p - y).astype(np.float32)
+            w -= LEARNING_RATE * (X.T @ err / n + L2_REG * w)
+            b -= LEARNING_RATE * float(err.mean())
+            if epoch % 50 == 0 or epoch == epochs - 1:
+                loss = -np.mean(y * np.log(p + 1e-9) + (1 - y) * np.log(1 - p + 1e-9))
+                print(f"  epoch {epoch:>4} loss {loss:.4f}")
+        return cls(w, b, threshold=0.0)
+
+    def predict_hate_proba(self, contents) -> np.ndarray:
+        """批量预测，返回每条评论为 hate 的概率。"""
+        return _sigmoid(featurize(contents) @ self.weights + self.bias)
+
+    def skip_mask(self, contents) -> np.ndarray:
+        """True 表示该条可以跳过 LLM，直接输出 non-hate。"""
+        return self.predict_hate_proba(contents) < self.threshold
+
+    def save(self, path: str = MODEL_PATH):
+        np.savez_compressed(path, weights=self.weights, bias=np.float32(self.bias),
+                            threshold=np.float32(self.threshold), n_features=N_FEATURES)
+
+    @classmethod
+    def load(cls, path: str = MODEL_PATH):
+        data = np.load(path)
+        if int(data['n_features']) != N_FEATURES:
+            raise ValueError(f"'{path}' 的特征维度与当前配置不一致，请重新训练")
+        return cls(data['weights'], float(data['bias']), float(data['threshold']))
+
+
+def validation_llm_outputs(val, llm_preds_path: str = None):
+    """调阈值用的 LLM 验证集输出；没有提供预测文件时退回标准答案，并醒目地警告。"""
+    if llm_preds_path:
+        preds = load_predictions(llm_preds_path)
+        return [preds.get(str(item['id']), "") for item in val]
+    print("!" * 60)
+    print("警告: 未提供 --llm-preds，LLM 部分按标准答案计 (基线 F1 = 1.0)。")
+    print("这样选出的阈值只衡量级联本身的损失，与真实 LLM 的表现不符，正式使用前请用真实预测重新调阈值。")
+    print("!" * 60)
+    return [item['output'] for item in val]
+
+
+def tune_threshold(probs, items, llm_outputs, saved_label: str = "省去LLM"):
+    """
+    在验证集上扫描阈值：probs (hate 概率或其它"越低越有把握是 non-hate"的分数) 低于阈值的条目
+    用 short_circuit_output 代替 llm_outputs。返回 (选中的阈值, 每个阈值的结果列表)。
+    """
+    golds = [item['output'] for item in items]
+    base = score_pairs(llm_outputs, golds)['avg_f1']
+    rows = []
+    best = 0.0
+    print(f"{'阈值':<8}{saved_label:>10}{'avg F1':>10}{'下降':>10}{'漏掉hate':>10}")
+    for t in THRESHOLD_GRID:
+        skip = probs < t
+        preds = [short_circuit_output(item['content']) if s else out
+                 for item, s, out in zip(items, skip, llm_outputs)]
+        f1 = score_pairs(preds, golds)['avg_f1']
+        missed = sum(1 for item, s in zip(items, skip) if s and is_hate(item['output']))
+        rows.append({"threshold": t, "saved": float(skip.mean()), "avg_f1": f1, "drop": base - f1, "missed_hate": missed})
+        print(f"{t:<8}{skip.mean():>10.2%}{f1:>10.4f}{base - f1:>10.4f}{missed:>10}")
+        if base - f1 <= MAX_F1_DROP:
+            best = t
+    print(f"选定阈值 {best} (F1 下降上限 {MAX_F1_DROP})")
+    return best, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="级联第一级 hate/non-hate 分类器")
+    parser.add_argument("command", choices=["train"])
+    parser.add_argument("--train-file", default=TRAIN_FILE_PATH)
+    parser.add_argument("--llm-preds", help="LLM 在验证集上的预测文件 (id 输出 格式)；缺省时按标准答案计")
+    args = parser.parse_args()
+
+    with open(args.train_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    train, val = split_train_validation(data)
+    print(f"训练 {len(train)} 条，验证 {len(val)} 条")
+
+    clf = CascadeClassifier.train([i['content'] for i in train], [is_hate(i['output']) for i in train])
+    probs = clf.predict_hate_proba([i['content'] for i in val])
+
+    llm_outputs = validation_llm_outputs(val, args.llm_preds)
+    clf.threshold, _ = tune_threshold(probs, val, llm_outputs)
+    clf.save()
+    print(f"模型已保存到 '{MODEL_PATH}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+# compare_runs.py
+# 多次运行结果的并行对比：仓库里有很多互相竞争的输出 (submission1.txt、retried1.txt、vesion3.txt、end2.txt ...)，
+# 以前只能肉眼比较。这里标准答案只读取/索引一次，通过进程池的 initializer 分发给各进程，N 个预测文件并行评分：
+#   - 每个文件的 hard / soft / avg F1
+#   - 每个标签的混淆矩阵 (是否仇恨、目标群体；按条目级标签统计，行为标准答案，列为预测)
+#   - 各文件两两之间的逐条分歧率，以及分歧条目明细表 (TSV)
+#   - 逐条选出"最佳来源"拼成集成结果：不依赖标准答案的共识选择 (与其它文件平均相似度最高的输出)，
+#     有标准答案时同时给出逐条取最优的理论上限
+# 用法:
+#   python compare_runs.py --gold val.json submission1.txt retried1.txt vesion3.txt
+#   python compare_runs.py --ids test1.json submission1.txt newnew_end1.txt    # 无标准答案，只比较分歧并集成
+import argparse
+import json
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+
+from scorer import (count_matches, f1_from_counts, is_hard_match, is_soft_match, load_predictions,
+                    parse_quadruplets, similarity)
+
+DISAGREEMENT_FILE = "./compare_disagreements.tsv"
+ENSEMBLE_FILE = "./ensemble_submission.txt"
+HATEFUL_LABELS = ["hate", "non-hate"]
+GROUP_LABELS = ["LGBTQ", "Racism", "Region", "Sexism", "others", "non-hate", "multi", "invalid"]
+ITEM_CHUNK = 500
+
+# 进程池中每个进程各持有一份，由 _init_worker 设置
+_IDS = None
+_GOLD = None
+
+
+def _init_worker(ids, gold):
+    global _IDS, _GOLD
+    _IDS, _GOLD = ids, gold
+
+
+def normalize_output(text: str) -> str:
+    """解析后重新拼接，消除空白/大小写 [END] 等无关差异，便于比较不同文件的输出是否一致。"""
+    quads = parse_quadruplets(text or "")
+    return ' [SEP] '.join(' | '.join(q) for q in quads) + ' [END]' if quads else ""
+
+
+def item_labels(quads):
+    """条目级标签：(是否仇恨, 目标群体)。多个不同群体记为 multi，无法解析记为 invalid。"""
+    if not quads:
+        return "non-hate", "invalid"
+    hateful = "hate" if any(q[3] == "hate" for q in quads) else "non-hate"
+    groups = {g.strip() for q in quads for g in q[2].split(',')}
+    if len(groups) > 1:
+        return hateful, "multi"
+    group = groups.pop()
+    return hateful, group if group in GROUP_LABELS else "invalid"
+
+
+def item_score(pred_quads, gold_quads) -> float:
+    hard = f1_from_counts(count_matches(pred_quads, gold_quads, is_hard_match), len(pred_quads), len(gold_quads))
+    soft = f1_from_counts(count_matches(pred_quads, gold_quads, is_soft_match), len(pred_quads), len(gold_quads))
+    return (hard + soft) / 2
+
+
+def score_run(path: str):
+    """在子进程中对一个预测文件评分，返回汇总结果和逐条规范化输出。"""
+    preds = load_predictions(path, _IDS)
+    outputs = [normalize_output(preds.get(i, "")) for i in _IDS]
+    result = {"path": path, "outputs": outputs, "coverage": sum(1 for i in _IDS if i in preds)}
+    if _GOLD is None:
+        return result
+
+    hard_tp = soft_tp = n_pred = n_gold = 0
+    hateful_cm, group_cm, per_item = Counter(), Counter(), []
+    for item_id, output in zip(_IDS, outputs):
+        pred_quads, gold_quads = parse_quadruplets(output), parse_quadruplets(_GOLD[item_id])
+        n_pred += len(pred_quads)
+        n_gold += len(gold_quads)
+        hard_tp += count_matches(pred_quads, gold_quads, is_hard_match)
+        soft_tp += count_matches(pred_quads, gold_quads, is_soft_match)
+        (gold_h, gold_g), (pred_h, pred_g) = item_labels(gold_quads), item_labels(pred_quads)
+        hateful_cm[(gold_h, pred_h)] += 1
+        group_cm[(gold_g, pred_g)] += 1
+        per_item.append(item_score(pred_quads, gold_quads))
+    hard_f1, soft_f1 = f1_from_counts(hard_tp, n_pred, n_gold), f1_from_counts(soft_tp, n_pred, n_gold)
+    result.update({
+        "hard_f1": hard_f1,
+        "soft_f1": soft_f1,
+        "avg_f1": (hard_f1 + soft_f1) / 2,
+        "hateful_cm": dict(hateful_cm),
+        "group_cm": dict(group_cm),
+        "per_item": per_item,
+    })
+    return result
+
+
+def _output_similarity(a: str, b: str) -> float:
+    if a == b:
+        return 1.0
+    qa, qb = parse_quadruplets(a), parse_quadruplets(b)
+    if not qa or not qb:
+        return 0.0
+    return 2 * count_matches(qa, qb, is_soft_match) / (len(qa) + len(qb)) * 0.5 + similarity(a, b) * 0.5
+
+
+def consensus_chunk(candidates_chunk):
+    """candidates_chunk: [[各文件的输出], ...]。每条选与其它文件平均相似度最高的来源下标 (相同时取靠前的文件)。"""
+    picks = []
+    for candidates in candidates_chunk:
+        n = len(candidates)
+        scores = [0.0] * n
+        for a, b in combinations(range(n), 2):
+            s = _output_similarity(candidates[a], candidates[b])
+            scores[a] += s
+            scores[b] += s
+        # 空输出不参与选择
+        best = max(range(n), key=lambda k: (bool(candidates[k]), scores[k], -k))
+        picks.append(best)
+    return picks
+
+
+def print_confusion(name: str, cm: dict, labels):
+    present = [l for l in labels if any(k[0] == l or k[1] == l for k in cm)]
+    width = max(8, *(len(l) for l in present)) + 1
+    print(f"  {name} (行: 标准答案, 列: 预测)")
+    print("  " + " " * width + "".join(l.rjust(width) for l in present))
+    for g in present:
+        print("  " + g.ljust(width) + "".join(str(cm.get((g, p), 0)).rjust(width) for p in present))
+
+
+def write_disagreements(path, ids, runs, gold):
+    names = [os.path.basename(r["path"]) for r in runs]
+    n = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("\t".join(["id", "n_distinct"] + (["gold"] if gold else []) + names) + "\n")
+        for i, item_id in enumerate(ids):
+            outputs = [r["outputs"][i] for r in runs]
+            distinct = len(set(outputs))
+            if distinct > 1:
+                n += 1
+                f.write("\t".join([item_id, str(distinct)] + ([gold[item_id]] if gold else []) + outputs) + "\n")
+    return n
+
+
+def compare(paths, ids, gold=None, workers=None, disagreement_path=DISAGREEMENT_FILE, ensemble_path=ENSEMBLE_FILE):
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(ids, gold)) as pool:
+        runs = list(pool.map(score_run, paths))
+        candidates = [[r["outputs"][i] for r in runs] for i in range(len(ids))]
+        chunks = [candidates[s:s + ITEM_CHUNK] for s in range(0, len(candidates), ITEM_CHUNK)]
+        picks = [p for chunk in pool.map(consensus_chunk, chunks) for p in chunk]
+
+    names = [os.path.basename(p) for p in paths]
+    print(f"\n共 {len(ids)} 条，{len(paths)} 个文件")
+    for name, r in zip(names, runs):
+        line = f"  {name:<22} 覆盖 {r['coverage']:>6}"
+        if gold is not None:
+            line += f" | hard F1 {r['hard_f1']:.4f} | soft F1 {r['soft_f1']:.4f} | avg {r['avg_f1']:.4f}"
+        print(line)
+
+    if gold is not None:
+        for name, r in zip(names, runs):
+            print(f"\n[{name}]")
+            print_confusion("是否仇恨", r["hateful_cm"], HATEFUL_LABELS)
+            print_confusion("目标群体", r["group_cm"], GROUP_LABELS)
+
+    print("\n两两逐条分歧率:")
+    width = max(len(n) for n in names) + 2
+    print(" " * width + "".join(n[:width - 2].rjust(width) for n in names))
+    for a, ra in zip(names, runs):
+        row = [sum(x != y for x, y in zip(ra["outputs"], rb["outputs"])) / max(1, len(ids)) for rb in runs]
+        print(a.ljust(width) + "".join(f"{v:.1%}".rjust(width) for v in row))
+    n_disagree = write_disagreements(disagreement_path, ids, runs, gold)
+    print(f"至少两个文件输出不同的条目 {n_disagree} 条，明细已写入 '{disagreement_path}'")
+
+    ensemble = [runs[k]["outputs"][i] or "NULL | NULL | non-hate | non-hate [END]" for i, k in enumerate(picks)]
+    with open(ensemble_path, 'w', encoding='utf-8') as f:
+        for item_id, output in zip(ids, ensemble):
+            f.write(f"{item_id} {output}\n")
+    source_counts = Counter(names[k] for k in picks)
+    print(f"\n共识集成结果已写入 '{ensemble_path}'，各来源被选中次数: "
+          + ", ".join(f"{n} {c}" for n, c in source_counts.most_common()))
+    if gold is not None:
+        from scorer import format_scores, score_pairs
+
+        print(f"  共识集成: {format_scores(score_pairs(ensemble, [gold[i] for i in ids]))}")
+        oracle = [max(range(len(runs)), key=lambda k: runs[k]["per_item"][i]) for i in range(len(ids))]
+        oracle_outputs = [runs[k]["outputs"][i] for i, k in enumerate(oracle)]
+        print(f"  逐条最优 (理论上限): {format_scores(score_pairs(oracle_outputs, [gold[i] for i in ids]))}")
+    return runs, picks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多个预测文件并行对比与逐条集成")
+    parser.add_argument("runs", nargs="+", help="预测文件 (id 输出 格式或逐行对齐格式)")
+    parser.add_argument("--gold", help="带 output 字段的标注 json；提供时计算 F1 与混淆矩阵")
+    parser.add_argument("--ids", help="无标准答案时用于确定ID顺序的测试集 json")
+    parser.add_argument("--workers", type=int, default=None, help="进程数 (默认 CPU 核数)")
+    parser.add_argument("--disagreements", default=DISAGREEMENT_FILE)
+    parser.add_argument("--ensemble", default=ENSEMBLE_FILE)
+    args = parser.parse_args()
+
+    if not args.gold and not args.ids:
+        parser.error("需要 --gold 或 --ids 之一来确定ID顺序")
+    with open(args.gold or args.ids, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    ids = [str(item['id']) for item in data]
+    gold = {str(item['id']): item['output'] for item in data} if args.gold else None
+    compare(args.runs, ids, gold, args.workers, args.disagreements, args.ensemble)
+
+
+if __name__ == "__main__":
+    main()
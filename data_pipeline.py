@@ -0,0 +1,39 @@
+# data_pipeline.py
+# 训练数据准备的公共部分：不经过 pandas，直接把 train.json 读进 Arrow，
+# 按ID哈希做确定性的训练/验证划分，所有变换都用可 pickle 的顶层函数/类做 batched + 多进程 map，
+# 这样 datasets 的指纹缓存可以生效，输入不变时重跑几乎是瞬间完成。
+import os
+
+from datasets import load_dataset
+
+from data_split import VALIDATION_PERCENT, id_bucket
+
+TRAIN_FILE_PATH = "train.json"
+NUM_PROC = max(1, min(8, (os.cpu_count() or 1) - 1))
+MAP_BATCH_SIZE = 1000
+
+
+def load_train_arrow(path: str = TRAIN_FILE_PATH):
+    """用 datasets 的 json 构建器直接把文件读成 Arrow 表 (结果缓存在 HF 缓存目录)。"""
+    return load_dataset("json", data_files=path, split="train")
+
+
+def in_validation(batch, validation_percent: int = VALIDATION_PERCENT):
+    return [id_bucket(i) < validation_percent for i in batch['id']]
+
+
+def in_train(batch, validation_percent: int = VALIDATION_PERCENT):
+    return [id_bucket(i) >= validation_percent for i in batch['id']]
+
+
+def split_by_id_hash(dataset, validation_percent: int = VALIDATION_PERCENT, num_proc: int = NUM_PROC):
+    """按ID哈希确定性地划分训练/验证集。"""
+    kwargs = dict(batched=True, batch_size=MAP_BATCH_SIZE, num_proc=num_proc,
+                  fn_kwargs={"validation_percent": validation_percent})
+    return dataset.filter(in_train, **kwargs), dataset.filter(in_validation, **kwargs)
+
+
+def batched_map(dataset, function, desc: str = None, num_proc: int = NUM_PROC, remove_columns=None):
+    """统一的 batched + 多进程 map。function 必须可 pickle (顶层函数或实现了 __getstate__ 的类实例)。"""
+    return dataset.map(function, batched=True, batch_size=MAP_BATCH_SIZE, num_proc=num_proc,
+                       desc=desc, remove_columns=remove_columns)
@@ -0,0 +1,34 @@
+# data_split.py
+# 按ID哈希的确定性训练/验证划分。只依赖标准库 (复现适配器旧划分时才导入 sklearn)，datasets 流水线 (data_pipeline.py) 与
+# 直接读 json 列表的脚本 (cascade_classifier.py、prefill_probe.py、distill.py) 共用同一份定义，划分不会各自漂移。
+import zlib
+
+VALIDATION_PERCENT = 10
+# 现有的 LoRA 适配器 (qwen-hf-sft-output/final_adapter) 是用旧版 prepare_data_hf.py 训练的，
+# 那一版用 sklearn 的 train_test_split(test_size=0.1, random_state=42) 随机划分，与ID哈希划分不同
+ADAPTER_VALIDATION_SIZE = 0.1
+ADAPTER_SPLIT_SEED = 42
+
+
+def id_bucket(item_id) -> int:
+    """ID -> [0, 100) 的稳定桶号；新增数据不会改变已有样本的划分。"""
+    return zlib.crc32(str(item_id).encode('utf-8')) % 100
+
+
+def split_train_validation(data, validation_percent: int = VALIDATION_PERCENT):
+    """data: [{'id', ...}, ...]，返回 (训练, 验证) 两个列表，保持原顺序。"""
+    is_val = [id_bucket(item['id']) < validation_percent for item in data]
+    train = [item for item, v in zip(data, is_val) if not v]
+    val = [item for item, v in zip(data, is_val) if v]
+    return train, val
+
+
+def adapter_heldout_split(data, test_size: float = ADAPTER_VALIDATION_SIZE, seed: int = ADAPTER_SPLIT_SEED):
+    """
+    复现旧版 prepare_data_hf.py 的随机划分，返回 (适配器训练过的, 适配器训练时留出的)，各自保持原顺序。
+    划分只取决于条数和随机种子，所以对下标列表划分与当时对 DataFrame 划分结果相同。
+    """
+    from sklearn.model_selection import train_test_split
+
+    train_idx, val_idx = train_test_split(list(range(len(data))), test_size=test_size, random_state=seed)
+    return [data[i] for i in sorted(train_idx)], [data[i] for i in sorted(val_idx)]
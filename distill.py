@@ -0,0 +1,246 @@
+# distill.py
+# 知识蒸馏：用微调后的 Qwen+LoRA (教师) 给无标注评论打四元组伪标签并缓存，
+# 再和 train.json 的人工标注一起训练一个小得多的学生模型 (如 Qwen1.5-0.5B-Chat)，用于 CPU 上的大批量回填。
+# 用法:
+#   python distill.py teacher --unlabeled test1.json test2.json   # 教师推理，结果缓存到 distill_cache/
+#   python distill.py train                                       # 训练学生模型
+#   python distill.py report                                      # 教师/学生 吞吐量与 hard/soft F1 对比
+#   python distill.py all --tiny --limit 16                       # CPU 上用微型配置端到端跑通全部流程
+import argparse
+import json
+import os
+import time
+
+import torch
+
+from inference_utils import (BASE_MODEL_PATH, apply_fallback, generate_responses, load_model,
+                             load_tiny_model, load_tokenizer)
+from scorer import format_scores, parse_quadruplets, score_pairs
+
+TRAIN_FILE_PATH = "./train.json"
+CACHE_DIR = "./distill_cache"
+TEACHER_OUTPUTS = os.path.join(CACHE_DIR, "teacher_outputs.jsonl")
+STUDENT_MODEL_PATH = "/root/autodl-tmp/Qwen1.5-0.5B-Chat"
+STUDENT_OUTPUT_DIR = "./qwen-distilled-student"
+# --tiny 的随机模型输出不能混进真实的教师缓存/学生模型，单独使用 tiny- 前缀的路径
+TINY_TEACHER_OUTPUTS = os.path.join(CACHE_DIR, "tiny-teacher_outputs.jsonl")
+TINY_STUDENT_OUTPUT_DIR = "./tiny-qwen-distilled-student"
+# 教师与学生都是微调过的模型，推理时使用与训练一致的短指令
+PROMPT_NAME = "compact_v1"
+
+LEARNING_RATE = 5e-5
+EPOCHS = 2
+BATCH_SIZE = 8
+MAX_LENGTH = 512
+
+
+def load_teacher(args, tokenizer):
+    if args.tiny:
+        return load_tiny_model(tokenizer, seed=0)
+    return load_model(backend=args.backend)
+
+
+def teacher_outputs_path(args) -> str:
+    return TINY_TEACHER_OUTPUTS if args.tiny else TEACHER_OUTPUTS
+
+
+def student_output_dir(args) -> str:
+    return TINY_STUDENT_OUTPUT_DIR if args.tiny else STUDENT_OUTPUT_DIR
+
+
+def load_cached_teacher_outputs(path: str = TEACHER_OUTPUTS):
+    outputs = {}
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                outputs[str(record['id'])] = record
+    return outputs
+
+
+def run_teacher(args, tokenizer):
+    """对无标注评论做教师推理，按 (文件, id) 追加写入缓存，已缓存的条目跳过，可随时中断续跑。"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    cached = load_cached_teacher_outputs(teacher_outputs_path(args))
+    pending = []
+    for path in args.unlabeled:
+        with open(path, 'r', encoding='utf-8') as f:
+            items = json.load(f)
+        for item in items[:args.limit] if args.limit else items:
+            key = f"{os.path.basename(path)}:{item['id']}"
+            if key not in cached:
+                pending.append((key, item['content']))
+    print(f"教师缓存已有 {len(cached)} 条，待推理 {len(pending)} 条。")
+    if not pending:
+        return
+
+    teacher = load_teacher(args, tokenizer)
+    with open(teacher_outputs_path(args), 'a', encoding='utf-8') as out_f:
+        for start in range(0, len(pending), args.batch_size):
+            batch = pending[start:start + args.batch_size]
+            responses = generate_responses(teacher, tokenizer, [c for _, c in batch], PROMPT_NAME,
+                                           batch_size=args.batch_size, max_new_tokens=args.max_new_tokens)
+            for (key, content), response in zip(batch, responses):
+                out_f.write(json.dumps({"id": key, "content": content, "output": response}, ensure_ascii=False) + '\n')
+            out_f.flush()
+    del teacher
+
+
+def split_gold(limit: int = 0, heldout: str = "adapter"):
+    """
+    划分 train.json，返回 (训练, 验证)。
+    adapter: 复现现有适配器训练时的随机划分，验证集是教师没训练过的条目，教师 F1 不会虚高；
+    id-hash: 与 data_pipeline.py 一致的ID哈希划分 (适配器用当前 prepare_data_hf.py 重新训练过时使用)。
+    """
+    from data_split import adapter_heldout_split, split_train_validation
+
+    with open(TRAIN_FILE_PATH, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    train, val = adapter_heldout_split(data) if heldout == "adapter" else split_train_validation(data)
+    if limit:
+        train, val = train[:limit], val[:limit]
+    return train, val
+
+
+def build_student_examples(tokenizer, gold_items, teacher_path: str = TEACHER_OUTPUTS):
+    """人工标注 + 可解析的教师伪标签，按 Qwen 模板分词，只对 assistant 部分计算 loss。"""
+    from prepare_data_hf import build_chat_messages
+    from sft_packing import tokenize_chat_example
+
+    records = list(gold_items)
+    pseudo = [r for r in load_cached_teacher_outputs(teacher_path).values() if parse_quadruplets(r['output'])]
+    print(f"学生训练数据：人工标注 {len(records)} 条 + 教师伪标签 {len(pseudo)} 条")
+    records.extend(pseudo)
+    return [tokenize_chat_example(tokenizer, build_chat_messages(r), MAX_LENGTH) for r in records]
+
+
+def build_student(args, tokenizer):
+    if args.tiny:
+        # 比教师更小的随机初始化配置，仅用于 CPU 流程验证
+        from transformers import Qwen2Config, Qwen2ForCausalLM
+
+        torch.manual_seed(1)
+        return Qwen2ForCausalLM(Qwen2Config(
+            vocab_size=len(tokenizer), hidden_size=32, intermediate_size=64, num_hidden_layers=1,
+            num_attention_heads=2, num_key_value_heads=1, max_position_embeddings=2048,
+            pad_token_id=tokenizer.pad_token_id, eos_token_id=tokenizer.eos_token_id))
+    from transformers import AutoModelForCausalLM
+
+    return AutoModelForCausalLM.from_pretrained(
+        STUDENT_MODEL_PATH,
+        torch_dtype=torch.bfloat16 if torch.cuda.is_available() else torch.float32,
+        trust_remote_code=True
+    )
+
+
+def _collate(batch, pad_token_id):
+    from sft_packing import IGNORE_INDEX
+
+    max_len = max(len(ex['input_ids']) for ex in batch)
+    input_ids = torch.full((len(batch), max_len), pad_token_id, dtype=torch.long)
+    labels = torch.full((len(batch), max_len), IGNORE_INDEX, dtype=torch.long)
+    attention_mask = torch.zeros((len(batch), max_len), dtype=torch.long)
+    for i, ex in enumerate(batch):
+        n = len(ex['input_ids'])
+        input_ids[i, :n] = torch.tensor(ex['input_ids'])
+        labels[i, :n] = torch.tensor(ex['labels'])
+        attention_mask[i, :n] = 1
+    return {"input_ids": input_ids, "labels": labels, "attention_mask": attention_mask}
+
+
+def train_student(args, tokenizer):
+    from sft_packing import length_grouped_batches
+
+    train_items, _ = split_gold(args.limit, args.heldout)
+    examples = build_student_examples(tokenizer, train_items, teacher_outputs_path(args))
+    student = build_student(args, tokenizer)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    student.to(device)
+    student.train()
+    optimizer = torch.optim.AdamW(student.parameters(), lr=LEARNING_RATE)
+
+    lengths = [len(ex['input_ids']) for ex in examples]
+    for epoch in range(args.epochs):
+        batches = length_grouped_batches(lengths, args.batch_size, seed=epoch)
+        total_loss = 0.0
+        for step, batch_idx in enumerate(batches):
+            inputs = {k: v.to(device) for k, v in _collate([examples[i] for i in batch_idx], tokenizer.pad_token_id).items()}
+            loss = student(**inputs).loss
+            loss.backward()
+            optimizer.step()
+            optimizer.zero_grad()
+            total_loss += loss.item()
+            if step % 50 == 0:
+                print(f"  epoch {epoch} step {step}/{len(batches)} loss {loss.item():.4f}")
+        print(f"epoch {epoch} 平均 loss {total_loss / max(1, len(batches)):.4f}")
+
+    output_dir = student_output_dir(args)
+    student.save_pretrained(output_dir)
+    tokenizer.save_pretrained(output_dir)
+    print(f"学生模型已保存到 '{output_dir}'")
+
+
+def evaluate(model, tokenizer, items, args):
+    contents = [item['content'] for item in items]
+    start = time.perf_counter()
+    responses = generate_responses(model, tokenizer, contents, PROMPT_NAME,
+                                   batch_size=args.batch_size, max_new_tokens=args.max_new_tokens)
+    elapsed = time.perf_counter() - start
+    scores = score_pairs([apply_fallback(r) for r in responses], [item['output'] for item in items])
+    scores["items_per_sec"] = len(items) / elapsed
+    return scores
+
+
+def report(args, tokenizer):
+    from transformers import AutoModelForCausalLM
+
+    _, val_items = split_gold(args.limit, args.heldout)
+    rows = {}
+    teacher = load_teacher(args, tokenizer)
+    rows["teacher"] = evaluate(teacher, tokenizer, val_items, args)
+    del teacher
+    student = AutoModelForCausalLM.from_pretrained(student_output_dir(args), trust_remote_code=True)
+    student.to("cuda" if torch.cuda.is_available() else "cpu").eval()
+    rows["student"] = evaluate(student, tokenizer, val_items, args)
+
+    if args.heldout == "adapter":
+        print(f"\n验证集 {len(val_items)} 条 (现有适配器训练时留出的部分，教师和学生都没有训练过):")
+    else:
+        print(f"\n验证集 {len(val_items)} 条 (ID哈希划分):")
+        print("注意: 如果适配器是用旧版 prepare_data_hf.py 的随机划分训练的，这些条目大多在教师的训练数据中，"
+              "教师 F1 和师生差距都会偏高；请改用 --heldout adapter")
+    for name, scores in rows.items():
+        print(f"  {name:<8} {scores['items_per_sec']:>8.2f} 条/秒 | {format_scores(scores)}")
+    speedup = rows["student"]["items_per_sec"] / rows["teacher"]["items_per_sec"]
+    print(f"学生相对教师吞吐提升 {speedup:.1f}x，avg F1 变化 {rows['student']['avg_f1'] - rows['teacher']['avg_f1']:+.4f}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Qwen+LoRA -> 小模型 知识蒸馏")
+    parser.add_argument("stage", choices=["teacher", "train", "report", "all"])
+    parser.add_argument("--unlabeled", nargs="+", default=["./test1.json", "./test2.json"], help="无标注评论文件")
+    parser.add_argument("--tiny", action="store_true", help="教师/学生都使用随机初始化的微型配置 (CPU 端到端测试)")
+    parser.add_argument("--limit", type=int, default=0, help="每个文件/划分最多取多少条 (0 表示全部)")
+    parser.add_argument("--backend", default="4bit")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--epochs", type=int, default=EPOCHS)
+    parser.add_argument("--max-new-tokens", type=int, default=256)
+    parser.add_argument("--heldout", choices=["adapter", "id-hash"], default="adapter",
+                        help="验证集划分：adapter 为现有适配器训练时留出的部分；id-hash 为 data_pipeline.py 的划分")
+    args = parser.parse_args()
+    if args.tiny:
+        args.max_new_tokens = min(args.max_new_tokens, 32)
+        args.epochs = min(args.epochs, 1)
+
+    tokenizer = load_tokenizer(BASE_MODEL_PATH)
+    if args.stage in ("teacher", "all"):
+        run_teacher(args, tokenizer)
+    if args.stage in ("train", "all"):
+        train_student(args, tokenizer)
+    if args.stage in ("report", "all"):
+        report(args, tokenizer)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+# fewshot_retriever.py
+# 检索式动态 few-shot：对 train.json 建一次字符 n-gram BM25 倒排索引 (CSR 矩阵，np.save 后以 mmap 方式加载)，
+# 推理时为每条评论检索最相似的已标注样本，在 token 预算内拼进 prompt (prompts.py 中的 retrieval_v1)。
+# 整个测试文件的批量检索只需要一次稀疏矩阵乘法: (n_query x V) @ (V x n_train)。
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from id_index import open_index
+from ngram_features import N_FEATURES, NGRAM_RANGE, hashed_counts, texts_to_csr
+from prompts import format_example, format_retrieval_prompt
+
+TRAIN_FILE_PATH = "./train.json"
+INDEX_DIR = "./fewshot_index"
+TOP_K = 6
+FEWSHOT_TOKEN_BUDGET = 600
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def build_index(train_path: str = TRAIN_FILE_PATH, index_dir: str = INDEX_DIR):
+    """从 train.json 构建 BM25 倒排索引并保存到 index_dir。"""
+    with open(train_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    n_docs = len(data)
+    print(f"为 {n_docs} 条训练样本构建字符 n-gram 索引...")
+
+    counts = texts_to_csr([item['content'] for item in data])
+    doc_len = np.asarray(counts.sum(axis=1)).ravel()
+    avgdl = doc_len.mean() if n_docs else 0.0
+    df = np.bincount(counts.indices, minlength=N_FEATURES)
+    idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+    # 把计数替换为 BM25 文档侧权重，查询时只需对命中的项求和
+    tf = counts.data
+    row_len = np.repeat(doc_len, np.diff(counts.indptr))
+    counts.data = (idf[counts.indices] * tf * (BM25_K1 + 1)
+                   / (tf + BM25_K1 * (1 - BM25_B + BM25_B * row_len / avgdl))).astype(np.float32)
+
+    # 转置成 V x n_docs 的倒排表 (每个 n-gram 一行)
+    postings = counts.T.tocsr()
+    postings.sort_indices()
+
+    os.makedirs(index_dir, exist_ok=True)
+    index_dtype = np.int32 if postings.nnz < 2 ** 31 else np.int64
+    np.save(os.path.join(index_dir, "postings_data.npy"), postings.data.astype(np.float32))
+    np.save(os.path.join(index_dir, "postings_indices.npy"), postings.indices.astype(index_dtype))
+    np.save(os.path.join(index_dir, "postings_indptr.npy"), postings.indptr.astype(index_dtype))
+    np.save(os.path.join(index_dir, "ids.npy"), np.array([int(item['id']) for item in data], dtype=np.int64))
+    stat = os.stat(train_path)
+    with open(os.path.join(index_dir, "meta.json"), 'w', encoding='utf-8') as f:
+        json.dump({
+            "source": os.path.abspath(train_path),
+            "source_size": stat.st_size,
+            "source_mtime_ns": stat.st_mtime_ns,
+            "n_docs": n_docs,
+            "n_features": N_FEATURES,
+            "ngram_range": list(NGRAM_RANGE),
+            "k1": BM25_K1,
+            "b": BM25_B,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"索引已保存到 '{index_dir}' (非零项 {postings.nnz})。")
+
+
+def count_tokens(tokenizer, text: str) -> int:
+    """没有分词器时按字符数估算 (中文约 1 字 1 token)。"""
+    if tokenizer is None:
+        return len(text)
+    return len(tokenizer(text, add_special_tokens=False)['input_ids'])
+
+
+def index_is_fresh(index_dir: str = INDEX_DIR, train_path: str = TRAIN_FILE_PATH) -> bool:
+    """索引存在，且记录的 train.json 大小/修改时间与当前文件一致 (与 id_index.py 相同的判断方式)。"""
+    meta_path = os.path.join(index_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    stat = os.stat(train_path)
+    return (meta.get("source_size") == stat.st_size and meta.get("source_mtime_ns") == stat.st_mtime_ns
+            and meta.get("n_features") == N_FEATURES and meta.get("ngram_range") == list(NGRAM_RANGE))
+
+
+class FewShotRetriever:
+    def __init__(self, index_dir: str = INDEX_DIR, train_path: str = TRAIN_FILE_PATH):
+        if not index_is_fresh(index_dir, train_path):
+            build_index(train_path, index_dir)
+        with open(os.path.join(index_dir, "meta.json"), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        load = lambda name: np.load(os.path.join(index_dir, name), mmap_mode='r')
+        self.postings = csr_matrix(
+            (load("postings_data.npy"), load("postings_indices.npy"), load("postings_indptr.npy")),
+            shape=(self.meta["n_features"], self.meta["n_docs"]),
+            copy=False,
+        )
+        self.ids = load("ids.npy")
+        # 样本原文/答案按需从 train.json 中读取，不常驻内存
+        self.records = open_index(train_path)
+
+    def _query_matrix(self, contents):
+        """查询侧只看 n-gram 是否出现 (二值)，得分即命中项的 BM25 权重之和。"""
+        rows = [{col: 1.0 for col in hashed_counts(c, tuple(self.meta["ngram_range"]), self.meta["n_features"])}
+                for c in contents]
+        indptr = np.cumsum([0] + [len(r) for r in rows])
+        indices = np.fromiter((col for r in rows for col in sorted(r)), dtype=np.int32, count=indptr[-1])
+        data = np.ones(indptr[-1], dtype=np.float32)
+        return csr_matrix((data, indices, indptr), shape=(len(contents), self.meta["n_features"]))
+
+    def search_batch(self, contents, k: int = TOP_K, exclude_ids=None):
+        """
+        批量检索，返回每条查询的 [(train_id, score), ...] (按得分降序)。
+        exclude_ids 与 contents 对齐，用于在训练集上评测时排除样本自身。
+        """
+        scores = (self._query_matrix(contents) @ self.postings).tocsr()
+        results = []
+        for i in range(len(contents)):
+            row = slice(scores.indptr[i], scores.indptr[i + 1])
+            doc_idx, doc_scores = scores.indices[row], scores.data[row]
+            if exclude_ids is not None and exclude_ids[i] is not None:
+                keep = self.ids[doc_idx] != int(exclude_ids[i])
+                doc_idx, doc_scores = doc_idx[keep], doc_scores[keep]
+            if len(doc_idx) > k:
+                top = np.argpartition(-doc_scores, k)[:k]
+                doc_idx, doc_scores = doc_idx[top], doc_scores[top]
+            order = np.argsort(-doc_scores, kind='stable')
+            results.append([(int(self.ids[doc_idx[j]]), float(doc_scores[j])) for j in order])
+        return results
+
+    def search(self, content: str, k: int = TOP_K, exclude_id=None):
+        return self.search_batch([content], k, [exclude_id])[0]
+
+    def select_examples(self, hits, tokenizer=None, token_budget: int = FEWSHOT_TOKEN_BUDGET):
+        """按相似度依次取样例，超出 token 预算的样例跳过 (后面较短的仍可放入)。"""
+        examples = []
+        used = 0
+        for item_id, _ in hits:
+            record = self.records.get(item_id)
+            if record is None:
+                continue
+            cost = count_tokens(tokenizer, format_example(len(examples) + 1, record['content'], record['output']))
+            if used + cost > token_budget:
+                continue
+            examples.append((record['content'], record['output']))
+            used += cost
+        return examples
+
+    def build_prompts(self, contents, tokenizer=None, k: int = TOP_K,
+                      token_budget: int = FEWSHOT_TOKEN_BUDGET, exclude_ids=None):
+        """为一批评论生成各自的 retrieval_v1 system prompt。"""
+        hits = self.search_batch(contents, k, exclude_ids)
+        return [format_retrieval_prompt(self.select_examples(h, tokenizer, token_budget)) for h in hits]
+
+    def close(self):
+        self.records.close()
+
+
+# --- 使用说明 ---
+# 建索引:   python fewshot_retriever.py build
+# 检索示例: python fewshot_retriever.py query "没爹的黑孩到处扔"
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "build":
+        build_index()
+    elif len(sys.argv) >= 3 and sys.argv[1] == "query":
+        retriever = FewShotRetriever()
+        retriever.search(sys.argv[2])  # 预热
+        start = time.perf_counter()
+        hits = retriever.search(sys.argv[2])
+        print(f"检索耗时 {(time.perf_counter() - start) * 1000:.3f} ms")
+        for item_id, score in hits:
+            record = retriever.records.get(item_id)
+            print(f"  [{score:.2f}] {item_id}: {record['content']} -> {record['output']}")
+        retriever.close()
+    else:
+        print("用法: python fewshot_retriever.py build | query <文本>")
@@ -2,6 +2,7 @@
 import re
 import json
 from tqdm import tqdm
+from span_snap import snap_output
 
 # --- 配置 ---
 # 您的模型生成的、带有ID的、混乱的原始文件
@@ -14,6 +15,9 @@ TEST_FILE_PATH = "./test2.json"
 DEFAULT_FALLBACK_OUTPUT = "NULL | NULL | non-hate | non-hate [END]"
 VALID_TARGET_GROUPS = {"Racism", "Region", "Sexism", "LGBTQ", "others", "non-hate"}
 VALID_HATEFUL_LABELS = {"hate", "non-hate"}
+# 是否把 Target/Argument 吸附到原文中最接近的真实子串上 (见 span_snap.py)，提升硬匹配。
+# 打开后会改写已有的片段 (输出与之前的修复结果不同)，默认关闭，需要时手动改为 True
+SNAP_SPANS = False
 
 def repair_and_normalize_quadruplet(text: str) -> str:
     """
@@ -72,6 +76,7 @@ def main():
         with open(TEST_FILE_PATH, 'r', encoding='utf-8') as f:
             test_data = json.load(f)
         target_ids = {str(item['id']) for item in test_data}
+        test_contents = {str(item['id']): item['content'] for item in test_data}
         print(f"基准文件 '{TEST_FILE_PATH}' 加载成功，目标ID数量: {len(target_ids)}")
     except Exception as e:
         print(f"❌ 严重错误: 无法读取基准测试文件 '{TEST_FILE_PATH}'! {e}")
@@ -113,6 +118,8 @@ def main():
             # 如果某个ID在输出文件中存在，就处理它
             if record_id in records:
                 repaired_line = repair_and_normalize_quadruplet(records[record_id])
+                if SNAP_SPANS:
+                    repaired_line = snap_output(repaired_line, test_contents[record_id])
                 f_out.write(repaired_line + '\n')
             else:
                 # 如果某个ID在输出文件中完全不存在，也写入默认值以保证对齐
@@ -0,0 +1,180 @@
+# id_index.py
+# 为 test*.json / train.json 建立"按ID随机访问"的索引。
+# 一次性扫描JSON，把每条记录的 (id, 字节偏移, 字节长度) 按ID排序后写入一个紧凑的旁路文件 (<json>.idx)，
+# 之后通过 mmap + 二分查找实现 O(log n) 查询，只读取目标记录所在的那几个字节，不再整份 json.load。
+import json
+import mmap
+import os
+import struct
+import sys
+
+# --- 索引文件格式 ---
+# 文件头: 魔数(4B) + 记录数(8B) + 源文件大小(8B) + 源文件mtime_ns(8B)
+# 记录:   id(int64) + 偏移(uint64) + 长度(uint32)，按id升序排列
+INDEX_MAGIC = b"IDX1"
+HEADER_STRUCT = struct.Struct("<4sQQQ")
+RECORD_STRUCT = struct.Struct("<qQI")
+
+
+def default_index_path(json_path: str) -> str:
+    return json_path + ".idx"
+
+
+def scan_record_offsets(json_path: str):
+    """
+    扫描一个"list of dicts"格式的JSON文件，返回 [(id, 字节偏移, 字节长度), ...]。
+    使用 json 自带的 raw_decode 逐个解析顶层对象，同时累计字节偏移。
+    """
+    with open(json_path, 'rb') as f:
+        raw = f.read()
+    text = raw.decode('utf-8')
+    decoder = json.JSONDecoder()
+
+    pos = text.index('[') + 1
+    byte_pos = len(text[:pos].encode('utf-8'))
+    records = []
+    length = len(text)
+    while pos < length:
+        # 跳过空白和逗号
+        start = pos
+        while pos < length and text[pos] in ' \t\r\n,':
+            pos += 1
+        byte_pos += pos - start  # 以上字符都是单字节
+        if pos >= length or text[pos] == ']':
+            break
+
+        obj, end = decoder.raw_decode(text, pos)
+        obj_bytes = len(text[pos:end].encode('utf-8'))
+        records.append((int(obj['id']), byte_pos, obj_bytes))
+        byte_pos += obj_bytes
+        pos = end
+    return records
+
+
+def build_index(json_path: str, index_path: str = None) -> str:
+    """扫描JSON并写出排序后的旁路索引文件，返回索引文件路径。"""
+    index_path = index_path or default_index_path(json_path)
+    records = scan_record_offsets(json_path)
+    records.sort(key=lambda r: r[0])
+
+    stat = os.stat(json_path)
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER_STRUCT.pack(INDEX_MAGIC, len(records), stat.st_size, stat.st_mtime_ns))
+        for rec in records:
+            f.write(RECORD_STRUCT.pack(*rec))
+    os.replace(tmp_path, index_path)
+    return index_path
+
+
+def index_is_fresh(json_path: str, index_path: str) -> bool:
+    """索引存在且与源文件的大小/修改时间一致时才认为可用。"""
+    if not os.path.exists(index_path):
+        return False
+    with open(index_path, 'rb') as f:
+        header = f.read(HEADER_STRUCT.size)
+    if len(header) != HEADER_STRUCT.size:
+        return False
+    magic, _, size, mtime_ns = HEADER_STRUCT.unpack(header)
+    stat = os.stat(json_path)
+    return magic == INDEX_MAGIC and size == stat.st_size and mtime_ns == stat.st_mtime_ns
+
+
+class IdIndex:
+    """
+    基于 mmap 的只读ID索引。用法:
+        with open_index('./test2.json') as idx:
+            item = idx.get(4169)   # -> {'id': 4169, 'content': ...} 或 None
+    """
+
+    def __init__(self, json_path: str, index_path: str = None):
+        self.json_path = json_path
+        self.index_path = index_path or default_index_path(json_path)
+        self._idx_file = open(self.index_path, 'rb')
+        self._json_file = open(json_path, 'rb')
+        self._idx_map = mmap.mmap(self._idx_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._json_map = mmap.mmap(self._json_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count, _, _ = HEADER_STRUCT.unpack_from(self._idx_map, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"'{self.index_path}' 不是有效的ID索引文件")
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, item_id):
+        return self._find(int(item_id)) is not None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _record(self, i: int):
+        return RECORD_STRUCT.unpack_from(self._idx_map, HEADER_STRUCT.size + i * RECORD_STRUCT.size)
+
+    def _find(self, item_id: int):
+        # 在排序后的定长记录上做二分查找
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            rec = self._record(mid)
+            if rec[0] < item_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._count:
+            rec = self._record(lo)
+            if rec[0] == item_id:
+                return rec
+        return None
+
+    def get_raw(self, item_id):
+        """返回该ID对应记录的原始JSON字节串，找不到时返回 None。"""
+        rec = self._find(int(item_id))
+        if rec is None:
+            return None
+        _, offset, length = rec
+        return self._json_map[offset:offset + length]
+
+    def get(self, item_id):
+        """返回该ID对应的记录字典，找不到时返回 None。"""
+        raw = self.get_raw(item_id)
+        return None if raw is None else json.loads(raw.decode('utf-8'))
+
+    def ids(self):
+        """按升序迭代所有ID。"""
+        for i in range(self._count):
+            yield self._record(i)[0]
+
+    def close(self):
+        self._idx_map.close()
+        self._json_map.close()
+        self._idx_file.close()
+        self._json_file.close()
+
+
+def open_index(json_path: str, index_path: str = None) -> IdIndex:
+    """打开ID索引；索引不存在或已过期时先自动重建。"""
+    index_path = index_path or default_index_path(json_path)
+    if not index_is_fresh(json_path, index_path):
+        print(f"为 '{json_path}' 建立ID索引 -> '{index_path}'")
+        build_index(json_path, index_path)
+    return IdIndex(json_path, index_path)
+
+
+# --- 使用说明 ---
+# 建索引:   python id_index.py train.json
+# 查询样例: python id_index.py train.json 396 1778 5219
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("用法: python id_index.py <json文件> [id ...]")
+        sys.exit(1)
+    with open_index(sys.argv[1]) as idx:
+        print(f"索引共 {len(idx)} 条记录。")
+        for query_id in sys.argv[2:]:
+            item = idx.get(query_id)
+            if item is None:
+                print(f"  [警告] ID {query_id} 不存在。")
+            else:
+                print(json.dumps(item, ensure_ascii=False, indent=2))
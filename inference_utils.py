@@ -0,0 +1,242 @@
+# inference_utils.py
+# 推理相关的公共工具：模型/分词器加载、批量生成，以及CPU上做基准测试用的微型替身模型。
+# test.py 等脚本保留各自的流程，新工具 (benchmark.py 等) 统一从这里加载模型，避免再复制一遍加载代码。
+import hashlib
+import os
+
+import torch
+from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
+
+from output_format import DEFAULT_FALLBACK_OUTPUT, apply_fallback  # 重新导出，沿用旧的导入路径
+from prompts import DEFAULT_PROMPT_NAME, render_prompt
+
+BASE_MODEL_PATH = "/root/autodl-tmp/Qwen1.5-7B-Chat"
+ADAPTER_PATH = "./qwen-hf-sft-output/final_adapter"
+MAX_NEW_TOKENS = 256
+# int8 后端首次转换后缓存在这里 (按 基座/适配器路径及其权重文件的大小与修改时间区分)，之后直接加载
+INT8_CACHE_DIR = "./int8_cache"
+
+
+def load_tokenizer(path: str = BASE_MODEL_PATH):
+    tokenizer = AutoTokenizer.from_pretrained(path, trust_remote_code=True)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    # 批量生成时需要左填充，保证每条样本的生成起点对齐
+    tokenizer.padding_side = "left"
+    return tokenizer
+
+
+def load_base_model(base_path: str = BASE_MODEL_PATH, backend: str = "4bit"):
+    """
+    只加载基座模型 (不带 LoRA)。
+    backend:
+      - "4bit": 与 test.py 一致的 bitsandbytes nf4 量化 + device_map="auto"
+      - "bf16": 不量化的 bf16 权重 (也用作其它后端的对照基线)
+      - "int8": CPU 上的动态 int8 量化，见 load_model / quantize_int8 (这里只加载 CPU 上的 bf16 权重)
+    """
+    print(f"开始加载模型 (backend={backend})...")
+    if backend == "4bit":
+        quantization_config = BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_quant_type="nf4",
+            bnb_4bit_compute_dtype=torch.bfloat16,
+            bnb_4bit_use_double_quant=True,
+        )
+        return AutoModelForCausalLM.from_pretrained(
+            base_path,
+            quantization_config=quantization_config,
+            device_map="auto",
+            trust_remote_code=True
+        )
+    if backend == "int8":
+        return AutoModelForCausalLM.from_pretrained(base_path, torch_dtype=torch.bfloat16, trust_remote_code=True)
+    if backend == "bf16":
+        return AutoModelForCausalLM.from_pretrained(
+            base_path,
+            torch_dtype=torch.bfloat16,
+            device_map="auto" if torch.cuda.is_available() else None,
+            trust_remote_code=True
+        )
+    raise ValueError(f"未知的 backend: '{backend}'")
+
+
+def _float_output(module, args, output):
+    return output.float()
+
+
+def quantize_int8(model):
+    """
+    动态 int8 量化：所有 Linear 的权重以 int8 存储，激活在每次前向时动态量化。
+    逐个 decoder 层先转 fp32 再量化，峰值内存约为 bf16 模型 + 一层 fp32，而不是整份 fp32 模型。
+    embedding (7B 模型约 1.2GB bf16，转 fp32 后翻倍) 只做查表，保持 bf16，输出再转 fp32 交给后续层。
+    """
+    from torch.ao.quantization import quantize_dynamic
+
+    layers = getattr(getattr(model, "model", None), "layers", [])
+    for layer in layers:
+        layer.float()
+        quantize_dynamic(layer, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    # 剩下的 norm / lm_head 等转 fp32 (不用 model.float()，那样会连 embedding 一起转)，lm_head 等其余 Linear 一并量化
+    for module in model.modules():
+        if isinstance(module, torch.nn.Embedding):
+            # 模块级函数而不是 lambda，torch.save 整个模型时需要能被 pickle
+            module.register_forward_hook(_float_output)
+            continue
+        for param in module.parameters(recurse=False):
+            if param.is_floating_point():
+                param.data = param.data.float()
+        for name, buffer in module.named_buffers(recurse=False):
+            if buffer is not None and buffer.is_floating_point():
+                module._buffers[name] = buffer.float()
+    quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    model.eval()
+    return model
+
+
+WEIGHT_FILE_SUFFIXES = (".safetensors", ".bin", ".pt", ".json")
+
+
+def _weights_fingerprint(path: str) -> str:
+    """目录下权重/配置文件的 (文件数, 总大小, 最大修改时间)。目录本身的 mtime 在原地覆盖文件时不会变化。"""
+    if not path or not os.path.exists(path):
+        return "missing"
+    if os.path.isfile(path):
+        files = [path]
+    else:
+        files = [os.path.join(root, name) for root, _, names in os.walk(path) for name in names
+                 if name.endswith(WEIGHT_FILE_SUFFIXES)]
+    stats = [os.stat(f) for f in files]
+    return f"{len(stats)}:{sum(st.st_size for st in stats)}:{max((st.st_mtime_ns for st in stats), default=0)}"
+
+
+def model_fingerprint(base_path: str = BASE_MODEL_PATH, adapter_path: str = ADAPTER_PATH) -> str:
+    """基座/适配器路径及其权重文件的短摘要，用来区分按模型缓存的中间结果 (int8 模型、探针特征等)。"""
+    key = [f"{os.path.abspath(path) if path else ''}:{_weights_fingerprint(path)}" for path in (base_path, adapter_path)]
+    return hashlib.sha1("|".join(key).encode("utf-8")).hexdigest()[:16]
+
+
+def _int8_cache_path(base_path: str, adapter_path: str) -> str:
+    return os.path.join(INT8_CACHE_DIR, f"model-{model_fingerprint(base_path, adapter_path)}.pt")
+
+
+def model_memory_bytes(model) -> int:
+    """模型权重占用的字节数 (包括量化模块中打包的 int8 权重；int8 后端的 embedding 保持 bf16，也计入其中)。"""
+    def tensor_bytes(value):
+        if isinstance(value, torch.Tensor):
+            return value.numel() * value.element_size()
+        if isinstance(value, (tuple, list)):
+            return sum(tensor_bytes(v) for v in value)
+        return 0
+    return sum(tensor_bytes(v) for v in model.state_dict().values())
+
+
+def load_model(base_path: str = BASE_MODEL_PATH, adapter_path: str = ADAPTER_PATH, backend: str = "4bit"):
+    """加载基座模型并融合 LoRA 适配器，backend 见 load_base_model。"""
+    if backend == "int8":
+        cache_path = _int8_cache_path(base_path, adapter_path)
+        if os.path.exists(cache_path):
+            print(f"从缓存 '{cache_path}' 加载 int8 模型...")
+            model = torch.load(cache_path, weights_only=False)
+            model.eval()
+            print("模型加载并准备就绪！")
+            return model
+    base_model = load_base_model(base_path, backend)
+    model = base_model
+    if adapter_path:
+        from peft import PeftModel
+
+        print(f"从 {adapter_path} 加载LoRA适配器...")
+        model = PeftModel.from_pretrained(base_model, adapter_path)
+        print("融合LoRA权重...")
+        model = model.merge_and_unload()
+    model.eval()
+    if backend == "int8":
+        # LoRA 必须先融合进 bf16 权重再量化；转换较慢，结果整体缓存到磁盘
+        print("动态 int8 量化...")
+        model = quantize_int8(model)
+        cache_path = _int8_cache_path(base_path, adapter_path)
+        os.makedirs(INT8_CACHE_DIR, exist_ok=True)
+        # 先写同目录下的临时文件再原子替换，中途被打断不会留下被当作缓存命中的半截文件
+        tmp_path = f"{cache_path}.tmp-{os.getpid()}"
+        try:
+            torch.save(model, tmp_path)
+            os.replace(tmp_path, cache_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        print(f"int8 模型已缓存到 '{cache_path}'")
+    print("模型加载并准备就绪！")
+    return model
+
+
+def load_tiny_model(tokenizer, seed: int = 0):
+    """
+    构造一个随机初始化的微型 Qwen2 模型 (与 Qwen1.5 同结构)，词表与真实分词器一致。
+    输出没有意义，只用于在CPU上验证流程、比较不同推理模式的开销。
+    """
+    from transformers import Qwen2Config, Qwen2ForCausalLM
+
+    torch.manual_seed(seed)
+    config = Qwen2Config(
+        vocab_size=len(tokenizer),
+        hidden_size=64,
+        intermediate_size=128,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=4096,
+        pad_token_id=tokenizer.pad_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+    )
+    model = Qwen2ForCausalLM(config)
+    model.eval()
+    return model
+
+
+def greedy_logits_processors(model):
+    """
+    手写解码循环 (受限词表、标签打分、prefill 探针) 取 argmax 前要经过的 logits 处理，与 model.generate 贪心解码一致：
+    模型 generation_config 里的重复惩罚等 (Qwen1.5-Chat 默认 repetition_penalty=1.05)。
+    temperature / top_p 等采样参数在贪心下不起作用，不需要。调用时传入 prompt + 已生成的完整 token 序列。
+    """
+    from transformers import LogitsProcessorList, NoRepeatNGramLogitsProcessor, RepetitionPenaltyLogitsProcessor
+
+    config = model.generation_config
+    processors = LogitsProcessorList()
+    if config.repetition_penalty is not None and config.repetition_penalty != 1.0:
+        processors.append(RepetitionPenaltyLogitsProcessor(config.repetition_penalty))
+    if config.no_repeat_ngram_size:
+        processors.append(NoRepeatNGramLogitsProcessor(config.no_repeat_ngram_size))
+    return processors
+
+
+def eos_token_ids(model, tokenizer):
+    """generation_config 与分词器中的全部结束符 id。"""
+    eos = model.generation_config.eos_token_id
+    eos = set(eos if isinstance(eos, (list, tuple)) else [eos]) if eos is not None else set()
+    eos.add(tokenizer.eos_token_id)
+    return eos
+
+
+def generate_responses(model, tokenizer, contents, prompt_name: str = DEFAULT_PROMPT_NAME,
+                       batch_size: int = 8, max_new_tokens: int = MAX_NEW_TOKENS, system_prompts=None):
+    """
+    对一组评论做贪心批量生成，返回与 contents 对齐的原始响应文本列表。
+    system_prompts 与 contents 对齐时逐条覆盖 prompt_name (检索式 few-shot 等动态 prompt)。
+    """
+    responses = []
+    for start in range(0, len(contents), batch_size):
+        batch = contents[start:start + batch_size]
+        batch_system = system_prompts[start:start + batch_size] if system_prompts else [None] * len(batch)
+        prompts = [render_prompt(tokenizer, c, prompt_name, sp) for c, sp in zip(batch, batch_system)]
+        inputs = tokenizer(prompts, return_tensors="pt", padding=True).to(model.device)
+        with torch.no_grad():
+            outputs = model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                do_sample=False,
+                pad_token_id=tokenizer.pad_token_id
+            )
+        new_tokens = outputs[:, inputs['input_ids'].shape[1]:]
+        responses.extend(t.strip() for t in tokenizer.batch_decode(new_tokens, skip_special_tokens=True))
+    return responses
@@ -0,0 +1,139 @@
+# label_scoring.py
+# 两阶段解码：Target / Argument 照常逐 token 生成；每当一个四元组写完 "Target | Argument |"，
+# 不再逐 token 解码标签，而是把所有合法的 "目标群体 | 是否仇恨" 组合放进同一个 batch，
+# 共享当前 KV cache 做一次前向，按对数似然取最大者拼接回去，再继续生成 " [SEP] ..." 或 " [END]"。
+# 这样既省掉了标签的解码步，也从根本上杜绝了大小写错误、顺序错误等非法标签 (final.py 不必再修)。
+import copy
+from itertools import combinations
+
+import torch
+
+from inference_utils import MAX_NEW_TOKENS, eos_token_ids, greedy_logits_processors
+
+HATE_GROUPS = ["LGBTQ", "Racism", "Region", "Sexism", "others"]
+
+
+def label_candidates():
+    """
+    所有合法的 "目标群体 | 是否仇恨" 组合：
+    - non-hate 只能搭配 non-hate
+    - hate 搭配 5 个歧视类别的任意非空组合，组内按 sorted() 排序 (与 final.py 一致)
+    """
+    candidates = ["non-hate | non-hate"]
+    for size in range(1, len(HATE_GROUPS) + 1):
+        for combo in combinations(HATE_GROUPS, size):
+            candidates.append(f"{', '.join(sorted(combo))} | hate")
+    return candidates
+
+
+def _awaiting_labels(text: str) -> bool:
+    """当前四元组 (最后一个 [SEP] 之后) 恰好写完了两个 '|'，下一步就是标签。"""
+    segment = text.rsplit('[SEP]', 1)[-1]
+    return segment.count('|') == 2 and segment.rstrip(' ').endswith('|')
+
+
+def _expand_cache(past_key_values, n: int):
+    """把 batch=1 的 KV cache 复制成 batch=n，不改动原 cache。"""
+    if hasattr(past_key_values, "batch_repeat_interleave"):
+        expanded = copy.deepcopy(past_key_values)
+        expanded.batch_repeat_interleave(n)
+        return expanded
+    return tuple(tuple(t.repeat_interleave(n, dim=0) for t in layer) for layer in past_key_values)
+
+
+class LabelScorer:
+    def __init__(self, tokenizer, candidates=None):
+        self.tokenizer = tokenizer
+        self.candidates = candidates or label_candidates()
+        # 前面是否已经有空格决定候选是否需要带前导空格，两种分词结果都预先算好
+        self._cand_ids = {
+            lead: [tokenizer(lead + c, add_special_tokens=False)['input_ids'] for c in self.candidates]
+            for lead in ("", " ")
+        }
+
+    @torch.no_grad()
+    def score(self, model, past_key_values, next_logits, leading_space: bool):
+        """
+        对所有候选做一次批量前向，返回 (最佳候选下标, 最佳候选的token id列表, 各候选对数似然)。
+        next_logits: 当前位置 (1 x V) 的 logits，用于计算候选第一个 token 的概率。
+        """
+        cand_ids = self._cand_ids[" " if leading_space else ""]
+        n = len(cand_ids)
+        max_len = max(len(ids) for ids in cand_ids)
+        pad_id = self.tokenizer.pad_token_id
+        device = next_logits.device
+
+        batch = torch.full((n, max_len), pad_id, dtype=torch.long, device=device)
+        lengths = torch.tensor([len(ids) for ids in cand_ids], device=device)
+        for i, ids in enumerate(cand_ids):
+            batch[i, :len(ids)] = torch.tensor(ids, device=device)
+
+        past_len = past_key_values.get_seq_length() if hasattr(past_key_values, "get_seq_length") \
+            else past_key_values[0][0].shape[2]
+        # 候选右侧补齐；因果注意力下补齐位置不会影响前面的 token，只需忽略其 logits
+        attention_mask = torch.ones((n, past_len + max_len), dtype=torch.long, device=device)
+        position_ids = torch.arange(past_len, past_len + max_len, device=device).unsqueeze(0).expand(n, -1)
+        out = model(
+            input_ids=batch,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=_expand_cache(past_key_values, n),
+            use_cache=True,
+        )
+
+        # 第 j 个候选 token 的概率来自第 j-1 个位置的输出；第 0 个来自 next_logits
+        step_logits = torch.cat([next_logits.expand(n, -1).unsqueeze(1), out.logits[:, :-1]], dim=1)
+        log_probs = torch.log_softmax(step_logits.float(), dim=-1)
+        token_lp = log_probs.gather(-1, batch.unsqueeze(-1)).squeeze(-1)
+        mask = torch.arange(max_len, device=device).unsqueeze(0) < lengths.unsqueeze(1)
+        seq_lp = (token_lp * mask).sum(dim=1)
+
+        best = int(seq_lp.argmax())
+        return best, cand_ids[best], seq_lp.tolist()
+
+
+@torch.no_grad()
+def generate_with_label_scoring(model, tokenizer, input_ids, scorer: LabelScorer = None,
+                                max_new_tokens: int = MAX_NEW_TOKENS):
+    """
+    对单条样本 (input_ids: 1 x L) 做两阶段贪心解码。
+    返回 (响应文本, 统计信息)，统计信息包括实际解码步数和因标签打分而省下的步数。
+    """
+    scorer = scorer or LabelScorer(tokenizer)
+    # Target / Argument 的逐 token 解码与 model.generate 一样先经过重复惩罚等处理；标签打分仍比较原始对数似然
+    processors = greedy_logits_processors(model)
+    stop_ids = eos_token_ids(model, tokenizer) | {tokenizer.pad_token_id}
+    out = model(input_ids=input_ids, use_cache=True)
+    past = out.past_key_values
+    next_logits = out.logits[:, -1]
+    generated = []
+    stats = {"decode_steps": 0, "label_tokens_scored": 0, "quadruplets": 0}
+
+    while len(generated) < max_new_tokens:
+        text = tokenizer.decode(generated, skip_special_tokens=True)
+        if generated and _awaiting_labels(text):
+            _, chosen_ids, _ = scorer.score(model, past, next_logits, leading_space=not text.endswith(' '))
+            generated.extend(chosen_ids)
+            stats["label_tokens_scored"] += len(chosen_ids)
+            stats["quadruplets"] += 1
+            # 把选中的标签一次性写入 KV cache，继续生成
+            out = model(input_ids=torch.tensor([chosen_ids], device=input_ids.device),
+                        past_key_values=past, use_cache=True)
+        else:
+            scores = next_logits.float()
+            if len(processors):
+                sequence = torch.cat([input_ids, input_ids.new_tensor([generated])], dim=-1)
+                scores = processors(sequence, scores)
+            token = int(scores.argmax(dim=-1))
+            if token in stop_ids:
+                break
+            generated.append(token)
+            stats["decode_steps"] += 1
+            if tokenizer.decode(generated[-3:], skip_special_tokens=True).endswith('[END]'):
+                break
+            out = model(input_ids=torch.tensor([[token]], device=input_ids.device),
+                        past_key_values=past, use_cache=True)
+        past = out.past_key_values
+        next_logits = out.logits[:, -1]
+
+    return tokenizer.decode(generated, skip_special_tokens=True).strip(), stats
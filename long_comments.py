@@ -0,0 +1,104 @@
+# long_comments.py
+# 超长评论的 token 预算策略：少数长帖整条送入模型时，一条就能占满一个 batch 的 prefill 时间和显存。
+# 评论分词后超过 LONG_INPUT_TOKENS 时改为分块模式：在 ，。！？ 处切句，按 CHUNK_TOKENS 预算把句子拼成若干块
+# (每块都是原文的连续子串)，各块作为一个 batch 分别抽取四元组，再去重合并；
+# 合并后的 Target / Argument 再吸附回完整原文 (span_snap.py)，保证片段与原文逐字一致。
+import re
+
+from inference_utils import generate_responses
+from prompts import DEFAULT_PROMPT_NAME, render_prompt
+from scorer import parse_quadruplets
+from span_snap import snap_output
+
+LONG_INPUT_TOKENS = 256
+CHUNK_TOKENS = 128
+SENTENCE_END = re.compile(r'[，。！？]+')
+
+
+def content_length(tokenizer, content: str) -> int:
+    return len(tokenizer(content, add_special_tokens=False)['input_ids'])
+
+
+def is_long(tokenizer, content: str, budget: int = LONG_INPUT_TOKENS) -> bool:
+    return content_length(tokenizer, content) > budget
+
+
+def prompt_overhead(tokenizer, prompt_name: str = DEFAULT_PROMPT_NAME, system_prompt: str = None) -> int:
+    """chat 模板下除评论以外的 token 数 (system + 模板标记 + 生成前缀)。已分词的输入长度减去它即为评论长度。"""
+    return len(tokenizer(render_prompt(tokenizer, "", prompt_name, system_prompt))['input_ids'])
+
+
+def split_sentences(content: str):
+    """在 ，。！？ 之后切分 (标点留在前一句)，返回覆盖全文的 [(起点, 终点), ...]。"""
+    spans, start = [], 0
+    for match in SENTENCE_END.finditer(content):
+        spans.append((start, match.end()))
+        start = match.end()
+    if start < len(content):
+        spans.append((start, len(content)))
+    return spans
+
+
+def make_chunks(tokenizer, content: str, budget: int = CHUNK_TOKENS):
+    """
+    按 token 预算把相邻句子拼成块，返回 [(起点, 终点), ...]，每块都是原文的连续子串。
+    单句超过预算时按字符长度比例硬切。
+    """
+    chunks = []
+    cur_start, cur_end, cur_tokens = None, None, 0
+    for start, end in split_sentences(content):
+        n = content_length(tokenizer, content[start:end])
+        if n > budget:
+            if cur_start is not None:
+                chunks.append((cur_start, cur_end))
+                cur_start, cur_tokens = None, 0
+            step = max(1, (end - start) * budget // n)
+            chunks.extend((s, min(s + step, end)) for s in range(start, end, step))
+            continue
+        if cur_start is not None and cur_tokens + n > budget:
+            chunks.append((cur_start, cur_end))
+            cur_start, cur_tokens = None, 0
+        if cur_start is None:
+            cur_start = start
+        cur_end = end
+        cur_tokens += n
+    if cur_start is not None:
+        chunks.append((cur_start, cur_end))
+    return chunks
+
+
+def merge_chunk_outputs(outputs):
+    """
+    合并各块的输出：按 (Target, Argument, 群体, 标签) 去重；只要有 hate 四元组，
+    就丢掉 Target 为 NULL 的 non-hate 四元组 (那通常只是"本块无仇恨"的占位)。hate 四元组排在前面。
+    """
+    seen, hate, non_hate = set(), [], []
+    for output in outputs:
+        for quad in parse_quadruplets(output):
+            key = tuple(field.strip() for field in quad)
+            if key in seen:
+                continue
+            seen.add(key)
+            (hate if key[3] == "hate" else non_hate).append(key)
+    if hate:
+        non_hate = [q for q in non_hate if q[0] != "NULL"]
+    merged = hate + non_hate
+    if not merged:
+        return ""
+    return ' [SEP] '.join(' | '.join(q) for q in merged) + ' [END]'
+
+
+def extract_long(model, tokenizer, content: str, prompt_name: str = DEFAULT_PROMPT_NAME,
+                 budget: int = CHUNK_TOKENS, batch_size: int = 8, max_new_tokens: int = 256,
+                 system_prompt: str = None):
+    """
+    分块抽取一条长评论，返回 (合并后的输出, 块数)。
+    system_prompt 不为空时 (如该条的检索式 few-shot prompt) 各块都使用它，覆盖 prompt_name。
+    """
+    chunks = [content[s:e] for s, e in make_chunks(tokenizer, content, budget)]
+    chunks = [c for c in chunks if c.strip()]
+    outputs = generate_responses(model, tokenizer, chunks, prompt_name, batch_size=batch_size,
+                                 max_new_tokens=max_new_tokens,
+                                 system_prompts=[system_prompt] * len(chunks) if system_prompt else None)
+    merged = merge_chunk_outputs(outputs)
+    return (snap_output(merged, content) if merged else merged), len(chunks)
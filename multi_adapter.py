@@ -0,0 +1,187 @@
+# multi_adapter.py
+# 多 LoRA 适配器共享同一个基座模型推理 (不 merge)：
+# 以前每个 checkpoint 都要 merge_and_unload() 出一份完整的 7B 权重，A/B 两个适配器就得两个进程、两倍显存。
+# 这里基座只加载一次，多个 PEFT 适配器按名字挂载，每条请求/每个 batch 路由到指定适配器；
+# PEFT 支持时同一个 batch 内可以混合不同适配器 (generate(adapter_names=...))，否则按适配器分组执行。
+# 用法:
+#   python multi_adapter.py --adapters v1=./qwen-hf-sft-output/final_adapter v2=./qwen-sft-v2/final_adapter
+#   python multi_adapter.py --adapters v1=... v2=... --bench --limit 32 --backend bf16   # 与 merge 后执行的延迟对比 (4bit 上跳过)
+import argparse
+import json
+import time
+
+import torch
+from peft import PeftModel
+
+from inference_utils import (ADAPTER_PATH, BASE_MODEL_PATH, MAX_NEW_TOKENS, apply_fallback,
+                             load_base_model, load_tokenizer)
+from prompts import DEFAULT_PROMPT_NAME, render_prompt
+
+TEST_FILE_PATH = "./test1.json"
+OUTPUT_PATTERN = "./submission_{name}.txt"
+BATCH_SIZE = 8
+
+
+def load_multi_adapter_model(adapters: dict, base_path: str = BASE_MODEL_PATH, backend: str = "4bit"):
+    """adapters: {名称: 路径}。返回挂载了全部适配器、未 merge 的 PeftModel。"""
+    base_model = load_base_model(base_path, backend)
+    names = list(adapters)
+    print(f"挂载适配器 '{names[0]}' <- {adapters[names[0]]}")
+    model = PeftModel.from_pretrained(base_model, adapters[names[0]], adapter_name=names[0])
+    for name in names[1:]:
+        print(f"挂载适配器 '{name}' <- {adapters[name]}")
+        model.load_adapter(adapters[name], adapter_name=name)
+    model.eval()
+    return model
+
+
+def _generate(model, tokenizer, contents, prompt_name, max_new_tokens, adapter_names=None):
+    prompts = [render_prompt(tokenizer, c, prompt_name) for c in contents]
+    inputs = tokenizer(prompts, return_tensors="pt", padding=True).to(model.device)
+    kwargs = {"adapter_names": adapter_names} if adapter_names is not None else {}
+    with torch.no_grad():
+        outputs = model.generate(
+            **inputs,
+            max_new_tokens=max_new_tokens,
+            do_sample=False,
+            pad_token_id=tokenizer.pad_token_id,
+            **kwargs
+        )
+    new_tokens = outputs[:, inputs['input_ids'].shape[1]:]
+    return [t.strip() for t in tokenizer.batch_decode(new_tokens, skip_special_tokens=True)]
+
+
+def generate_grouped(model, tokenizer, requests, prompt_name=DEFAULT_PROMPT_NAME,
+                     batch_size: int = BATCH_SIZE, max_new_tokens: int = MAX_NEW_TOKENS):
+    """requests: [(适配器名, 评论), ...]。按适配器分组，切换激活适配器后分批生成，结果与 requests 对齐。"""
+    responses = [None] * len(requests)
+    by_adapter = {}
+    for i, (name, _) in enumerate(requests):
+        by_adapter.setdefault(name, []).append(i)
+    for name, indices in by_adapter.items():
+        model.set_adapter(name)
+        for start in range(0, len(indices), batch_size):
+            batch = indices[start:start + batch_size]
+            outs = _generate(model, tokenizer, [requests[i][1] for i in batch], prompt_name, max_new_tokens)
+            for i, out in zip(batch, outs):
+                responses[i] = out
+    return responses
+
+
+def generate_mixed(model, tokenizer, requests, prompt_name=DEFAULT_PROMPT_NAME,
+                   batch_size: int = BATCH_SIZE, max_new_tokens: int = MAX_NEW_TOKENS):
+    """同一个 batch 内混合不同适配器；当前 PEFT 版本不支持时退回 generate_grouped。"""
+    responses = []
+    try:
+        for start in range(0, len(requests), batch_size):
+            batch = requests[start:start + batch_size]
+            responses.extend(_generate(model, tokenizer, [c for _, c in batch], prompt_name, max_new_tokens,
+                                       adapter_names=[name for name, _ in batch]))
+    except (TypeError, ValueError) as e:
+        print(f"[警告] 当前 PEFT 不支持 batch 内混合适配器 ({e})，改为按适配器分组执行。")
+        return generate_grouped(model, tokenizer, requests, prompt_name, batch_size, max_new_tokens)
+    return responses
+
+
+def generate_merged(model, tokenizer, requests, prompt_name=DEFAULT_PROMPT_NAME,
+                    batch_size: int = BATCH_SIZE, max_new_tokens: int = MAX_NEW_TOKENS):
+    """
+    对照组：每个适配器临时 merge 进基座权重后执行，结束后 unmerge，不需要第二份模型。
+    返回 (结果, merge/unmerge 总耗时)。
+    """
+    responses = [None] * len(requests)
+    merge_seconds = 0.0
+    by_adapter = {}
+    for i, (name, _) in enumerate(requests):
+        by_adapter.setdefault(name, []).append(i)
+    for name, indices in by_adapter.items():
+        model.set_adapter(name)
+        start_time = time.perf_counter()
+        model.merge_adapter()
+        merge_seconds += time.perf_counter() - start_time
+        for start in range(0, len(indices), batch_size):
+            batch = indices[start:start + batch_size]
+            outs = _generate(model, tokenizer, [requests[i][1] for i in batch], prompt_name, max_new_tokens)
+            for i, out in zip(batch, outs):
+                responses[i] = out
+        start_time = time.perf_counter()
+        model.unmerge_adapter()
+        merge_seconds += time.perf_counter() - start_time
+    return responses, merge_seconds
+
+
+def benchmark_latency(model, tokenizer, requests, prompt_name=DEFAULT_PROMPT_NAME,
+                      batch_size: int = BATCH_SIZE, max_new_tokens: int = MAX_NEW_TOKENS, backend: str = "4bit"):
+    """
+    比较 未merge(分组) / 未merge(混合batch) / merge 后执行 的每条延迟。
+    4bit 后端上 merge 再 unmerge 需要重新量化基座权重，是有损的，会改变之后所有运行用到的基座，因此跳过 merged 对照。
+    """
+    timings = {}
+    for mode, fn in (("unmerged_grouped", generate_grouped), ("unmerged_mixed", generate_mixed)):
+        start_time = time.perf_counter()
+        fn(model, tokenizer, requests, prompt_name, batch_size, max_new_tokens)
+        timings[mode] = time.perf_counter() - start_time
+    merge_seconds = None
+    if backend == "4bit":
+        print("[提示] 4bit 后端上 merge/unmerge 有损，跳过 merged 对照；需要该对照请使用 --backend bf16。")
+    else:
+        start_time = time.perf_counter()
+        _, merge_seconds = generate_merged(model, tokenizer, requests, prompt_name, batch_size, max_new_tokens)
+        timings["merged"] = time.perf_counter() - start_time - merge_seconds
+
+    baseline_mode = "merged" if "merged" in timings else "unmerged_grouped"
+    baseline = timings[baseline_mode] / len(requests)
+    print(f"{'模式':<18}{'ms/条':>10}{'相对' + baseline_mode:>20}")
+    for mode, seconds in timings.items():
+        per_item = seconds / len(requests)
+        print(f"{mode:<18}{per_item * 1000:>10.1f}{(per_item / baseline - 1):>+20.1%}")
+    if merge_seconds is not None:
+        print(f"(merge/unmerge 本身共耗时 {merge_seconds:.2f}s，未计入 merged 行)")
+    return timings
+
+
+def parse_adapter_args(values):
+    adapters = {}
+    for value in values:
+        name, _, path = value.partition('=')
+        adapters[name] = path
+    return adapters
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多适配器共享基座推理")
+    parser.add_argument("--adapters", nargs="+", default=[f"default={ADAPTER_PATH}"], help="名称=路径")
+    parser.add_argument("--test", default=TEST_FILE_PATH)
+    parser.add_argument("--limit", type=int, default=0)
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT_NAME)
+    parser.add_argument("--backend", default="4bit")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--bench", action="store_true", help="只做延迟对比，不写结果文件")
+    args = parser.parse_args()
+
+    adapters = parse_adapter_args(args.adapters)
+    tokenizer = load_tokenizer()
+    model = load_multi_adapter_model(adapters, backend=args.backend)
+
+    with open(args.test, 'r', encoding='utf-8') as f:
+        test_data = json.load(f)
+    if args.limit:
+        test_data = test_data[:args.limit]
+
+    # 每条测试数据对每个适配器各请求一次，交错排列，使每个 batch 都是混合适配器
+    requests = [(name, item['content']) for item in test_data for name in adapters]
+    if args.bench:
+        benchmark_latency(model, tokenizer, requests, args.prompt, args.batch_size, backend=args.backend)
+        return
+
+    responses = generate_mixed(model, tokenizer, requests, args.prompt, args.batch_size)
+    outputs = {name: open(OUTPUT_PATTERN.format(name=name), 'w', encoding='utf-8') for name in adapters}
+    for (name, _), response, item in zip(requests, responses, (i for i in test_data for _ in adapters)):
+        outputs[name].write(f"{item['id']} {apply_fallback(response)}\n")
+    for name, f in outputs.items():
+        f.close()
+        print(f"适配器 '{name}' 的结果已保存到 {OUTPUT_PATTERN.format(name=name)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+# near_dedup.py
+# 推理前的近重复折叠：仇恨评论常被轻微改动后反复转发 (多几个标点、加表情、改一个字)，
+# 每个变体都跑一次 generate 很浪费。这里对每条评论的字符 shingle 计算 MinHash 签名，
+# 用 LSH 分桶找出近重复簇，每簇只对代表样本推理，其余成员复用代表的结果，并把 Target/Argument 重新锚定到成员自己的原文上。
+import json
+import re
+import sys
+import zlib
+from difflib import SequenceMatcher
+
+import numpy as np
+
+from scorer import parse_quadruplets
+
+SHINGLE_SIZE = 3
+NUM_PERM = 64
+LSH_BANDS = 16                      # 16 个 band x 每个 4 行
+JACCARD_THRESHOLD = 0.7             # 候选对的估计 Jaccard 需达到该值才算近重复
+_MERSENNE_PRIME = (1 << 61) - 1
+
+# 固定随机种子，保证不同运行之间签名一致
+_rng = np.random.RandomState(20221021)
+_PERM_A = _rng.randint(1, 1 << 29, size=NUM_PERM).astype(np.uint64)
+_PERM_B = _rng.randint(0, 1 << 32, size=NUM_PERM, dtype=np.int64).astype(np.uint64)
+
+
+def normalize_for_dedup(text: str) -> str:
+    """去掉标点、空白、表情等非文字字符，只保留汉字/字母/数字，并统一小写。"""
+    return re.sub(r'[^\w]|_', '', text).lower()
+
+
+def shingles(text: str, k: int = SHINGLE_SIZE):
+    norm = normalize_for_dedup(text) or text.strip()
+    if len(norm) <= k:
+        return {norm}
+    return {norm[i:i + k] for i in range(len(norm) - k + 1)}
+
+
+def minhash_signature(text: str) -> np.ndarray:
+    """返回长度为 NUM_PERM 的 uint32 MinHash 签名。"""
+    hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles(text)), dtype=np.uint64)
+    # (a * h + b) mod p，a < 2^29 且 h < 2^32，乘积不会溢出 uint64
+    permuted = (np.outer(_PERM_A, hashes) + _PERM_B[:, None]) % np.uint64(_MERSENNE_PRIME)
+    return (permuted.min(axis=1) & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+
+def minhash_signatures(texts) -> np.ndarray:
+    return np.stack([minhash_signature(t) for t in texts]) if texts else np.zeros((0, NUM_PERM), np.uint32)
+
+
+class _UnionFind:
+    def __init__(self, n):
+        self.parent = list(range(n))
+
+    def find(self, x):
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            # 让编号小的作为根，代表样本即簇中最早出现的那条
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+
+def find_clusters(texts, threshold: float = JACCARD_THRESHOLD, bands: int = LSH_BANDS):
+    """
+    返回 (cluster_of, clusters):
+      cluster_of[i] = 第 i 条所在簇的代表下标 (簇中最早出现的一条)
+      clusters      = {代表下标: [成员下标, ...]}
+    """
+    signatures = minhash_signatures(texts)
+    rows = NUM_PERM // bands
+    uf = _UnionFind(len(texts))
+    for band in range(bands):
+        buckets = {}
+        band_sig = signatures[:, band * rows:(band + 1) * rows]
+        for i in range(len(texts)):
+            buckets.setdefault(band_sig[i].tobytes(), []).append(i)
+        for members in buckets.values():
+            head = members[0]
+            for other in members[1:]:
+                if uf.find(head) == uf.find(other):
+                    continue
+                if np.mean(signatures[head] == signatures[other]) >= threshold:
+                    uf.union(head, other)
+
+    cluster_of = [uf.find(i) for i in range(len(texts))]
+    clusters = {}
+    for i, rep in enumerate(cluster_of):
+        clusters.setdefault(rep, []).append(i)
+    return cluster_of, clusters
+
+
+def reanchor_span(span: str, src_text: str, dst_text: str) -> str:
+    """
+    把代表样本原文 src_text 中的片段 span 映射到成员原文 dst_text 中对应的位置。
+    span 在成员原文中原样存在 (或为 NULL) 时直接保留。
+    """
+    if span == "NULL" or span in dst_text:
+        return span
+    start = src_text.find(span)
+    if start < 0:
+        return span
+    end = start + len(span)
+    opcodes = SequenceMatcher(None, src_text, dst_text, autojunk=False).get_opcodes()
+
+    def map_offset(offset, is_end):
+        for tag, i1, i2, j1, j2 in opcodes:
+            if i1 <= offset < i2 or (is_end and offset == i2):
+                if tag == 'equal':
+                    return j1 + (offset - i1)
+                return j2 if is_end else j1
+        return len(dst_text) if is_end else 0
+
+    mapped = dst_text[map_offset(start, False):map_offset(end, True)].strip()
+    return mapped or span
+
+
+def reanchor_output(output: str, src_text: str, dst_text: str) -> str:
+    """把代表样本的完整输出改写为成员样本的输出 (只替换 Target/Argument)。"""
+    quads = parse_quadruplets(output)
+    if not quads or src_text == dst_text:
+        return output
+    rebuilt = [f"{reanchor_span(t, src_text, dst_text)} | {reanchor_span(a, src_text, dst_text)} | {g} | {h}"
+               for t, a, g, h in quads]
+    return ' [SEP] '.join(rebuilt) + ' [END]'
+
+
+def dedup_report(cluster_of, clusters, seconds_per_item: float = None) -> str:
+    n_items = len(cluster_of)
+    n_reps = len(clusters)
+    skipped = n_items - n_reps
+    lines = [
+        f"样本数 {n_items}，近重复簇 {n_reps} 个 (其中多成员簇 {sum(1 for m in clusters.values() if len(m) > 1)} 个)",
+        f"去重比例 {skipped / n_items:.2%}，可省去 {skipped} 次 generate" if n_items else "样本数为0",
+    ]
+    if seconds_per_item is not None:
+        lines.append(f"按每条 {seconds_per_item:.2f}s 估算，节省约 {skipped * seconds_per_item:.1f}s")
+    return "\n".join(lines)
+
+
+# --- 使用说明 ---
+# python near_dedup.py test2.json   # 只统计近重复簇，不做推理
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("用法: python near_dedup.py <json文件>")
+        sys.exit(1)
+    with open(sys.argv[1], 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    contents = [item['content'] for item in data]
+    cluster_of, clusters = find_clusters(contents)
+    print(dedup_report(cluster_of, clusters))
+    largest = sorted(clusters.values(), key=len, reverse=True)[:5]
+    for members in largest:
+        if len(members) < 2:
+            break
+        print("-" * 20)
+        for i in members[:5]:
+            print(f"  {data[i]['id']}: {contents[i]}")
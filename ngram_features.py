@@ -0,0 +1,57 @@
+# ngram_features.py
+# 字符 n-gram 特征：中文评论不分词，直接取字符 n-gram，并用稳定哈希映射到固定维度，
+# 这样无需保存词表，索引/模型文件只有几个数组。检索 (fewshot_retriever.py) 与分类器共用这里的实现。
+import zlib
+
+import numpy as np
+
+NGRAM_RANGE = (1, 3)
+N_FEATURES = 2 ** 20
+
+
+def char_ngrams(text: str, ngram_range=NGRAM_RANGE):
+    """返回文本的所有字符 n-gram (去掉首尾空白，保留标点和表情，它们对识别黑话也有用)。"""
+    text = text.strip()
+    n_min, n_max = ngram_range
+    grams = []
+    for n in range(n_min, n_max + 1):
+        grams.extend(text[i:i + n] for i in range(len(text) - n + 1))
+    return grams
+
+
+def hash_feature(gram: str, n_features: int = N_FEATURES) -> int:
+    # crc32 在不同进程/机器上结果一致，不能用 Python 内置的 hash (带随机种子)
+    return zlib.crc32(gram.encode('utf-8')) % n_features
+
+
+def hashed_counts(text: str, ngram_range=NGRAM_RANGE, n_features: int = N_FEATURES):
+    """文本 -> {特征列号: 出现次数}"""
+    counts = {}
+    for gram in char_ngrams(text, ngram_range):
+        col = hash_feature(gram, n_features)
+        counts[col] = counts.get(col, 0) + 1
+    return counts
+
+
+def counts_to_csr(rows, dtype=np.float32):
+    """
+    [{列号: 值}, ...] -> (data, indices, indptr) 三个CSR数组，每行的列号升序排列。
+    """
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    for i, row in enumerate(rows):
+        indptr[i + 1] = indptr[i] + len(row)
+    indices = np.empty(indptr[-1], dtype=np.int32)
+    data = np.empty(indptr[-1], dtype=dtype)
+    for i, row in enumerate(rows):
+        cols = sorted(row)
+        indices[indptr[i]:indptr[i + 1]] = cols
+        data[indptr[i]:indptr[i + 1]] = [row[c] for c in cols]
+    return data, indices, indptr
+
+
+def texts_to_csr(texts, ngram_range=NGRAM_RANGE, n_features: int = N_FEATURES):
+    """一组文本 -> 计数矩阵 (scipy CSR, 形状 len(texts) x n_features)。"""
+    from scipy.sparse import csr_matrix
+
+    data, indices, indptr = counts_to_csr([hashed_counts(t, ngram_range, n_features) for t in texts])
+    return csr_matrix((data, indices, indptr), shape=(len(texts), n_features))
@@ -0,0 +1,62 @@
+# output_format.py
+# 输出格式相关的纯文本工具 (不依赖 torch/transformers)：兜底输出、逐段格式修复等。
+# 队列的替身 worker、导出提交文件这类不加载模型的流程从这里导入，inference_utils 也转而从这里重新导出。
+import re
+
+DEFAULT_FALLBACK_OUTPUT = "NULL | NULL | non-hate | non-hate [END]"
+VALID_TARGET_GROUPS = {"Racism", "Region", "Sexism", "LGBTQ", "others", "non-hate"}
+VALID_HATEFUL_LABELS = {"hate", "non-hate"}
+# 小写 -> 规范写法；final.py 用 capitalize() 匹配，会漏掉 LGBTQ / others 这类不是首字母大写的群体
+_CANONICAL_GROUPS = {g.lower(): g for g in VALID_TARGET_GROUPS} | {"lgbt": "LGBTQ"}
+
+
+def apply_fallback(response: str) -> str:
+    """与 test.py 相同的兜底逻辑：空响应或不含分隔符时使用默认四元组。"""
+    if not response or '|' not in response:
+        return DEFAULT_FALLBACK_OUTPUT
+    return response
+
+
+def normalize_quadruplet(segment: str):
+    """
+    按 final.py 的规则修复单个四元组片段 (群体名大小写不敏感) (补全缺失字段、规范 Hateful / Targeted Group)，
+    返回 "T | A | G | H" (不带 [END])；无法修复时返回 None。
+    """
+    parts = [p.strip() for p in segment.split('|')]
+    if len(parts) == 3:
+        if parts[2].lower() in VALID_HATEFUL_LABELS:
+            parts.insert(1, "NULL")  # 补全'论点'
+        else:
+            parts.insert(2, "non-hate")  # 补全'目标群体'
+    if len(parts) != 4:
+        return None
+    target, argument, targeted_group, hateful = parts
+
+    hateful = hateful.lower()
+    if hateful not in VALID_HATEFUL_LABELS:
+        hateful = "non-hate"
+    groups = set()
+    for g in targeted_group.split(','):
+        g = g.strip().lower()
+        if g in _CANONICAL_GROUPS:
+            groups.add(_CANONICAL_GROUPS[g])
+        elif g == "null":
+            groups.add("others" if hateful == "hate" else "non-hate")
+    if not groups:
+        groups.add("others" if hateful == "hate" else "non-hate")
+    return f"{target} | {argument} | {', '.join(sorted(groups))} | {hateful}"
+
+
+def repair_output(text: str) -> str:
+    """
+    修复一条模型响应 (不含ID)。与 final.repair_and_normalize_quadruplet 不同：
+    不剥离开头的数字 (那是给带ID的提交行用的，会误删以数字开头的 Target)，并保留所有 [SEP] 分隔的四元组。
+    """
+    text = re.sub(r'[`【】*]', '', apply_fallback(text))  # 移除特殊括号、反引号、星号
+    text = re.sub(r'^-.+', '', text, flags=re.MULTILINE)  # 移除markdown列表
+    text = re.sub(r'\s*\[END\]\s*$', '', text.strip(), flags=re.IGNORECASE)
+    quads = [normalize_quadruplet(seg) for seg in re.split(r'\s*\[SEP\]\s*', text, flags=re.IGNORECASE)]
+    quads = [q for q in quads if q is not None]
+    if not quads:
+        return DEFAULT_FALLBACK_OUTPUT
+    return ' [SEP] '.join(quads) + ' [END]'
@@ -1,8 +1,5 @@
-import json
-from datasets import Dataset, DatasetDict
-from sklearn.model_selection import train_test_split
-import pandas as pd
-import re
+from datasets import DatasetDict
+from data_pipeline import batched_map, load_train_arrow, split_by_id_hash
 
 # --- 1. 定义标准化函数 ---
 def standardize_output(output_str: str) -> str:
@@ -64,33 +61,35 @@ def create_prompt(record):
     """为SFTTrainer创建最终的训练文本"""
     return f"<s>[INST] {record['instruction']}\n{record['input']} [/INST]\n{record['output']}</s>"
 
+def format_batch(batch):
+    """
+    批量版本，供多进程 .map() 使用 (顶层函数，可pickle，datasets 能为其计算稳定的缓存指纹)。
+    """
+    records = [format_data_point({'content': c, 'output': o}) for c, o in zip(batch['content'], batch['output'])]
+    return {
+        "instruction": [r['instruction'] for r in records],
+        "input": [r['input'] for r in records],
+        "output": [r['output'] for r in records],
+        "text": [create_prompt(r) for r in records],
+    }
+
 
 # --- 3. 主处理流程 ---
 def main():
-    # 加载原始JSON数据
-    # 注意：你的JSON文件可能是一个包含多个字典的列表，请根据实际情况调整加载方式
+    # 直接把JSON读入Arrow，不经过pandas
     # 这里假设你的train.json是 'list of dicts' 格式
     try:
-        with open('train.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
-    except json.JSONDecodeError:
-        print("JSON文件格式错误，请检查。它应该是一个有效的JSON列表。")
+        dataset = load_train_arrow('train.json')
+    except Exception as e:
+        print(f"JSON文件读取失败，请检查。它应该是一个有效的JSON列表。{e}")
         return
         
-    # 应用格式化函数
-    formatted_data = [format_data_point(rec) for rec in data]
-    df = pd.DataFrame(formatted_data)
-    
-    # 划分训练集和验证集
-    train_df, val_df = train_test_split(df, test_size=0.1, random_state=42)
-    
-    # 转换为Hugging Face Dataset
-    train_dataset = Dataset.from_pandas(train_df)
-    val_dataset = Dataset.from_pandas(val_df)
+    # 按ID哈希确定性划分训练集和验证集 (约10%验证集)
+    train_dataset, val_dataset = split_by_id_hash(dataset)
     
-    # 将格式化好的prompt应用到数据集中
-    train_dataset = train_dataset.map(lambda x: {"text": create_prompt(x)})
-    val_dataset = val_dataset.map(lambda x: {"text": create_prompt(x)})
+    # 批量格式化并生成prompt，重跑时命中datasets缓存
+    train_dataset = batched_map(train_dataset, format_batch, desc="格式化训练集", remove_columns=['id', 'content'])
+    val_dataset = batched_map(val_dataset, format_batch, desc="格式化验证集", remove_columns=['id', 'content'])
 
     # 创建DatasetDict
     dataset_dict = DatasetDict({
@@ -0,0 +1,263 @@
+# prefill_probe.py
+# prefill 隐状态线性探针：生成任何 token 之前，模型在 prefill 阶段已经算出了整条评论的表示。
+# 在最后一个 prompt 位置的最终隐状态上训练两个线性头 (hate/non-hate 二分类 + 5 个歧视类别的多标签)，
+# 权重只是几个 NumPy 数组，存成 .npz。推理时 prefill 完成后先过探针，
+# 有把握判为 non-hate 的条目直接输出 non-hate 四元组，并在解码开始前就从 batch (连同 KV cache) 中移除；
+# 解码过程中已经输出结束符的条目也随时移出，后续步只为仍在生成的条目计算。
+# 用法:
+#   python prefill_probe.py train                      # 抽取隐状态 + 训练 + 在验证集上调阈值
+#   python prefill_probe.py train --tiny --limit 64    # CPU 上用微型替身模型跑通流程 (探针存到 tiny-prefill_probe.npz)
+#   python benchmark.py probe                          # 省下的解码步数与 F1 变化
+import argparse
+import json
+import os
+
+import numpy as np
+import torch
+
+from cascade_classifier import is_hate, tune_threshold, validation_llm_outputs
+from data_split import split_train_validation
+from inference_utils import MAX_NEW_TOKENS, eos_token_ids, greedy_logits_processors
+from label_scoring import HATE_GROUPS
+from prompts import DEFAULT_PROMPT_NAME, render_prompt
+from scorer import parse_quadruplets
+
+TRAIN_FILE_PATH = "./train.json"
+PROBE_PATH = "./prefill_probe.npz"
+# 微型替身模型的隐状态维度不同，单独存放，避免覆盖真实模型的探针
+TINY_PROBE_PATH = "./tiny-prefill_probe.npz"
+FEATURE_CACHE_DIR = "./probe_cache"
+L2_REG = 1e-3
+LEARNING_RATE = 0.1
+EPOCHS = 500
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -30, 30)))
+
+
+def group_targets(output: str) -> np.ndarray:
+    """标准答案中出现的歧视类别 (多标签)。"""
+    groups = {g.strip() for q in parse_quadruplets(output) if q[3] == "hate" for g in q[2].split(',')}
+    return np.array([g in groups for g in HATE_GROUPS], dtype=np.float32)
+
+
+class PrefillProbe:
+    def __init__(self, mean, std, w_hate, b_hate, w_group, b_group, threshold: float, prompt_name: str):
+        self.mean, self.std = mean, std
+        self.w_hate, self.b_hate = w_hate, b_hate
+        self.w_group, self.b_group = w_group, b_group
+        self.threshold = threshold
+        self.prompt_name = prompt_name
+
+    @property
+    def hidden_size(self) -> int:
+        return len(self.mean)
+
+    @classmethod
+    def train(cls, features, hate_labels, group_labels, prompt_name: str, epochs: int = EPOCHS):
+        """标准化后用全批量梯度下降同时训练两个头 (逻辑回归 / 每类一个 sigmoid)。"""
+        mean = features.mean(axis=0)
+        std = features.std(axis=0) + 1e-6
+        X = (features - mean) / std
+        y = np.asarray(hate_labels, dtype=np.float32)
+        Y = np.asarray(group_labels, dtype=np.float32)
+        n, dim = X.shape
+        w_hate, b_hate = np.zeros(dim, dtype=np.float32), 0.0
+        w_group, b_group = np.zeros((dim, len(HATE_GROUPS)), dtype=np.float32), np.zeros(len(HATE_GROUPS), dtype=np.float32)
+        for epoch in range(epochs):
+            p = _sigmoid(X @ w_hate + b_hate)
+            err = (p - y).astype(np.float32)
+            w_hate -= LEARNING_RATE * (X.T @ err / n + L2_REG * w_hate)
+            b_hate -= LEARNING_RATE * float(err.mean())
+            P = _sigmoid(X @ w_group + b_group)
+            E = (P - Y).astype(np.float32)
+            w_group -= LEARNING_RATE * (X.T @ E / n + L2_REG * w_group)
+            b_group -= LEARNING_RATE * E.mean(axis=0)
+            if epoch % 100 == 0 or epoch == epochs - 1:
+                loss = -np.mean(y * np.log(p + 1e-9) + (1 - y) * np.log(1 - p + 1e-9))
+                print(f"  epoch {epoch:>4} hate loss {loss:.4f}")
+        return cls(mean, std, w_hate, b_hate, w_group, b_group, threshold=0.0, prompt_name=prompt_name)
+
+    def predict(self, features):
+        """返回 (hate 概率, 各歧视类别概率)。"""
+        X = (np.asarray(features, dtype=np.float32) - self.mean) / self.std
+        return _sigmoid(X @ self.w_hate + self.b_hate), _sigmoid(X @ self.w_group + self.b_group)
+
+    def non_hate_risk(self, features) -> np.ndarray:
+        """两个头都认为是仇恨的可能性中较大者；越低越有把握是 non-hate。"""
+        p_hate, p_group = self.predict(features)
+        return np.maximum(p_hate, p_group.max(axis=1))
+
+    def skip_mask(self, features) -> np.ndarray:
+        features = np.asarray(features)
+        if features.shape[-1] != self.hidden_size:
+            raise ValueError(f"隐状态维度为 {features.shape[-1]}，探针是在 {self.hidden_size} 维的模型上训练的")
+        return self.non_hate_risk(features) < self.threshold
+
+    def save(self, path: str = PROBE_PATH):
+        np.savez_compressed(path, mean=self.mean, std=self.std, w_hate=self.w_hate, b_hate=np.float32(self.b_hate),
+                            w_group=self.w_group, b_group=self.b_group, threshold=np.float32(self.threshold),
+                            prompt_name=np.array(self.prompt_name), hidden_size=np.int64(self.hidden_size))
+
+    @classmethod
+    def load(cls, path: str = PROBE_PATH, hidden_size: int = None):
+        """hidden_size 不为空时检查与探针训练时的模型一致，不一致直接报错。"""
+        data = np.load(path)
+        stored = int(data['hidden_size']) if 'hidden_size' in data.files else len(data['mean'])
+        if hidden_size is not None and stored != hidden_size:
+            raise ValueError(f"探针 '{path}' 是在隐状态维度 {stored} 的模型上训练的，当前模型为 {hidden_size}；"
+                             f"请用当前模型重新训练 (微型替身模型的探针保存在 '{TINY_PROBE_PATH}')")
+        return cls(data['mean'], data['std'], data['w_hate'], float(data['b_hate']), data['w_group'],
+                   data['b_group'], float(data['threshold']), str(data['prompt_name']))
+
+
+def probe_path(tiny: bool = False) -> str:
+    return TINY_PROBE_PATH if tiny else PROBE_PATH
+
+
+@torch.no_grad()
+def extract_features(model, tokenizer, contents, prompt_name: str = DEFAULT_PROMPT_NAME, batch_size: int = 8):
+    """prefill 最后一个位置的最终隐状态 (经过最后的 norm)，返回 float32 数组 (N, hidden)。"""
+    backbone = model.base_model
+    features = []
+    for start in range(0, len(contents), batch_size):
+        prompts = [render_prompt(tokenizer, c, prompt_name) for c in contents[start:start + batch_size]]
+        inputs = tokenizer(prompts, return_tensors="pt", padding=True).to(model.device)
+        out = backbone(**inputs, use_cache=False)
+        features.append(out.last_hidden_state[:, -1].float().cpu().numpy())
+        print(f"  已抽取 {min(start + batch_size, len(contents))}/{len(contents)}")
+    return np.concatenate(features)
+
+
+def _select_rows(past_key_values, index):
+    """只保留 batch 中 index 指定的行 (KV cache 原地裁剪)。"""
+    if hasattr(past_key_values, "batch_select_indices"):
+        past_key_values.batch_select_indices(index)
+        return past_key_values
+    return tuple(tuple(t[index] for t in layer) for layer in past_key_values)
+
+
+@torch.no_grad()
+def generate_with_probe(model, tokenizer, inputs, probe: PrefillProbe = None, max_new_tokens: int = MAX_NEW_TOKENS):
+    """
+    贪心批量生成。prefill 后探针有把握判为 non-hate 的行不再解码 (对应结果为 None，由调用方输出 non-hate 四元组)；
+    其余行逐步解码，输出结束符的行立即移出 batch。probe 为 None 时不跳过任何行 (对照组)。
+    每步先经过与 model.generate 相同的 logits 处理 (重复惩罚等) 再取 argmax，输出与生产环境的贪心解码一致。
+    返回 (响应列表, 统计)，统计中 row_steps 为实际执行的 (行, 解码步) 数。
+    """
+    backbone = model.base_model
+    lm_head = model.get_output_embeddings()
+    processors = greedy_logits_processors(model)
+    eos_ids = eos_token_ids(model, tokenizer)
+    input_ids = inputs['input_ids']
+    attention_mask = inputs.get('attention_mask')
+    if attention_mask is None:
+        attention_mask = torch.ones_like(input_ids)
+    positions = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+    batch = input_ids.shape[0]
+
+    out = backbone(input_ids=input_ids, attention_mask=attention_mask, position_ids=positions, use_cache=True)
+    hidden = out.last_hidden_state[:, -1]
+    if probe is not None:
+        skip = probe.skip_mask(hidden.float().cpu().numpy())
+    else:
+        skip = np.zeros(batch, dtype=bool)
+    stats = {"skipped": int(skip.sum()), "row_steps": 0}
+    tokens = [[] for _ in range(batch)]
+
+    active = [i for i in range(batch) if not skip[i]]
+    past = out.past_key_values
+    # 重复惩罚需要看到 prompt + 已生成的 token (与 generate 相同，包含左填充)
+    sequences = input_ids
+    if active and len(active) < batch:
+        index = torch.tensor(active, device=input_ids.device)
+        past = _select_rows(past, index)
+        attention_mask, positions, hidden = attention_mask[index], positions[index], hidden[index]
+        sequences = sequences[index]
+    positions = positions[:, -1:]
+
+    for step in range(max_new_tokens if active else 0):
+        next_ids = processors(sequences, lm_head(hidden).float()).argmax(-1)
+        stats["row_steps"] += len(active)
+        keep = []
+        for k, (row, token) in enumerate(zip(active, next_ids.tolist())):
+            if token in eos_ids:
+                continue
+            tokens[row].append(token)
+            keep.append(k)
+        if not keep or step == max_new_tokens - 1:
+            break
+        if len(keep) < len(active):
+            index = torch.tensor(keep, device=input_ids.device)
+            past = _select_rows(past, index)
+            attention_mask, positions, next_ids = attention_mask[index], positions[index], next_ids[index]
+            sequences = sequences[index]
+            active = [active[k] for k in keep]
+        sequences = torch.cat([sequences, next_ids[:, None]], dim=-1)
+        attention_mask = torch.cat([attention_mask, attention_mask.new_ones((len(active), 1))], dim=-1)
+        positions = positions + 1
+        out = backbone(input_ids=next_ids[:, None], attention_mask=attention_mask, position_ids=positions,
+                       past_key_values=past, use_cache=True)
+        past, hidden = out.past_key_values, out.last_hidden_state[:, -1]
+
+    responses = [None if skip[i] else tokenizer.decode(tokens[i], skip_special_tokens=True).strip()
+                 for i in range(batch)]
+    return responses, stats
+
+
+def model_key(args) -> str:
+    """特征缓存中区分模型：微型替身模型，或 后端 + 基座/适配器权重文件的摘要 (重新训练适配器后自动失效)。"""
+    from inference_utils import model_fingerprint
+
+    return "tiny" if args.tiny else f"{args.backend}-{model_fingerprint()}"
+
+
+def cached_features(model, tokenizer, items, name: str, prompt_name: str, batch_size: int, key: str):
+    """隐状态抽取很慢，按 (模型, 划分, prompt, 条数) 缓存到 probe_cache/ 下。"""
+    os.makedirs(FEATURE_CACHE_DIR, exist_ok=True)
+    path = os.path.join(FEATURE_CACHE_DIR, f"{key}-{name}-{prompt_name}-{len(items)}.npy")
+    if os.path.exists(path):
+        return np.load(path)
+    features = extract_features(model, tokenizer, [item['content'] for item in items], prompt_name, batch_size)
+    np.save(path, features)
+    return features
+
+
+def main():
+    parser = argparse.ArgumentParser(description="prefill 隐状态线性探针")
+    parser.add_argument("command", choices=["train"])
+    parser.add_argument("--train-file", default=TRAIN_FILE_PATH)
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT_NAME, help="必须与推理时使用的 prompt 一致")
+    parser.add_argument("--llm-preds", help="LLM 在验证集上的预测文件 (id 输出 格式)；缺省时按标准答案计")
+    parser.add_argument("--limit", type=int, default=0, help="训练/验证各最多取多少条 (0 表示全部)")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--backend", default="4bit")
+    parser.add_argument("--tiny", action="store_true", help="使用随机初始化的微型替身模型 (CPU)")
+    args = parser.parse_args()
+
+    from inference_utils import load_model, load_tiny_model, load_tokenizer
+
+    with open(args.train_file, 'r', encoding='utf-8') as f:
+        train, val = split_train_validation(json.load(f))
+    if args.limit:
+        train, val = train[:args.limit], val[:args.limit]
+    print(f"训练 {len(train)} 条，验证 {len(val)} 条")
+
+    tokenizer = load_tokenizer()
+    model = load_tiny_model(tokenizer) if args.tiny else load_model(backend=args.backend)
+    key = model_key(args)
+    train_x = cached_features(model, tokenizer, train, "train", args.prompt, args.batch_size, key)
+    val_x = cached_features(model, tokenizer, val, "val", args.prompt, args.batch_size, key)
+
+    probe = PrefillProbe.train(train_x, [is_hate(i['output']) for i in train],
+                               np.stack([group_targets(i['output']) for i in train]), args.prompt)
+    llm_outputs = validation_llm_outputs(val, args.llm_preds)
+    probe.threshold, _ = tune_threshold(probe.non_hate_risk(val_x), val, llm_outputs, saved_label="跳过解码")
+    path = probe_path(args.tiny)
+    probe.save(path)
+    print(f"探针已保存到 '{path}'")
+
+
+if __name__ == "__main__":
+    main()
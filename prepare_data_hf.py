@@ -1,13 +1,14 @@
 # prepare_data_hf.py
-import json
-import pandas as pd
 from datasets import Dataset, DatasetDict
-from sklearn.model_selection import train_test_split
 from transformers import AutoTokenizer
+from data_pipeline import batched_map, load_train_arrow, split_by_id_hash
+from prompts import get_prompt
 
 # 模型的ID，我们需要用它的分词器来应用模板
 # 将它修改为本地路径:
 MODEL_ID = "/root/autodl-tmp/Qwen1.5-7B-Chat"
+# 训练数据文件；可改为 profile_train_data.py 生成的去重版本 './train_dedup.json'
+TRAIN_FILE = 'train.json'
 
 # 1. 标准化函数 (和之前一样，用于处理标签)
 def standardize_output(output_str: str) -> str:
@@ -27,21 +28,57 @@ def standardize_output(output_str: str) -> str:
     return final_output
 
 # 2. 使用官方ChatML模板进行格式化的函数
-def format_with_chat_template(example, tokenizer):
+def build_chat_messages(example):
     # 系统指令
-    system_prompt = "你是一个中文仇恨言论识别专家。请根据输入文本，抽取出所有仇恨言论四元组。每个四元组的格式为'评论对象 | 论点 | 目标群体 | 是否仇恨'，并以'[END]'结尾。多个四元组用'[SEP]'分隔。注意：'目标群体'必须是 'Region', 'Racism', 'Sexism', 'LGBTQ', 'others', 'non-hate'中的一个或多个（用逗号和空格分隔，并按字母排序）。'是否仇恨'必须是 'hate' 或 'non-hate'。输出必须严格遵守格式。"
+    system_prompt = get_prompt("compact_v1")
     
     # 构建消息列表
-    messages = [
+    return [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": example['content']},
         {"role": "assistant", "content": standardize_output(example['output'])}
     ]
-    
-    # 使用分词器的apply_chat_template方法
-    # add_generation_prompt=False表示我们同时提供了user和assistant的内容，用于训练
-    formatted_text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=False)
-    return {"text": formatted_text}
+
+class ChatTemplateFormatter:
+    """
+    可 pickle 的批量格式化器，供多进程 .map() 使用。
+    只有 model_id 参与序列化，分词器在各个进程中首次调用时才加载，
+    因此 datasets 的指纹只取决于 model_id 和代码本身，输入不变时可以直接命中缓存。
+    """
+    def __init__(self, model_id):
+        self.model_id = model_id
+        self._tokenizer = None
+
+    def __getstate__(self):
+        return {"model_id": self.model_id}
+
+    def __setstate__(self, state):
+        self.model_id = state["model_id"]
+        self._tokenizer = None
+
+    def __call__(self, batch):
+        if self._tokenizer is None:
+            self._tokenizer = AutoTokenizer.from_pretrained(self.model_id, trust_remote_code=True)
+        texts = []
+        for content, output in zip(batch['content'], batch['output']):
+            # add_generation_prompt=False表示我们同时提供了user和assistant的内容，用于训练
+            texts.append(self._tokenizer.apply_chat_template(
+                build_chat_messages({'content': content, 'output': output}),
+                tokenize=False, add_generation_prompt=False))
+        return {"text": texts}
+
+# 可选：序列打包 (见 sft_packing.py)。开启后额外输出按 PACKED_MAX_LENGTH 打包好的
+# input_ids / labels (仅 assistant 部分计算 loss) / position_ids，保存到 PACKED_OUTPUT_DIR
+PACK_SEQUENCES = False
+PACKED_MAX_LENGTH = 1024
+PACKED_OUTPUT_DIR = './hf_packed_data'
+TRAIN_BATCH_SIZE = 8  # 仅用于 padding 效率报告
+
+def pack_split(dataset, tokenizer):
+    from sft_packing import pack_examples, padding_report, tokenize_chat_example
+    tokenized = [tokenize_chat_example(tokenizer, build_chat_messages(ex), PACKED_MAX_LENGTH) for ex in dataset]
+    padding_report([len(t['input_ids']) for t in tokenized], TRAIN_BATCH_SIZE, PACKED_MAX_LENGTH)
+    return Dataset.from_list(pack_examples(tokenized, PACKED_MAX_LENGTH))
 
 # 3. 主处理流程
 def main():
@@ -50,21 +87,18 @@ def main():
     tokenizer = AutoTokenizer.from_pretrained(MODEL_ID, trust_remote_code=True)
     
     print("开始加载和处理JSON数据...")
-    with open('train.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
-        
-    df = pd.DataFrame(data)
+    # 直接读入Arrow，不经过pandas
+    dataset = load_train_arrow(TRAIN_FILE)
     
     print("划分训练集和验证集...")
-    train_df, val_df = train_test_split(df, test_size=0.1, random_state=42)
-    
-    train_dataset = Dataset.from_pandas(train_df)
-    val_dataset = Dataset.from_pandas(val_df)
+    # 按ID哈希确定性划分 (约10%验证集)，数据增删不会打乱已有样本的归属
+    train_dataset, val_dataset = split_by_id_hash(dataset)
     
     print("应用ChatML模板格式化数据...")
-    # 使用.map()方法批量处理数据
-    train_dataset = train_dataset.map(lambda x: format_with_chat_template(x, tokenizer))
-    val_dataset = val_dataset.map(lambda x: format_with_chat_template(x, tokenizer))
+    # batched + 多进程 map，格式化器可pickle，重跑时命中datasets缓存
+    formatter = ChatTemplateFormatter(MODEL_ID)
+    train_dataset = batched_map(train_dataset, formatter, desc="格式化训练集")
+    val_dataset = batched_map(val_dataset, formatter, desc="格式化验证集")
     
     dataset_dict = DatasetDict({'train': train_dataset, 'validation': val_dataset})
     
@@ -74,5 +108,11 @@ def main():
     print("\n格式化后的数据样例:")
     print(dataset_dict['train'][0]['text'])
 
+    if PACK_SEQUENCES:
+        print("\n按Qwen模板分词并打包序列...")
+        packed_dict = DatasetDict({split: pack_split(ds, tokenizer) for split, ds in dataset_dict.items()})
+        packed_dict.save_to_disk(PACKED_OUTPUT_DIR)
+        print(f"打包数据已保存到 '{PACKED_OUTPUT_DIR}' 目录下。")
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,141 @@
+# profile_train_data.py
+# 训练集去重 + token 长度分析：
+# 1. 对规范化后的评论内容做哈希，找出完全重复；再用 near_dedup.py 的 MinHash-LSH 找出近重复
+# 2. 去掉重复样本 (答案不一致的冲突样本默认保留并单独列出)，写出去重后的训练文件
+# 3. 按 Qwen chat 模板 (与 prepare_data_hf.py 相同的 compact_v1 指令) 统计 prompt / answer 的 token 长度直方图，
+#    并给出若干 max_length 截断长度下能完整保留的数据比例
+import hashlib
+import json
+
+from near_dedup import find_clusters, normalize_for_dedup
+
+MODEL_ID = "/root/autodl-tmp/Qwen1.5-7B-Chat"
+TRAIN_FILE_PATH = "./train.json"
+DEDUP_OUTPUT_PATH = "./train_dedup.json"
+# 近重复但答案不同的样本往往是有意义的标注差异，默认保留
+KEEP_CONFLICTING = True
+CANDIDATE_MAX_LENGTHS = [128, 192, 256, 384, 512, 768, 1024]
+
+
+def content_hash(text: str) -> str:
+    return hashlib.md5(normalize_for_dedup(text).encode('utf-8')).hexdigest()
+
+
+def deduplicate(data):
+    """
+    返回 (保留的样本列表, 报告字典)。
+    完全重复 = 规范化内容哈希相同；近重复 = MinHash-LSH 同簇。每组保留最早出现的一条。
+    """
+    from prepare_data_hf import standardize_output
+
+    answers = [standardize_output(item['output']) for item in data]
+    first_by_hash = {}
+    exact_rep = []
+    for i, item in enumerate(data):
+        exact_rep.append(first_by_hash.setdefault(content_hash(item['content']), i))
+
+    cluster_of, _ = find_clusters([item['content'] for item in data])
+
+    kept, exact_dropped, near_dropped, conflicts = [], [], [], []
+    for i, item in enumerate(data):
+        rep = exact_rep[i] if exact_rep[i] != i else cluster_of[i]
+        if rep == i:
+            kept.append(item)
+            continue
+        if answers[rep] != answers[i]:
+            conflicts.append((data[rep]['id'], item['id']))
+            if KEEP_CONFLICTING:
+                kept.append(item)
+                continue
+        (exact_dropped if exact_rep[i] != i else near_dropped).append((data[rep]['id'], item['id']))
+
+    report = {
+        "total": len(data),
+        "kept": len(kept),
+        "exact_dropped": exact_dropped,
+        "near_dropped": near_dropped,
+        "conflicts": conflicts,
+    }
+    return kept, report
+
+
+def print_dedup_report(report):
+    print(f"原始样本 {report['total']} 条，保留 {report['kept']} 条")
+    print(f"  完全重复删除 {len(report['exact_dropped'])} 条，近重复删除 {len(report['near_dropped'])} 条")
+    print(f"  答案不一致的重复组 {len(report['conflicts'])} 对" + (" (已保留)" if KEEP_CONFLICTING else " (已删除)"))
+    for rep_id, dup_id in report['conflicts'][:10]:
+        print(f"    冲突: ID {rep_id} vs ID {dup_id}")
+
+
+def token_lengths(data, tokenizer):
+    """返回 (prompt 长度列表, answer 长度列表)，answer 含结尾的 <|im_end|>。"""
+    from prepare_data_hf import build_chat_messages
+    from sft_packing import IGNORE_INDEX, tokenize_chat_example
+
+    prompt_lens, answer_lens = [], []
+    for item in data:
+        tokenized = tokenize_chat_example(tokenizer, build_chat_messages(item))
+        n_prompt = sum(1 for label in tokenized['labels'] if label == IGNORE_INDEX)
+        prompt_lens.append(n_prompt)
+        answer_lens.append(len(tokenized['input_ids']) - n_prompt)
+    return prompt_lens, answer_lens
+
+
+def percentile(values, q: float) -> int:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def print_histogram(name: str, values, n_bins: int = 12, width: int = 40):
+    lo, hi = min(values), max(values)
+    step = max(1, (hi - lo + n_bins) // n_bins)
+    counts = [0] * n_bins
+    for v in values:
+        counts[min(n_bins - 1, (v - lo) // step)] += 1
+    peak = max(counts)
+    print(f"\n{name} token 长度: min {lo} | p50 {percentile(values, 50)} | p95 {percentile(values, 95)} | "
+          f"p99 {percentile(values, 99)} | max {hi}")
+    for b, c in enumerate(counts):
+        start = lo + b * step
+        print(f"  {start:>5}-{start + step - 1:<5} {'#' * round(width * c / peak):<{width}} {c}")
+
+
+def suggest_max_lengths(total_lens):
+    """对候选截断长度以及 p95/p99 (向上取整到64的倍数) 给出完整保留的比例。"""
+    round64 = lambda n: (n + 63) // 64 * 64
+    candidates = sorted(set(CANDIDATE_MAX_LENGTHS) | {round64(percentile(total_lens, 95)),
+                                                      round64(percentile(total_lens, 99))})
+    print("\nmax_length 建议 (保留比例 = 不被截断的样本占比):")
+    rows = []
+    for cutoff in candidates:
+        share = sum(1 for n in total_lens if n <= cutoff) / len(total_lens)
+        rows.append((cutoff, share))
+        print(f"  max_length={cutoff:<6} 保留 {share:.2%}")
+    return rows
+
+
+def main():
+    from transformers import AutoTokenizer
+
+    with open(TRAIN_FILE_PATH, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    print("--- 去重 ---")
+    kept, report = deduplicate(data)
+    print_dedup_report(report)
+    with open(DEDUP_OUTPUT_PATH, 'w', encoding='utf-8') as f:
+        json.dump(kept, f, ensure_ascii=False, indent=2)
+    print(f"去重后的训练数据已保存到 '{DEDUP_OUTPUT_PATH}'")
+
+    print("\n--- token 长度分析 (Qwen chat 模板) ---")
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_ID, trust_remote_code=True)
+    prompt_lens, answer_lens = token_lengths(kept, tokenizer)
+    total_lens = [p + a for p, a in zip(prompt_lens, answer_lens)]
+    print_histogram("prompt", prompt_lens)
+    print_histogram("answer", answer_lens)
+    print_histogram("总计", total_lens)
+    suggest_max_lengths(total_lens)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+# prompts.py
+# Prompt 注册表：所有推理/训练脚本共用的 system prompt 都集中在这里，按"名称_版本"注册。
+# - full_v1:    test.py / test_continue.py / retried.py 原先各自复制的长版 prompt (规则 + 黑话 + 6个few-shot)
+# - compact_v1: 与 prepare_data_hf.py 微调时完全一致的短指令，LoRA 已经学过这些规则，推理时无需再付 ~10 倍的 prefill
+# - retrieval_v1: full_v1 的规则部分 + 由 fewshot_retriever.py 按输入检索、受 token 预算约束的相似样例
+# 运行 `python prompts.py` 可查看每个 prompt 在 Qwen chat 模板下的精确 token 数。
+import sys
+
+TOKENIZER_PATH = "/root/autodl-tmp/Qwen1.5-7B-Chat"
+
+# 长版 prompt 中 few-shot 样例在 train.json 中的ID (见 readme.txt)，评测时应排除
+FEW_SHOT_IDS = {396, 1778, 5219, 2825, 6458, 6159}
+
+FULL_PROMPT_V1 = '''### **任务：中文社交媒体细粒度仇恨言论识别**
+
+你是一个顶级的中文社交媒体内容审查专家，拥有社会学、语言学和网络文化背景。你的任务是精确地分析给定的文本，抽取出其中所有构成或不构成仇恨言论的观点，并严格按照指定的四元组格式输出。
+
+---
+
+### **第一部分：核心规则与定义**
+
+**1. 输出格式 (必须严格遵守):**
+- 每个观点都必须格式化为一个四元组：`评论对象 | 论点 | 目标群体 | 是否仇恨`
+- 四元组的每个元素之间用 ` | ` (空格英文半角竖线空格) 分隔。
+- 每个四元组必须以 ` [END]` (空格[END]) 结尾。
+- 如果一条文本包含多个独立的观点，不同的四元组之间用 ` [SEP] ` (空格[SEP]空格) 分隔。
+
+**2. 四元组字段定义:**
+- **评论对象 (Target):** 评论对象，观点所直接指向的人物、群体或实体。
+    - **风格对齐:** 抽取简洁的核心短语，严格重视于原文，必须是原文包含的
+    - **特殊情况:** 如果言论是泛指或隐含的，没有明确的评论对象，则设为 `NULL`。
+- **论点 (Argument):** 对“评论对象”的核心评价、行为描述或观点。
+    - **风格对齐:** 必须是从原文中抽取的、最能代表核心观点的简洁短语或子句，不要自创，标点符号也要与原文保持一致。
+- **目标群体 (Targeted Group):** 对“评论对象-论点”组合所攻击的群体进行的分类。必须是以下标签之一或多个的组合：
+    - `Racism`: 种族或民族歧视。
+    - `Region`: 地域歧视。
+    - `Sexism`: 性别歧视。
+    - `LGBTQ`: 对性少数群体的歧视。
+    - `others`: 其他类型的歧视（如针对残障、疾病、宗教、职业等）。
+    - `non-hate`: 不构成对特定群体的仇恨。
+- **是否仇恨 (Hateful):** 对该观点是否构成仇恨言论的判断。
+    - `hate`: 构成仇恨言论。
+    - `non-hate`: 不构成仇恨言论（包括一般性人身攻击或无害评论）。
+
+**3. 黄金规则 (为硬匹配优化):**
+- **分类标签必须完美:** `Targeted Group` 和 `Hateful` 的标签必须与上述列表完全一致，包括大小写。
+- **多标签必须排序:** 如果一个观点涉及多个`目标群体`，标签**必须按照英文字母顺序排序**，并用 `, ` (逗号+空格) 分隔。例如：应为 `Racism, Sexism`，而不是 `Sexism, Racism`。
+
+**4. 常见网络黑话/隐语提示:**
+- 为了帮助你更好地理解，以下是一些常见的隐语及其通常指向的歧视类别：
+- Racism：
+  - 黑蛆、黑皮、泥革、墨人、尼葛 → Racism
+  - 黑人器大活好、非洲boy、黑人传艾滋 → Racism
+  - 倭狗、日杂、韩畜 → Racism / Other
+- Sexism：
+  - 女拳、钕拳、小仙女、小酰钕、普信女、eg → Sexism
+  - 母狗、母坦克、母零 → Sexism
+  - 公、郭楠、龟男、直男癌 → Sexism
+- LGBTQ：
+  - 基佬、gay、腐癌、txl、同性癖、打拳、虹拳、跪虫族 → LGBTQ
+- Region：
+  - 东北人、南蛮、南满、北狄、冀东辽西 → Region
+  - 河南、河北、安徽、广东、江苏等地名 + 嘲讽、污蔑语言 → Region
+---
+
+### **第二部分：典型样本学习 (Few-shot Examples)**
+
+下面是几个经过精心挑选的例子，请仔细学习其内在逻辑。
+
+**【样例1：简单直接的例子】**
+- **输入:** `没爹的黑孩到处扔`
+- **输出:** `没爹的黑孩 | 到处扔 | Racism | hate [END]`
+- **//分析:** 直接针对特定种族（黑孩）进行恶意攻击，是明确的种族主义仇恨言论。
+
+**【样例2：多标签的例子】**
+- **输入:** `我靠真能下得去手啊，我去主校区的时候也见过几个又黑又肥又丑看不清脸，可能是我的学校太好了女生都挺保守的，没听说也没看见哪个女生和黑人谈恋爱`
+- **输出:** `黑人 | 没听说也没看见哪个女生和黑人谈恋爱 | Racism, Sexism | hate [END]`
+- **//分析:** 观点核心是“女生不应和黑人谈恋爱”。这既包含了对黑人群体的负面刻板印象（`Racism`），也包含了对女性择偶自由的物化和限制（`Sexism`）。注意标签已按字母排序。
+
+**【样例3：多四元组的例子】**
+- **输入:** `想反女权还得看女权，舔狗龟男理中客们不是男人能打醒的`
+- **输出:** `女权 | 想反女权还得看女权 | Sexism | hate [SEP] 舔狗龟男理中客们 | 不是男人能打醒的 | Sexism | hate [END]`
+- **//分析:** 文本包含两个独立的攻击点。第一个指向“女权”，第二个指向“舔狗龟男理中客们”，都与性别议题相关。因此需要拆分为两个四元组，用 `[SEP]` 分隔。
+
+**【样例4：NULL目标的例子】**
+- **输入:** `都弯了180度所以直了`
+- **输出:** `NULL | 弯了180度所以直了 | LGBTQ | hate [END]`
+- **//分析:** 这句话是网络上对同性恋群体的暗讽，没有明确说出评论对象，但仇恨指向非常清晰。因此“评论对象”为 `NULL`。
+
+**【样例5：non-hate但有争议的例子】**
+- **输入:** `无风不起浪，我就被河南人骗了几回了，没得洗`
+- **输出:** `河南人 | 骗了几回了 | non-hate | non-hate [END]`
+- **//分析:** 这是此任务标注标准的一个微妙之处。虽然内容是对特定地域人群的负面概括，但因为它基于“个人经历”的叙述，并未上升到鼓吹普遍性歧视或攻击的程度，因此被标注为 `non-hate`。你需要学习这种边界。
+
+**【样例6：包含网络黑话的例子】**
+- **输入:** `就算她不拿刀你就能打得过180斤起步的母坦克?`
+- **输出:** `母坦克 | 180斤起步 | Sexism | hate [END]`
+- **//分析:** 这里的核心攻击点是蔑称“母坦克”，这是一个基于体重的、对女性的侮辱性黑话，属于性别歧视 `Sexism`。
+
+---
+
+### **第三部分：开始任务**
+
+现在，你已经掌握了所有规则和模式。请处理以下新的输入文本，并只返回严格符合格式要求的四元组输出，不要添加任何额外的解释或评论。注意！！只输出最后的结果就可以，不要输出任何别的内容！！
+**警告：输出格式的绝对精确性**
+- 你的输出将用于机器自动评测，任何格式错误，即使是单个空格、大小写或标点符号的偏差，都将导致评测失败。
+- 请像机器一样精确地输出，不要添加任何与格式无关的、解释性的文字。你的整个回答应该只有四元组本身。'''
+
+# 与 prepare_data_hf.py 训练时使用的 system prompt 逐字一致
+COMPACT_PROMPT_V1 = "你是一个中文仇恨言论识别专家。请根据输入文本，抽取出所有仇恨言论四元组。每个四元组的格式为'评论对象 | 论点 | 目标群体 | 是否仇恨'，并以'[END]'结尾。多个四元组用'[SEP]'分隔。注意：'目标群体'必须是 'Region', 'Racism', 'Sexism', 'LGBTQ', 'others', 'non-hate'中的一个或多个（用逗号和空格分隔，并按字母排序）。'是否仇恨'必须是 'hate' 或 'non-hate'。输出必须严格遵守格式。"
+
+# 检索式 few-shot (retrieval_v1)：沿用 full_v1 的规则与任务说明，第二部分的6个固定样例
+# 换成 fewshot_retriever.py 按输入检索出的相似样本
+_FULL_RULES_V1, _FULL_REST_V1 = FULL_PROMPT_V1.split("### **第二部分", 1)
+_FULL_TASK_V1 = "### **第三部分" + _FULL_REST_V1.split("### **第三部分", 1)[1]
+RETRIEVAL_EXAMPLES_HEADER_V1 = """### **第二部分：相似样本参考 (Retrieved Examples)**
+
+下面是从已标注数据中检索出的、与待处理文本最相似的样本，请参考其抽取粒度和标注尺度。
+
+"""
+
+
+def format_example(index: int, content: str, output: str) -> str:
+    """与 full_v1 中样例相同的排版。"""
+    return f"**【样例{index}】**\n- **输入:** `{content}`\n- **输出:** `{output}`\n\n"
+
+
+def format_retrieval_prompt(examples) -> str:
+    """examples: [(content, output), ...]，按相似度从高到低排列。"""
+    if not examples:
+        return _FULL_RULES_V1 + _FULL_TASK_V1
+    body = "".join(format_example(i + 1, c, o) for i, (c, o) in enumerate(examples))
+    return _FULL_RULES_V1 + RETRIEVAL_EXAMPLES_HEADER_V1 + body + "---\n\n" + _FULL_TASK_V1
+
+
+PROMPTS = {
+    "full_v1": {
+        "text": FULL_PROMPT_V1,
+        "description": "长版规则+黑话+6个few-shot (原 test.py 推理 prompt)",
+    },
+    "compact_v1": {
+        "text": COMPACT_PROMPT_V1,
+        "description": "与微调指令一致的短 prompt，适用于 LoRA 微调后的模型",
+    },
+    "retrieval_v1": {
+        "text": format_retrieval_prompt([]),
+        "description": "full_v1 的规则 + 动态检索的相似样例 (此处为不含样例的基础开销)",
+    },
+}
+
+DEFAULT_PROMPT_NAME = "full_v1"
+
+
+def get_prompt(name: str = DEFAULT_PROMPT_NAME) -> str:
+    """按名称取出 system prompt 文本。"""
+    if name not in PROMPTS:
+        raise KeyError(f"未注册的prompt: '{name}'，可选: {', '.join(PROMPTS)}")
+    return PROMPTS[name]["text"]
+
+
+def build_messages(content: str, prompt_name: str = DEFAULT_PROMPT_NAME, system_prompt: str = None):
+    """构造一条待推理样本的 chat 消息列表；传入 system_prompt 时覆盖注册表中的文本。"""
+    if system_prompt is None:
+        system_prompt = get_prompt(prompt_name)
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": content},
+    ]
+
+
+def render_prompt(tokenizer, content: str, prompt_name: str = DEFAULT_PROMPT_NAME, system_prompt: str = None) -> str:
+    """套用 chat 模板，返回可直接送入分词器的推理文本。"""
+    messages = build_messages(content, prompt_name, system_prompt)
+    return tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+
+
+def count_prompt_tokens(tokenizer, prompt_name: str = DEFAULT_PROMPT_NAME, content: str = "") -> int:
+    """
+    返回在 Qwen chat 模板下的精确 token 数。
+    content 为空时即为每条样本都要付出的固定 prefill 开销 (system + 模板标记 + 生成前缀)。
+    """
+    messages = build_messages(content, prompt_name)
+    return len(tokenizer.apply_chat_template(messages, tokenize=True, add_generation_prompt=True))
+
+
+def report_token_costs(tokenizer):
+    """打印所有已注册 prompt 的 token 开销。"""
+    rows = [(name, count_prompt_tokens(tokenizer, name), PROMPTS[name]["description"]) for name in PROMPTS]
+    print(f"{'名称':<14}{'tokens':>8}  说明")
+    for name, n_tokens, desc in rows:
+        print(f"{name:<14}{n_tokens:>8}  {desc}")
+    return rows
+
+
+if __name__ == "__main__":
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(sys.argv[1] if len(sys.argv) > 1 else TOKENIZER_PATH, trust_remote_code=True)
+    report_token_costs(tokenizer)
@@ -0,0 +1,150 @@
+# quad_streamer.py
+# 增量输出四元组：下游的审核动作往往只需要第一个 hate 四元组，而以前要等整个 generate 结束、解码完才有结果。
+# QuadrupletStreamer 挂在 generate 循环上，每生成一个 token 就增量解码，一旦出现 " [SEP]" 或 " [END]" 边界，
+# 立即把刚写完的四元组解析出来，通过回调或迭代器交给调用方；调用方也可以随时要求提前停止生成。
+# 首个四元组的延迟与总延迟分别统计。
+import queue
+import re
+import threading
+import time
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList
+from transformers.generation.streamers import BaseStreamer
+
+from inference_utils import MAX_NEW_TOKENS
+from scorer import parse_quadruplets
+
+_BOUNDARY = re.compile(r'\[(SEP|END)\]', re.IGNORECASE)
+_DONE = object()
+
+
+class QuadrupletStreamer(BaseStreamer):
+    """
+    只支持 batch=1 (与 transformers 自带的 streamer 相同)。
+    callback(quad, elapsed_sec) 在每个四元组完成时调用；同时四元组也会放入内部队列供迭代。
+    """
+
+    def __init__(self, tokenizer, callback=None):
+        self.tokenizer = tokenizer
+        self.callback = callback
+        self.token_ids = []
+        self.text = ""
+        self.consumed = 0
+        self.prompt_skipped = False
+        self.stop_requested = False
+        self.quads = []
+        self.start_time = time.perf_counter()
+        self.first_quad_sec = None
+        self.total_sec = None
+        # 后台 generate 抛出的异常，迭代结束时在调用方线程重新抛出
+        self.error = None
+        self._queue = queue.Queue()
+
+    def put(self, value):
+        # generate 第一次调用 put 传入的是 prompt，跳过
+        if not self.prompt_skipped:
+            self.prompt_skipped = True
+            return
+        self.token_ids.extend(value.reshape(-1).tolist())
+        text = self.tokenizer.decode(self.token_ids, skip_special_tokens=True)
+        # 多字节字符被拆成多个 token 时，中间状态会解码出替换字符，等下一个 token 补全
+        if text.endswith('�'):
+            return
+        self.text = text
+        self._emit_complete_segments()
+
+    def end(self):
+        # generate 正常结束时自己会调用一次，start_streaming 的 finally 里还会再调用一次
+        if self.total_sec is not None:
+            return
+        # 没有以 [END] 结尾的最后一段 (被截断或模型漏写) 也尝试解析一次
+        self._emit_segment(self.text[self.consumed:])
+        self.consumed = len(self.text)
+        self.total_sec = time.perf_counter() - self.start_time
+        self._queue.put(_DONE)
+
+    def _emit_complete_segments(self):
+        while True:
+            match = _BOUNDARY.search(self.text, self.consumed)
+            if match is None:
+                return
+            self._emit_segment(self.text[self.consumed:match.start()])
+            self.consumed = match.end()
+
+    def _emit_segment(self, segment: str):
+        for quad in parse_quadruplets(segment):
+            elapsed = time.perf_counter() - self.start_time
+            if self.first_quad_sec is None:
+                self.first_quad_sec = elapsed
+            self.quads.append(quad)
+            if self.callback is not None:
+                self.callback(quad, elapsed)
+            self._queue.put(quad)
+
+    def stop(self):
+        """请求提前结束生成 (例如已经拿到了需要的 hate 四元组)。"""
+        self.stop_requested = True
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is _DONE:
+                if self.error is not None:
+                    raise self.error
+                return
+            yield item
+
+    def stats(self):
+        return {"first_quad_sec": self.first_quad_sec, "total_sec": self.total_sec, "n_quads": len(self.quads)}
+
+
+class StopOnRequest(StoppingCriteria):
+    def __init__(self, streamer: QuadrupletStreamer):
+        self.streamer = streamer
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return self.streamer.stop_requested
+
+
+def start_streaming(model, tokenizer, inputs, callback=None, max_new_tokens: int = MAX_NEW_TOKENS):
+    """
+    在后台线程中启动 generate，立即返回 streamer；迭代 streamer 即可按完成顺序拿到四元组。
+    generate 抛出的异常会在迭代到末尾时重新抛出。
+    """
+    streamer = QuadrupletStreamer(tokenizer, callback)
+
+    def run():
+        # generate 出错时 (如 OOM) 也必须 end()，否则迭代 streamer 的调用方会永远阻塞
+        try:
+            with torch.no_grad():
+                model.generate(
+                    **inputs,
+                    max_new_tokens=max_new_tokens,
+                    do_sample=False,
+                    pad_token_id=tokenizer.eos_token_id,
+                    streamer=streamer,
+                    stopping_criteria=StoppingCriteriaList([StopOnRequest(streamer)])
+                )
+        except Exception as e:
+            streamer.error = e
+        finally:
+            streamer.end()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    streamer.thread = thread
+    return streamer
+
+
+def first_hateful_quadruplet(model, tokenizer, inputs, max_new_tokens: int = MAX_NEW_TOKENS):
+    """返回 (第一个 hate 四元组或 None, 统计)。拿到 hate 四元组后立即停止生成。"""
+    streamer = start_streaming(model, tokenizer, inputs, max_new_tokens=max_new_tokens)
+    found = None
+    for quad in streamer:
+        if quad[3] == "hate":
+            found = quad
+            streamer.stop()
+            break
+    streamer.thread.join()
+    return found, streamer.stats()
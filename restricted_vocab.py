@@ -0,0 +1,132 @@
+# restricted_vocab.py
+# 受限词表解码：Qwen 词表约 15 万，每个解码步最后的 lm_head 投影 (hidden x 150k) 占了相当大的开销。
+# 而我们的输出只会用到输入评论里的 token，加上几十个格式/标签 token (|、[SEP]、[END]、NULL、群体名、hate/non-hate)。
+# 这里每个 batch 先求出允许 token id 的并集，把 lm_head 权重按这些行切片，每步只计算这一小块 logits。
+# 在该限制下对贪心解码是精确的：结果与"完整 logits + 屏蔽非允许 token"的贪心解码一致 (除浮点并列的极端情况)。
+# 切片 logits 填回完整词表的一行 (其余为 -inf) 后再经过与 model.generate 相同的重复惩罚等处理，之后才取 argmax。
+import torch
+
+from inference_utils import MAX_NEW_TOKENS, eos_token_ids, greedy_logits_processors
+from label_scoring import HATE_GROUPS
+
+FORMAT_STRINGS = [" | ", "|", " [SEP] ", "[SEP]", " [END]", "[END]", "NULL", "hate", "non-hate", ", ", "\n"]
+
+
+def _variants(text: str):
+    return (text, " " + text)
+
+
+def format_token_ids(tokenizer):
+    """格式与标签部分可能出现的全部 token (带/不带前导空格两种分词)，以及结束符。"""
+    ids = set()
+    for text in FORMAT_STRINGS + HATE_GROUPS + ["non-hate | non-hate"]:
+        for variant in _variants(text):
+            ids.update(tokenizer(variant, add_special_tokens=False)['input_ids'])
+    for token in (tokenizer.eos_token, tokenizer.pad_token, "<|im_end|>", "<|endoftext|>"):
+        token_id = tokenizer.convert_tokens_to_ids(token) if token else None
+        if token_id is not None and token_id != tokenizer.unk_token_id:
+            ids.add(token_id)
+    return ids
+
+
+def content_token_ids(tokenizer, content: str):
+    """
+    评论中的 token。模型抽取的片段是评论的子串，子串单独分词时 BPE 合并结果可能与整句不同，
+    所以除整句外再加上逐字符分词的结果，覆盖片段边界处被拆开的情况。
+    """
+    ids = set(tokenizer(content, add_special_tokens=False)['input_ids'])
+    ids.update(tokenizer(" " + content, add_special_tokens=False)['input_ids'])
+    for ch in set(content):
+        ids.update(tokenizer(ch, add_special_tokens=False)['input_ids'])
+    return ids
+
+
+def allowed_token_ids(tokenizer, contents, base_ids=None):
+    """一个 batch 的允许 token 并集，返回排好序的 id 列表。base_ids 可传入预先算好的 format_token_ids。"""
+    ids = set(base_ids if base_ids is not None else format_token_ids(tokenizer))
+    for content in contents:
+        ids.update(content_token_ids(tokenizer, content))
+    return sorted(ids)
+
+
+@torch.no_grad()
+def generate_restricted(model, tokenizer, inputs, allowed_ids, max_new_tokens: int = MAX_NEW_TOKENS):
+    """
+    受限词表贪心解码。inputs 为左填充的分词器输出；只对 allowed_ids 对应的 lm_head 行计算 logits。
+    返回 (响应文本列表, 实际解码步数)。
+    """
+    lm_head = model.get_output_embeddings()
+    processors = greedy_logits_processors(model)
+    eos_ids = eos_token_ids(model, tokenizer)
+    allowed = torch.tensor(sorted(set(allowed_ids) | eos_ids), device=lm_head.weight.device)
+    sub_weight = lm_head.weight.index_select(0, allowed)
+    sub_bias = lm_head.bias.index_select(0, allowed) if lm_head.bias is not None else None
+    eos_tensor = torch.tensor(sorted(eos_ids), device=allowed.device)
+
+    backbone = model.base_model
+    input_ids = inputs['input_ids']
+    attention_mask = inputs.get('attention_mask')
+    if attention_mask is None:
+        attention_mask = torch.ones_like(input_ids)
+    position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+    finished = torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+    step_ids, step_positions, past = input_ids, position_ids, None
+    # 重复惩罚要看到 prompt + 已生成的 token (与 generate 相同，包含左填充和已结束行补的 pad)
+    sequences = input_ids
+    vocab_size = lm_head.weight.shape[0]
+    generated = []
+    for _ in range(max_new_tokens):
+        out = backbone(input_ids=step_ids, attention_mask=attention_mask, position_ids=step_positions,
+                       past_key_values=past, use_cache=True)
+        past = out.past_key_values
+        hidden = out.last_hidden_state[:, -1].to(sub_weight.dtype)
+        logits = torch.nn.functional.linear(hidden, sub_weight, sub_bias).float()
+        if len(processors):
+            # 重复惩罚作用于 token id，填回完整词表的一行再处理；非允许 token 保持 -inf，不影响结果
+            scores = logits.new_full((logits.shape[0], vocab_size), float("-inf"))
+            scores[:, allowed] = logits
+            next_ids = processors(sequences, scores).argmax(-1)
+        else:
+            next_ids = allowed[logits.argmax(-1)]
+        next_ids = torch.where(finished, torch.full_like(next_ids, tokenizer.pad_token_id), next_ids)
+        generated.append(next_ids)
+        sequences = torch.cat([sequences, next_ids[:, None]], dim=-1)
+        finished |= torch.isin(next_ids, eos_tensor)
+        if finished.all():
+            break
+        step_ids = next_ids[:, None]
+        step_positions = step_positions[:, -1:] + 1
+        attention_mask = torch.cat([attention_mask, attention_mask.new_ones((attention_mask.shape[0], 1))], dim=-1)
+
+    new_tokens = torch.stack(generated, dim=1)
+    texts = [t.strip() for t in tokenizer.batch_decode(new_tokens, skip_special_tokens=True)]
+    return texts, len(generated)
+
+
+class AllowedTokensLogitsProcessor:
+    """对照组：照常计算完整 logits，再把非允许 token 置为 -inf。用于验证受限解码的精确性。"""
+
+    def __init__(self, allowed_ids):
+        self.allowed_ids = torch.tensor(sorted(allowed_ids))
+
+    def __call__(self, input_ids, scores):
+        mask = torch.full_like(scores, float("-inf"))
+        mask[:, self.allowed_ids.to(scores.device)] = 0
+        return scores + mask
+
+
+@torch.no_grad()
+def generate_masked_full(model, tokenizer, inputs, allowed_ids, max_new_tokens: int = MAX_NEW_TOKENS):
+    from transformers import LogitsProcessorList
+
+    allowed = set(allowed_ids) | eos_token_ids(model, tokenizer)
+    outputs = model.generate(
+        **inputs,
+        max_new_tokens=max_new_tokens,
+        do_sample=False,
+        pad_token_id=tokenizer.pad_token_id,
+        logits_processor=LogitsProcessorList([AllowedTokensLogitsProcessor(allowed)])
+    )
+    new_tokens = outputs[:, inputs['input_ids'].shape[1]:]
+    return [t.strip() for t in tokenizer.batch_decode(new_tokens, skip_special_tokens=True)]
@@ -0,0 +1,137 @@
+# scorer.py
+# 本地评测脚本：按比赛规则计算硬匹配 / 软匹配 F1。
+# - 硬匹配: Target, Argument, Targeted Group, Hateful 四个字段逐字符完全一致
+# - 软匹配: Targeted Group, Hateful 完全一致，Target 和 Argument 的字符相似度均超过 50%
+# 最终得分为硬匹配 F1 与软匹配 F1 的平均值。
+import json
+import re
+import sys
+from difflib import SequenceMatcher
+
+SOFT_MATCH_THRESHOLD = 0.5
+
+
+def parse_quadruplets(text: str):
+    """把一行模型输出/标准答案解析为 [(target, argument, group, hateful), ...]，格式不对的片段直接丢弃。"""
+    text = re.sub(r'\s*\[END\]\s*$', '', text.strip(), flags=re.IGNORECASE)
+    quads = []
+    for quad_str in re.split(r'\s*\[SEP\]\s*', text, flags=re.IGNORECASE):
+        quad_str = quad_str.replace('[END]', '').strip()
+        parts = [p.strip() for p in quad_str.split(' | ')]
+        if len(parts) != 4:
+            parts = [p.strip() for p in quad_str.split('|')]
+        if len(parts) == 4:
+            quads.append(tuple(parts))
+    return quads
+
+
+def similarity(a: str, b: str) -> float:
+    return SequenceMatcher(None, a, b).ratio()
+
+
+def is_hard_match(pred, gold) -> bool:
+    return pred == gold
+
+
+def is_soft_match(pred, gold) -> bool:
+    if pred[2] != gold[2] or pred[3] != gold[3]:
+        return False
+    return (similarity(pred[0], gold[0]) > SOFT_MATCH_THRESHOLD
+            and similarity(pred[1], gold[1]) > SOFT_MATCH_THRESHOLD)
+
+
+def count_matches(pred_quads, gold_quads, match_fn) -> int:
+    """一对一贪心匹配，返回匹配上的四元组数量 (每个标准答案四元组最多被匹配一次)。"""
+    used = set()
+    tp = 0
+    for pred in pred_quads:
+        for j, gold in enumerate(gold_quads):
+            if j not in used and match_fn(pred, gold):
+                used.add(j)
+                tp += 1
+                break
+    return tp
+
+
+def f1_from_counts(tp: int, n_pred: int, n_gold: int) -> float:
+    precision = tp / n_pred if n_pred else 0.0
+    recall = tp / n_gold if n_gold else 0.0
+    if precision + recall == 0:
+        return 0.0
+    return 2 * precision * recall / (precision + recall)
+
+
+def score_pairs(pred_texts, gold_texts):
+    """
+    逐条对齐的预测与答案列表 -> {'hard_f1', 'soft_f1', 'avg_f1', 'n'}。
+    """
+    hard_tp = soft_tp = n_pred = n_gold = 0
+    for pred_text, gold_text in zip(pred_texts, gold_texts):
+        pred_quads = parse_quadruplets(pred_text or "")
+        gold_quads = parse_quadruplets(gold_text)
+        n_pred += len(pred_quads)
+        n_gold += len(gold_quads)
+        hard_tp += count_matches(pred_quads, gold_quads, is_hard_match)
+        soft_tp += count_matches(pred_quads, gold_quads, is_soft_match)
+    hard_f1 = f1_from_counts(hard_tp, n_pred, n_gold)
+    soft_f1 = f1_from_counts(soft_tp, n_pred, n_gold)
+    return {
+        "hard_f1": hard_f1,
+        "soft_f1": soft_f1,
+        "avg_f1": (hard_f1 + soft_f1) / 2,
+        "n": len(gold_texts),
+    }
+
+
+def load_gold(json_path: str):
+    """读取带 output 字段的标注文件 (如 train.json 的验证子集)，返回 {id(str): output}。"""
+    with open(json_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return {str(item['id']): item['output'] for item in data}
+
+
+def load_predictions(path: str, ids=None):
+    """
+    读取预测文件，返回 {id(str): 输出文本}。支持两种格式：
+    - "id 输出" 格式 (test.py 的 submission*.txt)，一条记录可能跨多行
+    - 不带ID的逐行格式 (end2.txt 等)，此时需传入按顺序对齐的 ids
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    lines = [line for line in content.splitlines() if line.strip()]
+    id_lines = sum(1 for line in lines if re.match(r'^\d+\s', line))
+
+    if lines and id_lines >= len(lines) / 2:
+        # 与 final.py 相同：以"数字+空白"开头的行视为新记录的开始
+        records = {}
+        starts = list(re.finditer(r'^\d+\s', content, re.MULTILINE))
+        for i, m in enumerate(starts):
+            end = starts[i + 1].start() if i + 1 < len(starts) else len(content)
+            record_id, _, record_text = content[m.start():end].strip().partition(' ')
+            records[record_id.strip()] = record_text.strip()
+        return records
+
+    if ids is None:
+        raise ValueError(f"'{path}' 不含ID，需要提供按顺序对齐的 ids")
+    return {str(item_id): line.strip() for item_id, line in zip(ids, lines)}
+
+
+def score_files(pred_path: str, gold_path: str):
+    gold = load_gold(gold_path)
+    ids = sorted(gold, key=int)
+    preds = load_predictions(pred_path, ids)
+    return score_pairs([preds.get(i, "") for i in ids], [gold[i] for i in ids])
+
+
+def format_scores(scores) -> str:
+    return (f"hard F1 {scores['hard_f1']:.4f} | soft F1 {scores['soft_f1']:.4f} | "
+            f"avg {scores['avg_f1']:.4f} | n={scores['n']}")
+
+
+# --- 使用说明 ---
+# python scorer.py <预测文件> <带output的标注json>
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("用法: python scorer.py <预测文件> <标注json>")
+        sys.exit(1)
+    print(format_scores(score_files(sys.argv[1], sys.argv[2])))
@@ -0,0 +1,93 @@
+# self_consistency.py
+# 自洽性投票：对边界样本 (如 prompt 里提到的"non-hate 但有争议"的那类)，贪心解码在 prompt 稍有变化时就会翻转。
+# 先照常贪心解码一次并记录每个 token 的概率，只有当最低 token 概率低于阈值 (或输出无法解析) 时，
+# 才在一次 batched generate 中为该样本采样 k 个候选：prompt 只 prefill 一次，KV cache 复制 k 份后共享，
+# 再把所有候选解析成四元组，逐字段多数投票。大部分样本只走贪心，平均开销接近贪心。
+from collections import Counter
+
+import torch
+
+from inference_utils import MAX_NEW_TOKENS
+from label_scoring import _expand_cache
+from scorer import parse_quadruplets
+
+NUM_SAMPLES = 5
+CONFIDENCE_THRESHOLD = 0.5
+TEMPERATURE = 0.7
+TOP_P = 0.9
+
+
+@torch.no_grad()
+def greedy_with_confidence(model, tokenizer, inputs, max_new_tokens: int = MAX_NEW_TOKENS):
+    """贪心解码，返回 (响应文本, 置信度)。置信度取生成序列中最低的 token 概率。"""
+    out = model.generate(
+        **inputs,
+        max_new_tokens=max_new_tokens,
+        do_sample=False,
+        pad_token_id=tokenizer.eos_token_id,
+        output_scores=True,
+        return_dict_in_generate=True,
+    )
+    transition = model.compute_transition_scores(out.sequences, out.scores, normalize_logits=True)[0]
+    response_ids = out.sequences[0][inputs['input_ids'].shape[1]:]
+    keep = response_ids != tokenizer.pad_token_id
+    confidence = float(transition[keep].exp().min()) if keep.any() else 0.0
+    return tokenizer.decode(response_ids, skip_special_tokens=True).strip(), confidence
+
+
+@torch.no_grad()
+def sample_shared_prefix(model, tokenizer, inputs, k: int = NUM_SAMPLES, max_new_tokens: int = MAX_NEW_TOKENS):
+    """
+    对单条样本采样 k 个候选。prompt 除最后一个 token 外只 prefill 一次，KV cache 复制 k 份交给 generate，
+    generate 只需处理最后一个 token 即开始解码。当前 transformers 版本不支持传入 cache 时，退回 num_return_sequences。
+    """
+    input_ids = inputs['input_ids']
+    sample_kwargs = dict(max_new_tokens=max_new_tokens, do_sample=True, temperature=TEMPERATURE, top_p=TOP_P,
+                         pad_token_id=tokenizer.eos_token_id)
+    try:
+        prefix = model(input_ids=input_ids[:, :-1], use_cache=True)
+        outputs = model.generate(
+            input_ids=input_ids.repeat(k, 1),
+            attention_mask=torch.ones_like(input_ids).repeat(k, 1),
+            past_key_values=_expand_cache(prefix.past_key_values, k),
+            **sample_kwargs
+        )
+    except (TypeError, ValueError, AttributeError):
+        outputs = model.generate(**inputs, num_return_sequences=k, **sample_kwargs)
+    new_tokens = outputs[:, input_ids.shape[1]:]
+    return [t.strip() for t in tokenizer.batch_decode(new_tokens, skip_special_tokens=True)]
+
+
+def vote(responses):
+    """
+    逐字段多数投票：四元组个数取众数；第 i 个四元组的每个字段在拥有第 i 个四元组的候选中取众数。
+    标签保持一致：投出 non-hate 时目标群体也为 non-hate；投出 hate 时目标群体取候选中最常见的非 non-hate 群体。
+    """
+    parsed = [q for q in (parse_quadruplets(r) for r in responses) if q]
+    if not parsed:
+        return responses[0] if responses else ""
+    n_quads = Counter(len(q) for q in parsed).most_common(1)[0][0]
+    voted = []
+    for i in range(n_quads):
+        column = [q[i] for q in parsed if len(q) > i]
+        fields = [Counter(quad[f] for quad in column).most_common(1)[0][0] for f in range(4)]
+        if fields[3] == "non-hate":
+            fields[2] = "non-hate"
+        elif fields[2] == "non-hate":
+            hate_groups = [quad[2] for quad in column if quad[2] != "non-hate"]
+            fields[2] = Counter(hate_groups).most_common(1)[0][0] if hate_groups else "others"
+        voted.append(" | ".join(fields))
+    return " [SEP] ".join(voted) + " [END]"
+
+
+def self_consistent_generate(model, tokenizer, inputs, k: int = NUM_SAMPLES,
+                             threshold: float = CONFIDENCE_THRESHOLD, max_new_tokens: int = MAX_NEW_TOKENS):
+    """
+    返回 (响应文本, 是否触发了重采样)。
+    只有贪心结果置信度低于阈值或无法解析时才采样 k 个候选，贪心结果本身也参与投票。
+    """
+    greedy, confidence = greedy_with_confidence(model, tokenizer, inputs, max_new_tokens)
+    if confidence >= threshold and parse_quadruplets(greedy):
+        return greedy, False
+    samples = sample_shared_prefix(model, tokenizer, inputs, k, max_new_tokens)
+    return vote([greedy] + samples), True
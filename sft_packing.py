@@ -0,0 +1,166 @@
+# sft_packing.py
+# SFT 数据的序列打包与按长度分组：评论都很短且长度差异大，逐条 padding 时一个 batch 里大部分都是填充。
+# - tokenize_chat_example: 按 Qwen chat 模板分词，只对 assistant 部分计算 loss (其余 label 为 -100)
+# - pack_examples:         First-Fit-Decreasing 装箱到定长序列，position_ids 在样本边界处归零，
+#                          并记录每条样本的长度，供 PackedCollator 构造块对角因果注意力掩码
+# - LengthGroupedSampler:  不打包时，把长度相近的样本分到同一个 batch
+# - padding_report:        统计打包/分组前后的 padding 效率
+import random
+
+import torch
+from torch.utils.data import Sampler
+
+IGNORE_INDEX = -100
+
+
+def tokenize_chat_example(tokenizer, messages, max_length: int = None):
+    """
+    messages 的最后一条必须是 assistant 回复。
+    返回 {'input_ids', 'labels'}，labels 只保留 assistant 回复 (含 <|im_end|>) 部分。
+    """
+    prompt_text = tokenizer.apply_chat_template(messages[:-1], tokenize=False, add_generation_prompt=True)
+    full_text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=False)
+    prompt_ids = tokenizer(prompt_text, add_special_tokens=False)['input_ids']
+    full_ids = tokenizer(full_text, add_special_tokens=False)['input_ids']
+    if full_ids[:len(prompt_ids)] != prompt_ids:
+        raise ValueError("chat 模板渲染结果中 prompt 不是完整文本的前缀，无法定位 assistant 部分")
+    labels = [IGNORE_INDEX] * len(prompt_ids) + full_ids[len(prompt_ids):]
+    if max_length is not None:
+        full_ids, labels = full_ids[:max_length], labels[:max_length]
+    return {"input_ids": full_ids, "labels": labels}
+
+
+def pack_examples(examples, max_length: int):
+    """
+    First-Fit-Decreasing 装箱。examples: [{'input_ids', 'labels'}, ...]，单条长度不应超过 max_length。
+    返回打包后的序列列表，每条包含 input_ids / labels / position_ids / seq_lens。
+    """
+    order = sorted(range(len(examples)), key=lambda i: len(examples[i]['input_ids']), reverse=True)
+    bins = []        # 每个箱子里的样本下标
+    remaining = []   # 每个箱子剩余容量
+    for i in order:
+        length = len(examples[i]['input_ids'])
+        for b, space in enumerate(remaining):
+            if length <= space:
+                bins[b].append(i)
+                remaining[b] -= length
+                break
+        else:
+            bins.append([i])
+            remaining.append(max_length - length)
+
+    packed = []
+    for members in bins:
+        input_ids, labels, position_ids, seq_lens = [], [], [], []
+        for i in members:
+            ex = examples[i]
+            input_ids.extend(ex['input_ids'])
+            # 每条样本的第一个 token 不能去预测上一条样本，label 已经是 -100 (prompt 部分) 所以无需额外处理
+            labels.extend(ex['labels'])
+            position_ids.extend(range(len(ex['input_ids'])))
+            seq_lens.append(len(ex['input_ids']))
+        packed.append({"input_ids": input_ids, "labels": labels,
+                       "position_ids": position_ids, "seq_lens": seq_lens})
+    return packed
+
+
+class PackedCollator:
+    """
+    把打包后的序列补齐到同一长度，并构造 4D 块对角因果掩码 (batch, 1, L, L)，
+    保证同一序列中的不同样本互相不可见。使用 flash-attention 时可只依赖 position_ids 归零来划分边界。
+    """
+
+    def __init__(self, pad_token_id: int, build_4d_mask: bool = True):
+        self.pad_token_id = pad_token_id
+        self.build_4d_mask = build_4d_mask
+
+    def __call__(self, features):
+        max_len = max(len(f['input_ids']) for f in features)
+        batch = {"input_ids": [], "labels": [], "position_ids": []}
+        masks = []
+        for f in features:
+            pad = max_len - len(f['input_ids'])
+            batch["input_ids"].append(f['input_ids'] + [self.pad_token_id] * pad)
+            batch["labels"].append(f['labels'] + [IGNORE_INDEX] * pad)
+            batch["position_ids"].append(f['position_ids'] + [0] * pad)
+            if self.build_4d_mask:
+                mask = torch.zeros((max_len, max_len), dtype=torch.bool)
+                start = 0
+                for length in f['seq_lens']:
+                    mask[start:start + length, start:start + length] = torch.ones(
+                        (length, length), dtype=torch.bool).tril()
+                    start += length
+                masks.append(mask)
+        out = {k: torch.tensor(v, dtype=torch.long) for k, v in batch.items()}
+        if self.build_4d_mask:
+            # 转成加性掩码：可见位置为 0，不可见位置为 dtype 最小值
+            allowed = torch.stack(masks).unsqueeze(1)
+            out["attention_mask"] = torch.zeros(allowed.shape, dtype=torch.float32).masked_fill(
+                ~allowed, torch.finfo(torch.float32).min)
+        return out
+
+
+def length_grouped_batches(lengths, batch_size: int, seed: int = 42, mega_batch_mult: int = 50):
+    """
+    先整体打乱，再在每个 mega-batch (batch_size * mega_batch_mult 条) 内按长度降序排序后切分，
+    既让同一 batch 长度相近，又保留了 epoch 之间的随机性。
+    """
+    rng = random.Random(seed)
+    indices = list(range(len(lengths)))
+    rng.shuffle(indices)
+    mega = batch_size * mega_batch_mult
+    batches = []
+    for start in range(0, len(indices), mega):
+        chunk = sorted(indices[start:start + mega], key=lambda i: lengths[i], reverse=True)
+        batches.extend(chunk[j:j + batch_size] for j in range(0, len(chunk), batch_size))
+    rng.shuffle(batches)
+    return batches
+
+
+class LengthGroupedSampler(Sampler):
+    """按长度分组的 batch sampler，用于 DataLoader(batch_sampler=...)。每个 epoch 调用 set_epoch 换种子。"""
+
+    def __init__(self, lengths, batch_size: int, seed: int = 42):
+        self.lengths = list(lengths)
+        self.batch_size = batch_size
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def __iter__(self):
+        return iter(length_grouped_batches(self.lengths, self.batch_size, self.seed + self.epoch))
+
+    def __len__(self):
+        return (len(self.lengths) + self.batch_size - 1) // self.batch_size
+
+
+def padding_efficiency(batches, lengths) -> float:
+    """有效 token 数 / (每个 batch 补齐到其最长样本后的总 token 数)。"""
+    real = sum(lengths[i] for b in batches for i in b)
+    padded = sum(len(b) * max(lengths[i] for i in b) for b in batches if b)
+    return real / padded if padded else 1.0
+
+
+def padding_report(lengths, batch_size: int, max_length: int, seed: int = 42):
+    """比较随机 batch、按长度分组 batch、打包定长序列三种方式的 padding 效率，返回结果字典并打印。"""
+    rng = random.Random(seed)
+    indices = list(range(len(lengths)))
+    rng.shuffle(indices)
+    random_batches = [indices[i:i + batch_size] for i in range(0, len(indices), batch_size)]
+    grouped_batches = length_grouped_batches(lengths, batch_size, seed)
+
+    clipped = [min(length, max_length) for length in lengths]
+    n_bins = len(pack_examples([{"input_ids": [0] * length, "labels": []} for length in clipped], max_length))
+    report = {
+        "random": padding_efficiency(random_batches, lengths),
+        "length_grouped": padding_efficiency(grouped_batches, lengths),
+        "packed": sum(clipped) / (n_bins * max_length) if n_bins else 1.0,
+        "n_examples": len(lengths),
+        "n_packed_sequences": n_bins,
+    }
+    print(f"样本数 {report['n_examples']}，打包后序列数 {report['n_packed_sequences']} (每条 {max_length} tokens)")
+    print(f"padding 效率: 随机batch {report['random']:.2%} | 按长度分组 {report['length_grouped']:.2%} | "
+          f"打包 {report['packed']:.2%}")
+    return report
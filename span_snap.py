@@ -0,0 +1,185 @@
+# span_snap.py
+# 片段吸附：硬匹配要求 Target / Argument 与原文逐字一致，但模型常常丢掉或改掉标点、个别字。
+# 对每条评论建后缀数组，用预测片段的 k-gram 在后缀数组上二分查找得到候选对齐位置 (种子)，
+# 只在这些对角线附近的带内做编辑距离 DP，把预测片段吸附到原文中编辑距离最近的真实子串上；
+# 相似度低于 SNAP_THRESHOLD 的不做替换，只记录下来供人工检查。
+# 用法: python span_snap.py <预测文件> <测试集json> <输出文件>
+import json
+import sys
+import time
+from bisect import bisect_left
+
+from scorer import load_predictions, parse_quadruplets
+
+SEED_K = 2
+SNAP_THRESHOLD = 0.6
+MAX_SEEDS = 8
+
+
+def _suffix_array(text: str):
+    """前缀倍增构建后缀数组，只保存起点下标 (O(n) 内存，不物化任何后缀字符串)。"""
+    n = len(text)
+    sa = list(range(n))
+    if n < 2:
+        return sa
+    rank = [ord(c) for c in text]
+    k = 1
+    while True:
+        def key(i):
+            return rank[i], rank[i + k] if i + k < n else -1
+        sa.sort(key=key)
+        new_rank = [0] * n
+        for j in range(1, n):
+            new_rank[sa[j]] = new_rank[sa[j - 1]] + (key(sa[j - 1]) < key(sa[j]))
+        rank = new_rank
+        if rank[sa[-1]] == n - 1:
+            return sa
+        k *= 2
+
+
+class SuffixIndex:
+    """单条评论的后缀数组。只存后缀起点，查找时比较与模式等长的切片。"""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.sa = _suffix_array(text)
+
+    def _lower_bound(self, pattern: str) -> int:
+        m = len(pattern)
+        # 截断到 m 个字符后的顺序与完整后缀的顺序一致 (单调不减)，可以直接二分
+        return bisect_left(self.sa, pattern, key=lambda i: self.text[i:i + m])
+
+    def occurrences(self, pattern: str):
+        """返回 pattern 在原文中所有出现的起始位置。"""
+        m = len(pattern)
+        lo = self._lower_bound(pattern)
+        hits = []
+        while lo < len(self.sa) and self.text[self.sa[lo]:self.sa[lo] + m] == pattern:
+            hits.append(self.sa[lo])
+            lo += 1
+        return hits
+
+    def contains(self, pattern: str) -> bool:
+        lo = self._lower_bound(pattern)
+        return lo < len(self.sa) and self.text[self.sa[lo]:self.sa[lo] + len(pattern)] == pattern
+
+
+def _seed_diagonals(index: SuffixIndex, span: str, k: int = SEED_K):
+    """span 中每个 k-gram 在原文中的出现位置 -> 对齐起点 (原文位置 - span位置)，按得票数排序。"""
+    votes = {}
+    k = min(k, len(span))
+    for j in range(len(span) - k + 1):
+        for pos in index.occurrences(span[j:j + k]):
+            votes[pos - j] = votes.get(pos - j, 0) + 1
+    return [d for d, _ in sorted(votes.items(), key=lambda kv: -kv[1])[:MAX_SEEDS]]
+
+
+def _banded_align(span: str, window: str, diagonal: int, band: int):
+    """
+    带状半全局编辑距离：span 需要整体对齐，window 的首尾可以免费跳过，
+    但第 i 个 span 字符只允许对齐到 window 中 [diagonal+i-band, diagonal+i+band] 的范围内 (只计算带内的格子)。
+    返回 (编辑距离, 起点, 终点) —— window[起点:终点] 为最佳匹配子串。
+    """
+    inf = float('inf')
+    m = len(window)
+    prev = [inf] * (m + 1)
+    prev_start = [0] * (m + 1)
+    for j in range(max(0, min(m, diagonal - band)), min(m, max(0, diagonal + band)) + 1):
+        prev[j], prev_start[j] = 0, j
+    for i in range(1, len(span) + 1):
+        cur = [inf] * (m + 1)
+        cur_start = [0] * (m + 1)
+        ch = span[i - 1]
+        # 带超出 window 末尾时仍保留最后一列，使 span 末尾多出的字符可以按删除计入
+        for j in range(max(0, min(m, diagonal + i - band)), min(m, max(0, diagonal + i + band)) + 1):
+            best, start = prev[j] + 1, prev_start[j]
+            if j > 0:
+                if prev[j - 1] + (ch != window[j - 1]) <= best:
+                    best, start = prev[j - 1] + (ch != window[j - 1]), prev_start[j - 1]
+                if cur[j - 1] + 1 < best:
+                    best, start = cur[j - 1] + 1, cur_start[j - 1]
+            cur[j], cur_start[j] = best, start
+        prev, prev_start = cur, cur_start
+    reachable = [j for j in range(m + 1) if prev[j] < inf]
+    if not reachable:
+        # 原文在该对角线附近太短，带内无法完成对齐
+        return inf, 0, 0
+    end = min(reachable, key=lambda j: (prev[j], -(j - prev_start[j])))
+    return prev[end], prev_start[end], end
+
+
+def snap_span(span: str, index: SuffixIndex):
+    """
+    返回 (吸附后的片段, 相似度, 是否被标记)。
+    原文中已精确存在或为 NULL 的片段原样返回；相似度低于阈值时保留原片段并标记。
+    """
+    if span == "NULL" or not span or index.contains(span):
+        return span, 1.0, False
+    text = index.text
+    band = max(2, len(span) // 4)
+    best = None
+    for d in _seed_diagonals(index, span):
+        lo = max(0, d - band)
+        window = text[lo:min(len(text), d + len(span) + band)]
+        dist, s, e = _banded_align(span, window, d - lo, band)
+        candidate = text[lo + s:lo + e].strip()
+        if candidate and (best is None or dist < best[0]):
+            best = (dist, candidate)
+    if best is None:
+        return span, 0.0, True
+    dist, candidate = best
+    similarity = 1 - dist / max(len(span), len(candidate))
+    if similarity < SNAP_THRESHOLD:
+        return span, similarity, True
+    return candidate, similarity, False
+
+
+def snap_output(output: str, content: str, flagged=None):
+    """对一行输出中的所有四元组做片段吸附；flagged 列表用于收集低相似度的片段。"""
+    quads = parse_quadruplets(output)
+    if not quads:
+        return output
+    index = SuffixIndex(content)
+    rebuilt = []
+    for target, argument, group, hateful in quads:
+        snapped = []
+        for span in (target, argument):
+            new_span, similarity, is_flagged = snap_span(span, index)
+            if is_flagged and flagged is not None:
+                flagged.append((span, similarity))
+            snapped.append(new_span)
+        rebuilt.append(f"{snapped[0]} | {snapped[1]} | {group} | {hateful}")
+    return ' [SEP] '.join(rebuilt) + ' [END]'
+
+
+def snap_submission(pred_path: str, test_path: str, output_path: str):
+    with open(test_path, 'r', encoding='utf-8') as f:
+        test_data = json.load(f)
+    ids = [str(item['id']) for item in test_data]
+    preds = load_predictions(pred_path, ids)
+
+    start = time.perf_counter()
+    changed = 0
+    flagged_report = []
+    with open(output_path, 'w', encoding='utf-8') as out_f:
+        for item in test_data:
+            item_id = str(item['id'])
+            original = preds.get(item_id, "")
+            flagged = []
+            snapped = snap_output(original, item['content'], flagged)
+            changed += snapped != original
+            flagged_report.extend((item_id, span, sim) for span, sim in flagged)
+            out_f.write(f"{item_id} {snapped}\n")
+
+    print(f"处理 {len(test_data)} 条，修改 {changed} 条，耗时 {time.perf_counter() - start:.2f}s")
+    print(f"低于相似度阈值 {SNAP_THRESHOLD} 未吸附的片段 {len(flagged_report)} 个:")
+    for item_id, span, sim in flagged_report[:20]:
+        print(f"  ID {item_id}: '{span}' (最高相似度 {sim:.2f})")
+    print(f"结果已保存到 {output_path}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4:
+        print("用法: python span_snap.py <预测文件> <测试集json> <输出文件>")
+        sys.exit(1)
+    snap_submission(*sys.argv[1:])
@@ -0,0 +1,115 @@
+# static_decode.py
+# 静态 KV cache + torch.compile 解码模式：
+# 我们的输出很短 (一两个四元组)，默认动态 cache 下每个解码步的 Python 开销占了大头，CPU 上尤其明显。
+# 这里让 generate 使用预分配的静态 KV cache (batch, prompt+max_new_tokens)，前向函数用 torch.compile 编译；
+# 输入的 prompt 长度和 batch 大小都向上取整到固定的桶 (左填充)，使形状固定，编译后的图可以跨 batch 复用，
+# 只有第一次遇到某个 (batch桶, 长度桶) 时才会触发编译。
+# 每个形状桶有 prefill 和逐步解码两张图，总数远超 dynamo 默认的 cache_size_limit (8)，超过后会静默退回 eager，
+# 所以编译时把上限提高到桶数对应的图数，并打开重编译日志。bitsandbytes 4bit 模型无法 fullgraph 编译，只用静态 cache。
+import torch
+
+from inference_utils import MAX_NEW_TOKENS
+from prompts import DEFAULT_PROMPT_NAME, render_prompt
+
+LENGTH_BUCKETS = (128, 256, 512, 1024, 2048, 4096)
+BATCH_BUCKETS = (1, 2, 4, 8, 16)
+# CUDA 上用 CUDA Graphs 进一步消除 kernel 启动开销；CPU 上用默认模式
+COMPILE_MODE = "reduce-overhead" if torch.cuda.is_available() else "default"
+
+
+def compiled_graph_budget(length_buckets=LENGTH_BUCKETS, batch_buckets=BATCH_BUCKETS) -> int:
+    """全部形状桶需要的编译图数：每个 (batch桶, 长度桶) 一张 prefill 图 + 一张解码图。"""
+    return 2 * len(length_buckets) * len(batch_buckets)
+
+
+def _is_bnb_quantized(model) -> bool:
+    return bool(getattr(model, "is_loaded_in_4bit", False) or getattr(model, "is_loaded_in_8bit", False))
+
+
+def bucket_size(n: int, buckets) -> int:
+    """返回不小于 n 的最小桶；超过最大桶时按最大桶的整数倍取整。"""
+    for b in buckets:
+        if n <= b:
+            return b
+    return -(-n // buckets[-1]) * buckets[-1]
+
+
+class StaticDecoder:
+    """
+    包装一个已加载的模型，用静态 cache + 编译后的前向做贪心生成。
+    同一个 StaticDecoder 在多次调用间复用 generate 内部缓存的 StaticCache 和编译好的图。
+    """
+
+    def __init__(self, model, tokenizer, max_new_tokens: int = MAX_NEW_TOKENS, compile: bool = True,
+                 length_buckets=LENGTH_BUCKETS, batch_buckets=BATCH_BUCKETS):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_new_tokens = max_new_tokens
+        self.length_buckets = length_buckets
+        self.batch_buckets = batch_buckets
+        self.shapes_seen = set()
+        # 编译后的前向只保存在解码器上，generate 期间临时换入，结束后恢复；共享模型的其它调用方不受影响
+        self.compiled_forward = None
+        if compile and _is_bnb_quantized(model):
+            print("警告: bitsandbytes 量化模型无法 fullgraph 编译，StaticDecoder 退回 eager 前向 (仍使用静态 KV cache)。"
+                  "需要编译时请改用 bf16 / int8 后端。")
+        elif compile:
+            budget = compiled_graph_budget(length_buckets, batch_buckets)
+            dynamo_config = torch._dynamo.config
+            dynamo_config.cache_size_limit = max(dynamo_config.cache_size_limit, budget)
+            if hasattr(dynamo_config, "accumulated_cache_size_limit"):
+                dynamo_config.accumulated_cache_size_limit = max(dynamo_config.accumulated_cache_size_limit, budget)
+            # 每次重编译及其原因都打印出来；超出桶范围的超长输入会产生额外形状，在日志里可以看到
+            torch._logging.set_logs(recompiles=True)
+            self.compiled_forward = torch.compile(model.forward, mode=COMPILE_MODE, fullgraph=True, dynamic=False)
+
+    def pad_to_bucket(self, input_ids, attention_mask):
+        """左填充到 (batch桶, 长度桶)。补齐 batch 的占位行只保留最后一个 token 可见，避免整行被 mask 产生 NaN。"""
+        batch, length = input_ids.shape
+        target_len = bucket_size(length, self.length_buckets)
+        target_batch = bucket_size(batch, self.batch_buckets)
+        pad_id = self.tokenizer.pad_token_id
+        padded_ids = torch.full((target_batch, target_len), pad_id, dtype=input_ids.dtype, device=input_ids.device)
+        padded_mask = torch.zeros((target_batch, target_len), dtype=attention_mask.dtype, device=input_ids.device)
+        padded_ids[:batch, target_len - length:] = input_ids
+        padded_mask[:batch, target_len - length:] = attention_mask
+        padded_mask[batch:, -1] = 1
+        self.shapes_seen.add((target_batch, target_len))
+        return padded_ids, padded_mask
+
+    @torch.no_grad()
+    def generate(self, inputs):
+        """inputs: 分词器输出 (input_ids / attention_mask)。返回与真实行对齐的响应文本列表。"""
+        input_ids = inputs['input_ids']
+        attention_mask = inputs.get('attention_mask')
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        padded_ids, padded_mask = self.pad_to_bucket(input_ids, attention_mask)
+        original_forward = self.model.forward
+        if self.compiled_forward is not None:
+            self.model.forward = self.compiled_forward
+        try:
+            outputs = self.model.generate(
+                input_ids=padded_ids,
+                attention_mask=padded_mask,
+                max_new_tokens=self.max_new_tokens,
+                do_sample=False,
+                pad_token_id=self.tokenizer.pad_token_id,
+                cache_implementation="static"
+            )
+        finally:
+            self.model.forward = original_forward
+        new_tokens = outputs[:input_ids.shape[0], padded_ids.shape[1]:]
+        return [t.strip() for t in self.tokenizer.batch_decode(new_tokens, skip_special_tokens=True)]
+
+    def generate_responses(self, contents, prompt_name: str = DEFAULT_PROMPT_NAME, batch_size: int = 8,
+                           system_prompts=None):
+        """与 inference_utils.generate_responses 同样的接口，供基准测试直接替换。"""
+        responses = []
+        for start in range(0, len(contents), batch_size):
+            batch = contents[start:start + batch_size]
+            batch_system = system_prompts[start:start + batch_size] if system_prompts else [None] * len(batch)
+            prompts = [render_prompt(self.tokenizer, c, prompt_name, sp) for c, sp in zip(batch, batch_system)]
+            inputs = self.tokenizer(prompts, return_tensors="pt", padding=True).to(self.model.device)
+            responses.extend(self.generate(inputs))
+        return responses
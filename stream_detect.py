@@ -0,0 +1,163 @@
+# stream_detect.py
+# 流式检测模式：producer | python stream_detect.py | sink
+# 从 stdin 逐行读取 JSONL {"id", "content"}，凑满 batch 或等到截止时间 (以先到者为准) 就送入模型，
+# 每个 batch 完成后立即把修复后的 JSONL {"id", "output"} 写到 stdout。
+# 读线程与推理之间是一个有界队列：队列满时读线程阻塞、不再读 stdin，管道写满后上游 producer 自然被反压。
+# 退出时把每条数据端到端延迟 (读入 -> 写出) 的分位数写到 stderr (stdout 只输出结果)。
+# 用法:
+#   cat comments.jsonl | python stream_detect.py --max-batch 8 --max-wait-ms 200 > results.jsonl
+#   python stream_detect.py --tiny < comments.jsonl    # CPU 上用微型替身模型验证流程
+import argparse
+import contextlib
+import json
+import queue
+import sys
+import threading
+import time
+
+from inference_utils import generate_responses, load_model, load_tiny_model, load_tokenizer
+from output_format import repair_output
+from span_snap import snap_output
+
+MAX_BATCH = 8
+MAX_WAIT_MS = 200
+MAX_QUEUE = 64
+PERCENTILES = (50, 90, 99)
+
+_EOF = object()
+
+
+def log(message: str):
+    print(message, file=sys.stderr, flush=True)
+
+
+def read_stdin(stream, pending: queue.Queue, stats: dict):
+    """
+    读线程：解析每行 JSON 并记录到达时间；队列满时 put 阻塞，即对上游施加反压。
+    读取出错 (如输入不是合法的 UTF-8) 时把异常记到 stats["error"]，无论如何都放入 _EOF，主循环不会永远阻塞。
+    """
+    try:
+        for line_no, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+                item = (time.perf_counter(), str(record['id']), record['content'])
+            except (json.JSONDecodeError, KeyError, TypeError) as e:
+                log(f"[警告] 第 {line_no} 行不是合法的 {{id, content}} JSON，已跳过: {e}")
+                stats["malformed"] += 1
+                continue
+            if pending.full():
+                stats["backpressure_events"] += 1
+                start = time.perf_counter()
+                pending.put(item)
+                stats["backpressure_sec"] += time.perf_counter() - start
+            else:
+                pending.put(item)
+    except Exception as e:
+        stats["error"] = e
+    finally:
+        pending.put(_EOF)
+
+
+def next_batch(pending: queue.Queue, max_batch: int, max_wait: float):
+    """
+    阻塞等待第一条数据，之后在 (第一条到达时间 + max_wait) 之前继续收集，凑满 max_batch 立即返回。
+    返回 (batch, 是否已到输入末尾)。
+    """
+    first = pending.get()
+    if first is _EOF:
+        return [], True
+    batch = [first]
+    deadline = first[0] + max_wait
+    while len(batch) < max_batch:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            break
+        try:
+            item = pending.get(timeout=remaining)
+        except queue.Empty:
+            break
+        if item is _EOF:
+            return batch, True
+        batch.append(item)
+    return batch, False
+
+
+def repair(response: str, content: str) -> str:
+    """兜底 -> 逐个四元组格式修复 (不剥离ID、保留全部四元组) -> 片段吸附。"""
+    return snap_output(repair_output(response), content)
+
+
+def percentile(sorted_values, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+def format_latency_report(latencies, batch_sizes, stats, elapsed: float) -> str:
+    latencies = sorted(latencies)
+    lines = [f"共处理 {len(latencies)} 条，{len(batch_sizes)} 个 batch (平均 {sum(batch_sizes) / max(1, len(batch_sizes)):.1f} 条)，"
+             f"吞吐 {len(latencies) / max(elapsed, 1e-9):.2f} 条/秒，非法输入 {stats['malformed']} 行"]
+    if latencies:
+        parts = [f"p{p} {percentile(latencies, p) * 1000:.0f}ms" for p in PERCENTILES]
+        lines.append(f"端到端延迟: {', '.join(parts)}, max {latencies[-1] * 1000:.0f}ms")
+    lines.append(f"反压 {stats['backpressure_events']} 次，读线程累计阻塞 {stats['backpressure_sec']:.2f}s")
+    return "\n".join(lines)
+
+
+def run_stream(model, tokenizer, args, in_stream=sys.stdin, out_stream=sys.stdout):
+    pending = queue.Queue(maxsize=args.max_queue)
+    stats = {"malformed": 0, "backpressure_events": 0, "backpressure_sec": 0.0, "error": None}
+    reader = threading.Thread(target=read_stdin, args=(in_stream, pending, stats), daemon=True)
+    reader.start()
+
+    latencies, batch_sizes = [], []
+    start = time.perf_counter()
+    done = False
+    try:
+        while not done:
+            batch, done = next_batch(pending, args.max_batch, args.max_wait_ms / 1000)
+            if not batch:
+                break
+            responses = generate_responses(model, tokenizer, [content for _, _, content in batch], args.prompt,
+                                           batch_size=len(batch), max_new_tokens=args.max_new_tokens)
+            for (arrived, item_id, content), response in zip(batch, responses):
+                out_stream.write(json.dumps({"id": item_id, "output": repair(response, content)},
+                                            ensure_ascii=False) + '\n')
+            out_stream.flush()
+            finished = time.perf_counter()
+            latencies.extend(finished - arrived for arrived, _, _ in batch)
+            batch_sizes.append(len(batch))
+    except (KeyboardInterrupt, BrokenPipeError):
+        log("[提示] 输入或输出被中断，停止处理。")
+    log(format_latency_report(latencies, batch_sizes, stats, time.perf_counter() - start))
+    # 读线程出错前读到的条目已经处理完并输出，这里在主线程重新抛出
+    if stats["error"] is not None:
+        raise stats["error"]
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="stdin/stdout 流式仇恨言论检测")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH, help="batch 最大条数")
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS, help="batch 中第一条数据最多等待的毫秒数")
+    parser.add_argument("--max-queue", type=int, default=MAX_QUEUE, help="待处理队列上限，超过后对上游反压")
+    parser.add_argument("--prompt", default="full_v1")
+    parser.add_argument("--max-new-tokens", type=int, default=256)
+    parser.add_argument("--backend", default="4bit")
+    parser.add_argument("--tiny", action="store_true", help="使用随机初始化的微型替身模型 (CPU)")
+    args = parser.parse_args()
+
+    # 加载过程的进度信息打到 stderr，stdout 只留给结果
+    with contextlib.redirect_stdout(sys.stderr):
+        tokenizer = load_tokenizer()
+        model = load_tiny_model(tokenizer) if args.tiny else load_model(backend=args.backend)
+    log("模型已就绪，开始读取 stdin...")
+    run_stream(model, tokenizer, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
 # predict_on_test.py (Modified to include ID in the output)
 import torch
 import json
+import time
 from tqdm import tqdm
 from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
 from peft import PeftModel
+from prompts import get_prompt
 
 # --- 1. 配置路径 ---
 BASE_MODEL_PATH = "/root/autodl-tmp/Qwen1.5-7B-Chat"
@@ -17,6 +19,8 @@ print("开始加载模型和分词器...")
 tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL_PATH, trust_remote_code=True)
 if tokenizer.pad_token is None:
     tokenizer.pad_token = tokenizer.eos_token
+# 与 inference_utils.load_tokenizer 一致：批量生成 (如长评论分块) 时必须左填充，否则短的行会在 pad 之后续写
+tokenizer.padding_side = "left"
 
 quantization_config = BitsAndBytesConfig(
     load_in_4bit=True,
@@ -38,100 +42,37 @@ model.eval()
 print("模型加载并准备就绪！")
 
 # --- 3. 准备prompt模板 ---
-system_prompt = '''### **任务：中文社交媒体细粒度仇恨言论识别**
-
-你是一个顶级的中文社交媒体内容审查专家，拥有社会学、语言学和网络文化背景。你的任务是精确地分析给定的文本，抽取出其中所有构成或不构成仇恨言论的观点，并严格按照指定的四元组格式输出。
-
----
-
-### **第一部分：核心规则与定义**
-
-**1. 输出格式 (必须严格遵守):**
-- 每个观点都必须格式化为一个四元组：`评论对象 | 论点 | 目标群体 | 是否仇恨`
-- 四元组的每个元素之间用 ` | ` (空格英文半角竖线空格) 分隔。
-- 每个四元组必须以 ` [END]` (空格[END]) 结尾。
-- 如果一条文本包含多个独立的观点，不同的四元组之间用 ` [SEP] ` (空格[SEP]空格) 分隔。
-
-**2. 四元组字段定义:**
-- **评论对象 (Target):** 评论对象，观点所直接指向的人物、群体或实体。
-    - **风格对齐:** 抽取简洁的核心短语，严格重视于原文，必须是原文包含的
-    - **特殊情况:** 如果言论是泛指或隐含的，没有明确的评论对象，则设为 `NULL`。
-- **论点 (Argument):** 对“评论对象”的核心评价、行为描述或观点。
-    - **风格对齐:** 必须是从原文中抽取的、最能代表核心观点的简洁短语或子句，不要自创，标点符号也要与原文保持一致。
-- **目标群体 (Targeted Group):** 对“评论对象-论点”组合所攻击的群体进行的分类。必须是以下标签之一或多个的组合：
-    - `Racism`: 种族或民族歧视。
-    - `Region`: 地域歧视。
-    - `Sexism`: 性别歧视。
-    - `LGBTQ`: 对性少数群体的歧视。
-    - `others`: 其他类型的歧视（如针对残障、疾病、宗教、职业等）。
-    - `non-hate`: 不构成对特定群体的仇恨。
-- **是否仇恨 (Hateful):** 对该观点是否构成仇恨言论的判断。
-    - `hate`: 构成仇恨言论。
-    - `non-hate`: 不构成仇恨言论（包括一般性人身攻击或无害评论）。
-
-**3. 黄金规则 (为硬匹配优化):**
-- **分类标签必须完美:** `Targeted Group` 和 `Hateful` 的标签必须与上述列表完全一致，包括大小写。
-- **多标签必须排序:** 如果一个观点涉及多个`目标群体`，标签**必须按照英文字母顺序排序**，并用 `, ` (逗号+空格) 分隔。例如：应为 `Racism, Sexism`，而不是 `Sexism, Racism`。
-
-**4. 常见网络黑话/隐语提示:**
-- 为了帮助你更好地理解，以下是一些常见的隐语及其通常指向的歧视类别：
-- Racism：
-  - 黑蛆、黑皮、泥革、墨人、尼葛 → Racism
-  - 黑人器大活好、非洲boy、黑人传艾滋 → Racism
-  - 倭狗、日杂、韩畜 → Racism / Other
-- Sexism：
-  - 女拳、钕拳、小仙女、小酰钕、普信女、eg → Sexism
-  - 母狗、母坦克、母零 → Sexism
-  - 公、郭楠、龟男、直男癌 → Sexism
-- LGBTQ：
-  - 基佬、gay、腐癌、txl、同性癖、打拳、虹拳、跪虫族 → LGBTQ
-- Region：
-  - 东北人、南蛮、南满、北狄、冀东辽西 → Region
-  - 河南、河北、安徽、广东、江苏等地名 + 嘲讽、污蔑语言 → Region
----
-
-### **第二部分：典型样本学习 (Few-shot Examples)**
-
-下面是几个经过精心挑选的例子，请仔细学习其内在逻辑。
-
-**【样例1：简单直接的例子】**
-- **输入:** `没爹的黑孩到处扔`
-- **输出:** `没爹的黑孩 | 到处扔 | Racism | hate [END]`
-- **//分析:** 直接针对特定种族（黑孩）进行恶意攻击，是明确的种族主义仇恨言论。
-
-**【样例2：多标签的例子】**
-- **输入:** `我靠真能下得去手啊，我去主校区的时候也见过几个又黑又肥又丑看不清脸，可能是我的学校太好了女生都挺保守的，没听说也没看见哪个女生和黑人谈恋爱`
-- **输出:** `黑人 | 没听说也没看见哪个女生和黑人谈恋爱 | Racism, Sexism | hate [END]`
-- **//分析:** 观点核心是“女生不应和黑人谈恋爱”。这既包含了对黑人群体的负面刻板印象（`Racism`），也包含了对女性择偶自由的物化和限制（`Sexism`）。注意标签已按字母排序。
-
-**【样例3：多四元组的例子】**
-- **输入:** `想反女权还得看女权，舔狗龟男理中客们不是男人能打醒的`
-- **输出:** `女权 | 想反女权还得看女权 | Sexism | hate [SEP] 舔狗龟男理中客们 | 不是男人能打醒的 | Sexism | hate [END]`
-- **//分析:** 文本包含两个独立的攻击点。第一个指向“女权”，第二个指向“舔狗龟男理中客们”，都与性别议题相关。因此需要拆分为两个四元组，用 `[SEP]` 分隔。
-
-**【样例4：NULL目标的例子】**
-- **输入:** `都弯了180度所以直了`
-- **输出:** `NULL | 弯了180度所以直了 | LGBTQ | hate [END]`
-- **//分析:** 这句话是网络上对同性恋群体的暗讽，没有明确说出评论对象，但仇恨指向非常清晰。因此“评论对象”为 `NULL`。
-
-**【样例5：non-hate但有争议的例子】**
-- **输入:** `无风不起浪，我就被河南人骗了几回了，没得洗`
-- **输出:** `河南人 | 骗了几回了 | non-hate | non-hate [END]`
-- **//分析:** 这是此任务标注标准的一个微妙之处。虽然内容是对特定地域人群的负面概括，但因为它基于“个人经历”的叙述，并未上升到鼓吹普遍性歧视或攻击的程度，因此被标注为 `non-hate`。你需要学习这种边界。
-
-**【样例6：包含网络黑话的例子】**
-- **输入:** `就算她不拿刀你就能打得过180斤起步的母坦克?`
-- **输出:** `母坦克 | 180斤起步 | Sexism | hate [END]`
-- **//分析:** 这里的核心攻击点是蔑称“母坦克”，这是一个基于体重的、对女性的侮辱性黑话，属于性别歧视 `Sexism`。
-
----
-
-### **第三部分：开始任务**
-
-现在，你已经掌握了所有规则和模式。请处理以下新的输入文本，并只返回严格符合格式要求的四元组输出，不要添加任何额外的解释或评论。注意！！只输出最后的结果就可以，不要输出任何别的内容！！
-**警告：输出格式的绝对精确性**
-- 你的输出将用于机器自动评测，任何格式错误，即使是单个空格、大小写或标点符号的偏差，都将导致评测失败。
-- 请像机器一样精确地输出，不要添加任何与格式无关的、解释性的文字。你的整个回答应该只有四元组本身。'''
+# prompt 统一在 prompts.py 中注册；使用 LoRA 微调后的模型推理时可改为 "compact_v1" (与训练指令一致，prefill 更短)
+PROMPT_NAME = "full_v1"
+system_prompt = get_prompt(PROMPT_NAME)
+# 为 True 时改用检索式动态 few-shot (retrieval_v1)：每条评论从 train.json 中检索最相似的样例
+USE_RETRIEVED_FEWSHOT = False
+# 为 True 时先做 MinHash-LSH 近重复折叠：每个近重复簇只推理最早出现的一条，其余成员复用其结果
+USE_NEAR_DEDUP = False
+# 为 True 时只生成 Target/Argument，标签改为对所有合法组合一次性打分取最大似然 (见 label_scoring.py)
+USE_LABEL_SCORING = False
+# 为 True 时推理前把整个测试集预分词并缓存到磁盘 (见 token_cache.py)，循环中不再调用分词器
+USE_TOKEN_CACHE = False
+# 为 True 时启用两级级联：CPU 分类器 (cascade_classifier.py) 有把握判为 non-hate 的评论不再调用 LLM
+USE_CASCADE = False
+# 为 True 时贪心结果置信度低的条目额外采样 k 个候选并逐字段多数投票 (见 self_consistency.py)
+USE_SELF_CONSISTENCY = False
+# 为 True 时使用静态 KV cache + torch.compile 解码 (见 static_decode.py)，prompt 长度按桶左填充以复用编译图
+USE_STATIC_CACHE = False
+# 为 True 时每步只计算允许 token (评论中的 token + 格式/标签 token) 对应的 lm_head 切片 (见 restricted_vocab.py)
+USE_RESTRICTED_VOCAB = False
+# 为 True 时分词后超过 token 预算的长评论按 ，。！？ 切块分别抽取再合并 (见 long_comments.py)
+USE_LONG_INPUT_CHUNKING = False
+# 为 True 时 prefill 后先过隐状态探针 (见 prefill_probe.py)，有把握判为 non-hate 的条目不再解码；需与训练探针时的 PROMPT_NAME 一致
+USE_PREFILL_PROBE = False
+# 探针路径有自己的解码循环，不能与其它解码方式叠加；同时打开时直接报错，而不是静默忽略后者
+if USE_PREFILL_PROBE:
+    conflicts = [name for name, on in (("USE_LABEL_SCORING", USE_LABEL_SCORING),
+                                       ("USE_SELF_CONSISTENCY", USE_SELF_CONSISTENCY),
+                                       ("USE_STATIC_CACHE", USE_STATIC_CACHE),
+                                       ("USE_RESTRICTED_VOCAB", USE_RESTRICTED_VOCAB)) if on]
+    if conflicts:
+        raise ValueError(f"USE_PREFILL_PROBE 不能与 {', '.join(conflicts)} 同时使用")
 
 # --- 4. 加载测试数据 ---
 print(f"从 {TEST_FILE_PATH} 加载测试数据...")
@@ -139,6 +80,70 @@ with open(TEST_FILE_PATH, 'r', encoding='utf-8') as f:
     test_data = json.load(f)
 print(f"共加载 {len(test_data)} 条测试数据。")
 
+system_prompts = None
+if USE_RETRIEVED_FEWSHOT:
+    from fewshot_retriever import FewShotRetriever
+    print("检索每条测试数据的相似样例...")
+    retriever = FewShotRetriever()
+    # 整个测试集一次批量检索
+    system_prompts = retriever.build_prompts([item['content'] for item in test_data], tokenizer)
+    retriever.close()
+
+token_cache = None
+if USE_TOKEN_CACHE:
+    from token_cache import load_or_build
+    token_cache = load_or_build(tokenizer, TEST_FILE_PATH, test_data, system_prompts or system_prompt)
+
+# 级联分类器和 prefill 探针跳过的条目都输出同样的 non-hate 四元组
+if USE_CASCADE or USE_PREFILL_PROBE:
+    from cascade_classifier import short_circuit_output
+cascade_skip = None
+if USE_CASCADE:
+    from cascade_classifier import CascadeClassifier
+    cascade = CascadeClassifier.load()
+    # 整个测试集一次向量化预测
+    cascade_skip = cascade.skip_mask([item['content'] for item in test_data])
+    print(f"级联分类器 (阈值 {cascade.threshold}) 将跳过 {int(cascade_skip.sum())}/{len(test_data)} 条 LLM 调用。")
+
+cluster_of = None
+if USE_NEAR_DEDUP:
+    from near_dedup import dedup_report, find_clusters, reanchor_output
+    cluster_of, clusters = find_clusters([item['content'] for item in test_data])
+    print(dedup_report(cluster_of, clusters))
+label_scorer = None
+label_tokens_saved = 0
+if USE_LABEL_SCORING:
+    from label_scoring import LabelScorer, generate_with_label_scoring
+    label_scorer = LabelScorer(tokenizer)
+if USE_SELF_CONSISTENCY:
+    from self_consistency import NUM_SAMPLES, self_consistent_generate
+resampled_count = 0
+static_decoder = None
+if USE_STATIC_CACHE:
+    from static_decode import StaticDecoder
+    static_decoder = StaticDecoder(model, tokenizer)
+format_ids = None
+if USE_RESTRICTED_VOCAB:
+    from restricted_vocab import allowed_token_ids, format_token_ids, generate_restricted
+    format_ids = format_token_ids(tokenizer)
+if USE_LONG_INPUT_CHUNKING:
+    from long_comments import LONG_INPUT_TOKENS, extract_long, is_long, prompt_overhead
+    from prompts import format_retrieval_prompt
+    # 模板开销只算一次，循环中用已分词输入的长度减去它判断评论长度，不再重复分词。
+    # 检索 prompt 每条不同，这里取不含样例的规则部分作为下界，只有超出预算的条目再对评论精确分词确认
+    long_overhead = prompt_overhead(tokenizer, PROMPT_NAME, format_retrieval_prompt([]) if system_prompts else None)
+chunked_count = 0
+probe = None
+probe_skipped = 0
+if USE_PREFILL_PROBE:
+    from prefill_probe import PrefillProbe, generate_with_probe
+    probe = PrefillProbe.load(hidden_size=model.config.hidden_size)
+    if probe.prompt_name != PROMPT_NAME:
+        print(f"警告: 探针是用 '{probe.prompt_name}' 训练的，当前 PROMPT_NAME 为 '{PROMPT_NAME}'。")
+rep_outputs = {}
+generate_seconds = 0.0
+generate_count = 0
+
 # --- 5. 循环推理并保存结果 ---
 print("开始批量推理...")
 with open(OUTPUT_FILE_PATH, 'w', encoding='utf-8') as out_f:
@@ -147,25 +152,66 @@ with open(OUTPUT_FILE_PATH, 'w', encoding='utf-8') as out_f:
         # ★ 修改2: 从item中提取ID和content
         item_id = item['id']
         test_content = item['content']
-        
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": test_content}
-        ]
-        
-        prompt = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-        inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
 
-        with torch.no_grad():
-            outputs = model.generate(
-                **inputs,
-                max_new_tokens=256,
-                do_sample=False,
-                pad_token_id=tokenizer.eos_token_id
-            )
+        # 近重复簇的非代表成员：代表 (簇中最早的一条) 已经推理过，直接把结果锚定到本条原文
+        if cluster_of is not None and cluster_of[index] != index:
+            rep = cluster_of[index]
+            final_output = reanchor_output(rep_outputs[rep], test_data[rep]['content'], test_content)
+            out_f.write(f"{item_id} {final_output}" + '\n')
+            continue
+
+        # 一级分类器有把握判为 non-hate：直接输出，不调用 LLM
+        if cascade_skip is not None and cascade_skip[index]:
+            final_output = short_circuit_output(test_content)
+            rep_outputs[index] = final_output
+            out_f.write(f"{item_id} {final_output}" + '\n')
+            continue
         
-        response_ids = outputs[0][inputs['input_ids'].shape[1]:]
-        response = tokenizer.decode(response_ids, skip_special_tokens=True).strip()
+        if token_cache is not None:
+            inputs = token_cache.model_inputs(index, model.device)
+        else:
+            messages = [
+                {"role": "system", "content": system_prompts[index] if system_prompts else system_prompt},
+                {"role": "user", "content": test_content}
+            ]
+
+            prompt = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+            inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
+
+        start_time = time.perf_counter()
+        if (USE_LONG_INPUT_CHUNKING and inputs['input_ids'].shape[1] - long_overhead > LONG_INPUT_TOKENS
+                and (system_prompts is None or is_long(tokenizer, test_content))):
+            response, _ = extract_long(model, tokenizer, test_content, PROMPT_NAME,
+                                       system_prompt=system_prompts[index] if system_prompts else None)
+            chunked_count += 1
+        elif probe is not None:
+            response = generate_with_probe(model, tokenizer, inputs, probe)[0][0]
+            if response is None:
+                response = short_circuit_output(test_content)
+                probe_skipped += 1
+        elif label_scorer is not None:
+            response, label_stats = generate_with_label_scoring(model, tokenizer, inputs['input_ids'], label_scorer)
+            label_tokens_saved += label_stats["label_tokens_scored"]
+        elif USE_SELF_CONSISTENCY:
+            response, resampled = self_consistent_generate(model, tokenizer, inputs)
+            resampled_count += resampled
+        elif format_ids is not None:
+            allowed_ids = allowed_token_ids(tokenizer, [test_content], format_ids)
+            response = generate_restricted(model, tokenizer, inputs, allowed_ids)[0][0]
+        elif static_decoder is not None:
+            response = static_decoder.generate(inputs)[0]
+        else:
+            with torch.no_grad():
+                outputs = model.generate(
+                    **inputs,
+                    max_new_tokens=256,
+                    do_sample=False,
+                    pad_token_id=tokenizer.eos_token_id
+                )
+            response_ids = outputs[0][inputs['input_ids'].shape[1]:]
+            response = tokenizer.decode(response_ids, skip_special_tokens=True).strip()
+        generate_seconds += time.perf_counter() - start_time
+        generate_count += 1
         
         # 兜底逻辑
         if not response or '|' not in response:
@@ -173,6 +219,7 @@ with open(OUTPUT_FILE_PATH, 'w', encoding='utf-8') as out_f:
             final_output = DEFAULT_FALLBACK_OUTPUT
         else:
             final_output = response
+        rep_outputs[index] = final_output
             
         # ★ 修改3: 构造新的输出行格式 "id output"
         line_to_write = f"{item_id} {final_output}"
@@ -180,4 +227,16 @@ with open(OUTPUT_FILE_PATH, 'w', encoding='utf-8') as out_f:
         # ★ 修改4 (Bug修复): 确保无论是正常输出还是兜底输出，都会被写入文件
         out_f.write(line_to_write + '\n')
 
-print(f"\n处理完成！所有预测结果已保存到 {OUTPUT_FILE_PATH}")
\ No newline at end of file
+print(f"\n处理完成！所有预测结果已保存到 {OUTPUT_FILE_PATH}")
+if cluster_of is not None and generate_count:
+    print(dedup_report(cluster_of, clusters, generate_seconds / generate_count))
+if label_scorer is not None:
+    print(f"标签打分模式共省去 {label_tokens_saved} 个标签 token 的逐步解码。")
+if cascade_skip is not None:
+    print(f"级联共省去 {cascade_skip.mean():.2%} 的 LLM 调用。")
+if USE_LONG_INPUT_CHUNKING:
+    print(f"长评论分块：{chunked_count} 条超过 token 预算，按句切块推理。")
+if probe is not None:
+    print(f"prefill 探针：{probe_skipped}/{generate_count} 条判为 non-hate，跳过了解码。")
+if USE_SELF_CONSISTENCY and generate_count:
+    print(f"自洽性投票：{resampled_count}/{generate_count} 条低置信度条目各采样了 {NUM_SAMPLES} 个候选。")
\ No newline at end of file
@@ -0,0 +1,93 @@
+# token_cache.py
+# 预分词缓存：推理前把整个测试集套用 chat 模板并用 fast tokenizer 分批编码，
+# 所有 input_ids 存成一个扁平的 int32 数组 + 每条样本的偏移 (CSR 式)，以 mmap 方式读取。
+# 缓存文件名由 分词器 + chat模板 + system prompt + 测试文件 的哈希决定，任一变化都会自动重建。
+# generate 循环里只需按偏移切片，不再在 GPU 步骤之间调用分词器。
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import torch
+
+from prompts import render_prompt
+
+CACHE_DIR = "./token_cache"
+TOKENIZE_BATCH_SIZE = 512
+
+
+def cache_key(tokenizer, test_file_path: str, system_prompts) -> str:
+    """system_prompts 可以是单个字符串 (所有样本共用) 或与样本对齐的列表。"""
+    h = hashlib.sha256()
+    h.update(str(getattr(tokenizer, "name_or_path", "")).encode('utf-8'))
+    h.update(str(len(tokenizer)).encode('utf-8'))
+    h.update(str(getattr(tokenizer, "chat_template", "")).encode('utf-8'))
+    prompts = [system_prompts] if isinstance(system_prompts, str) else list(system_prompts)
+    for p in prompts:
+        h.update(hashlib.sha256(p.encode('utf-8')).digest())
+    stat = os.stat(test_file_path)
+    h.update(f"{os.path.abspath(test_file_path)}|{stat.st_size}|{stat.st_mtime_ns}".encode('utf-8'))
+    return h.hexdigest()[:16]
+
+
+def build_cache(tokenizer, items, system_prompts, path_prefix: str):
+    """分批渲染 + 编码，写出 <prefix>.ids.npy / <prefix>.offsets.npy / <prefix>.meta.json。"""
+    n = len(items)
+    per_item = system_prompts if not isinstance(system_prompts, str) else [system_prompts] * n
+    chunks = []
+    lengths = np.zeros(n, dtype=np.int64)
+    for start in range(0, n, TOKENIZE_BATCH_SIZE):
+        batch = items[start:start + TOKENIZE_BATCH_SIZE]
+        texts = [render_prompt(tokenizer, item['content'], system_prompt=sp)
+                 for item, sp in zip(batch, per_item[start:start + TOKENIZE_BATCH_SIZE])]
+        # fast tokenizer 对整批文本并行编码；与 test.py 中 tokenizer(prompt) 的结果逐条一致
+        encoded = tokenizer(texts)['input_ids']
+        for j, ids in enumerate(encoded):
+            lengths[start + j] = len(ids)
+            chunks.append(np.asarray(ids, dtype=np.int32))
+
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    flat = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int32)
+    np.save(path_prefix + ".ids.npy", flat)
+    np.save(path_prefix + ".offsets.npy", offsets)
+    with open(path_prefix + ".meta.json", 'w', encoding='utf-8') as f:
+        json.dump({"ids": [item['id'] for item in items], "total_tokens": int(offsets[-1])}, f)
+
+
+class TokenizedDataset:
+    """已分词的测试集，按下标取 input_ids (只切片，不调用分词器)。"""
+
+    def __init__(self, path_prefix: str):
+        self.ids = np.load(path_prefix + ".ids.npy", mmap_mode='r')
+        self.offsets = np.load(path_prefix + ".offsets.npy", mmap_mode='r')
+        with open(path_prefix + ".meta.json", 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def length(self, index: int) -> int:
+        return int(self.offsets[index + 1] - self.offsets[index])
+
+    def input_ids(self, index: int) -> np.ndarray:
+        return self.ids[self.offsets[index]:self.offsets[index + 1]]
+
+    def model_inputs(self, index: int, device):
+        """返回可直接传给 model.generate 的 batch=1 输入。"""
+        input_ids = torch.from_numpy(np.array(self.input_ids(index), dtype=np.int64)).unsqueeze(0).to(device)
+        return {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+
+
+def load_or_build(tokenizer, test_file_path: str, items, system_prompts, cache_dir: str = CACHE_DIR):
+    os.makedirs(cache_dir, exist_ok=True)
+    prefix = os.path.join(cache_dir, cache_key(tokenizer, test_file_path, system_prompts))
+    if not os.path.exists(prefix + ".meta.json"):
+        start = time.perf_counter()
+        print(f"预分词 {len(items)} 条样本 -> '{prefix}.*'")
+        build_cache(tokenizer, items, system_prompts, prefix)
+        print(f"预分词完成，耗时 {time.perf_counter() - start:.1f}s")
+    else:
+        print(f"使用已有的预分词缓存 '{prefix}.*'")
+    return TokenizedDataset(prefix)
@@ -0,0 +1,368 @@
+# work_queue.py
+# 多节点推理的持久化工作队列：共享存储上的一个 SQLite 文件。
+# 静态分片在 worker 挂掉或速度不一时会失衡，test.py 中途崩溃后还要靠 filtered*.txt 手工对账。
+# 这里队列保存所有待处理的测试ID，worker 按 batch 领取并获得限时租约 (lease)，过期未完成的租约自动回到待处理，
+# 结果在一个事务里原子写入。worker 可以在运行中随时加入或退出，进度/吞吐随时可查，最后按原顺序导出提交文件。
+# 不方便共享文件系统时，可以用 serve 起一个 HTTP 替身服务，worker 用 --server 通过 QueueClient 访问同一个队列。
+# 用法:
+#   python work_queue.py init --test test1.json            # 建队列 (重复执行只会补充新ID)
+#   python work_queue.py worker --batch-size 8             # 任意节点上启动任意多个
+#   python work_queue.py worker --standin                  # 不加载模型的替身 worker，用于测试队列本身
+#   python work_queue.py serve --port 8765                 # HTTP 替身服务
+#   python work_queue.py status                            # 进度与吞吐
+#   python work_queue.py export --test test1.json --output submission1.txt
+import argparse
+import json
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+QUEUE_DB_PATH = "./work_queue.db"
+LEASE_SECONDS = 600
+BATCH_SIZE = 8
+# 一个 batch 内每生成这么多条就为剩余条目续约一次
+CHUNK_SIZE = 4
+# 队列暂时领不到条目、但其它 worker 仍持有租约时的轮询间隔
+POLL_SECONDS = 30
+# 同一条目被领取超过该次数仍未完成时不再分发 (多半是会让 worker 崩溃的输入)，status 中单独列出
+MAX_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    output TEXT,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status, position);
+"""
+
+
+def default_worker_name() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class WorkQueue:
+    """SQLite 队列。每个操作是一个 BEGIN IMMEDIATE 事务，多个进程/节点并发访问同一个文件是安全的。"""
+
+    def __init__(self, db_path: str = QUEUE_DB_PATH):
+        self.db_path = db_path
+        # 网络文件系统上 WAL 不可靠，保持默认的回滚日志
+        self.conn = sqlite3.connect(db_path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+
+    def _transaction(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def enqueue(self, items) -> int:
+        """items: [{'id', 'content'}, ...]，按列表顺序记录原始位置。已存在的ID保持不变，返回新增条数。"""
+        conn = self._transaction()
+        try:
+            before = conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+            conn.executemany("INSERT OR IGNORE INTO tasks (id, position, content) VALUES (?, ?, ?)",
+                             [(str(item['id']), pos, item['content']) for pos, item in enumerate(items)])
+            after = conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return after - before
+
+    def lease(self, worker: str, n: int = BATCH_SIZE, lease_seconds: float = LEASE_SECONDS):
+        """先回收过期租约，再领取最多 n 条待处理条目，返回 [(id, content), ...]。"""
+        now = time.time()
+        conn = self._transaction()
+        try:
+            conn.execute("UPDATE tasks SET status = 'pending', worker = NULL, lease_expires = NULL "
+                         "WHERE status = 'leased' AND lease_expires < ?", (now,))
+            rows = conn.execute("SELECT id, content FROM tasks WHERE status = 'pending' AND attempts < ? "
+                                "ORDER BY position LIMIT ?", (MAX_ATTEMPTS, n)).fetchall()
+            conn.executemany("UPDATE tasks SET status = 'leased', worker = ?, lease_expires = ?, "
+                             "attempts = attempts + 1 WHERE id = ?",
+                             [(worker, now + lease_seconds, row[0]) for row in rows])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return rows
+
+    def renew(self, worker: str, ids, lease_seconds: float = LEASE_SECONDS) -> int:
+        """延长仍归该 worker 持有的租约，返回成功续约的条数。"""
+        cur = self.conn.executemany(
+            "UPDATE tasks SET lease_expires = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+            [(time.time() + lease_seconds, str(i), worker) for i in ids])
+        return cur.rowcount
+
+    def complete(self, worker: str, results: dict) -> int:
+        """
+        原子地写入一批结果 {id: output}。租约过期后又被别人领走的条目仍接受先到的结果，
+        已完成的条目不会被覆盖。返回实际写入的条数。
+        """
+        now = time.time()
+        conn = self._transaction()
+        try:
+            written = 0
+            for item_id, output in results.items():
+                cur = conn.execute("UPDATE tasks SET status = 'done', output = ?, worker = ?, finished_at = ?, "
+                                   "lease_expires = NULL WHERE id = ? AND status != 'done'",
+                                   (output, worker, now, str(item_id)))
+                written += cur.rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return written
+
+    def release(self, worker: str, ids) -> None:
+        """worker 正常退出时归还未完成的租约。"""
+        self.conn.executemany("UPDATE tasks SET status = 'pending', worker = NULL, lease_expires = NULL, "
+                              "attempts = attempts - 1 WHERE id = ? AND worker = ? AND status = 'leased'",
+                              [(str(i), worker) for i in ids])
+
+    def summary(self, window_seconds: float = 300) -> dict:
+        """各状态条数、最近 window_seconds 内的吞吐、预计剩余时间和各 worker 完成数。"""
+        now = time.time()
+        counts = dict(self.conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+        expired = self.conn.execute("SELECT COUNT(*) FROM tasks WHERE status = 'leased' AND lease_expires < ?",
+                                    (now,)).fetchone()[0]
+        stuck = self.conn.execute("SELECT COUNT(*) FROM tasks WHERE status = 'pending' AND attempts >= ?",
+                                  (MAX_ATTEMPTS,)).fetchone()[0]
+        recent = self.conn.execute("SELECT COUNT(*) FROM tasks WHERE finished_at > ?",
+                                   (now - window_seconds,)).fetchone()[0]
+        workers = dict(self.conn.execute("SELECT worker, COUNT(*) FROM tasks WHERE status = 'done' "
+                                         "GROUP BY worker").fetchall())
+        active = [w for (w,) in self.conn.execute("SELECT DISTINCT worker FROM tasks WHERE status = 'leased' "
+                                                  "AND lease_expires >= ?", (now,)).fetchall()]
+        total = sum(counts.values())
+        done = counts.get('done', 0)
+        throughput = recent / window_seconds
+        return {
+            "total": total,
+            "done": done,
+            "pending": counts.get('pending', 0),
+            "leased": counts.get('leased', 0),
+            "expired_leases": expired,
+            "stuck": stuck,
+            "items_per_sec": throughput,
+            "eta_sec": (total - done) / throughput if throughput else None,
+            "done_by_worker": workers,
+            "active_workers": active,
+        }
+
+    def results(self) -> dict:
+        return dict(self.conn.execute("SELECT id, output FROM tasks WHERE status = 'done'").fetchall())
+
+    def close(self):
+        self.conn.close()
+
+
+class QueueClient:
+    """通过 HTTP 替身服务访问队列，接口与 WorkQueue 的 lease/renew/complete/release/summary 相同。"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip('/')
+
+    def _call(self, method: str, **params):
+        body = json.dumps(params, ensure_ascii=False).encode('utf-8')
+        request = urllib.request.Request(f"{self.url}/{method}", data=body,
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=120) as resp:
+            return json.loads(resp.read().decode('utf-8'))
+
+    def lease(self, worker, n=BATCH_SIZE, lease_seconds=LEASE_SECONDS):
+        return [tuple(row) for row in self._call("lease", worker=worker, n=n, lease_seconds=lease_seconds)]
+
+    def renew(self, worker, ids, lease_seconds=LEASE_SECONDS):
+        return self._call("renew", worker=worker, ids=list(ids), lease_seconds=lease_seconds)
+
+    def complete(self, worker, results):
+        return self._call("complete", worker=worker, results=results)
+
+    def release(self, worker, ids):
+        return self._call("release", worker=worker, ids=list(ids))
+
+    def summary(self):
+        return self._call("summary")
+
+    def close(self):
+        pass
+
+
+def make_handler(queue: WorkQueue):
+    methods = {"lease", "renew", "complete", "release", "summary"}
+    # 所有请求共用一个连接，事务之间需要串行
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            method = self.path.strip('/')
+            if method not in methods:
+                self.send_error(404)
+                return
+            params = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            with lock:
+                result = getattr(queue, method)(**params)
+            payload = json.dumps(result, ensure_ascii=False).encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(queue: WorkQueue, port: int):
+    server = ThreadingHTTPServer(("0.0.0.0", port), make_handler(queue))
+    server.daemon_threads = True
+    print(f"队列替身服务已启动: http://0.0.0.0:{port} (数据库 '{queue.db_path}')")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def format_summary(s: dict) -> str:
+    eta = f"{s['eta_sec'] / 60:.1f} 分钟" if s['eta_sec'] is not None else "未知"
+    lines = [
+        f"完成 {s['done']}/{s['total']} ({s['done'] / max(1, s['total']):.1%})，待处理 {s['pending']}，"
+        f"租约中 {s['leased']} (其中已过期 {s['expired_leases']})，多次失败 {s['stuck']}",
+        f"最近吞吐 {s['items_per_sec']:.2f} 条/秒，预计剩余 {eta}，活跃 worker {len(s['active_workers'])} 个",
+    ]
+    for worker, n in sorted(s['done_by_worker'].items(), key=lambda kv: -kv[1]):
+        lines.append(f"  {worker}: {n}")
+    return "\n".join(lines)
+
+
+def run_worker(queue, args):
+    """
+    循环领取 -> 生成 -> 提交。领取到的 batch 按 --chunk-size 分块生成，每块之后为剩余条目续约，
+    避免长 batch 生成途中租约过期被别的 worker 重复领取。
+    暂时领不到条目但其它 worker 仍持有租约时不退出，而是每隔 --poll-seconds 轮询一次
+    (对方崩溃后租约过期会回到待处理)，直到没有待处理也没有租约中的条目。
+    """
+    from output_format import apply_fallback
+
+    worker = args.name or default_worker_name()
+    if args.standin:
+        model = tokenizer = None
+    else:
+        from inference_utils import load_model, load_tokenizer
+
+        tokenizer = load_tokenizer()
+        model = load_model(backend=args.backend)
+
+    processed = 0
+    while True:
+        batch = queue.lease(worker, args.batch_size, args.lease_seconds)
+        if not batch:
+            s = queue.summary()
+            # 多次失败的条目虽然是 pending，但不会再被分发
+            remaining = s['pending'] - s['stuck'] + s['leased']
+            if remaining == 0:
+                break
+            print(f"[{worker}] 暂无可领取条目，其它 worker 仍持有 {s['leased']} 条租约，{args.poll_seconds:g} 秒后重试")
+            time.sleep(args.poll_seconds)
+            continue
+        ids = [item_id for item_id, _ in batch]
+        responses = []
+        try:
+            for start in range(0, len(batch), args.chunk_size):
+                chunk = batch[start:start + args.chunk_size]
+                if args.standin:
+                    # 替身 worker：模拟推理耗时，按 --crash-rate 概率"崩溃" (不提交也不归还，等待租约过期)
+                    time.sleep(random.uniform(0, 2 * args.standin_latency))
+                    if random.random() < args.crash_rate:
+                        print(f"[{worker}] 模拟崩溃，放弃 {len(ids)} 条租约")
+                        return processed
+                    responses.extend([""] * len(chunk))
+                else:
+                    from inference_utils import generate_responses
+
+                    responses.extend(generate_responses(model, tokenizer, [content for _, content in chunk],
+                                                        args.prompt, batch_size=args.chunk_size))
+                rest = ids[len(responses):]
+                if rest:
+                    queue.renew(worker, rest, args.lease_seconds)
+        except KeyboardInterrupt:
+            queue.release(worker, ids)
+            raise
+        queue.complete(worker, {item_id: apply_fallback(r) for item_id, r in zip(ids, responses)})
+        processed += len(batch)
+        print(f"[{worker}] 已完成 {processed} 条")
+    print(f"[{worker}] 队列已空，退出。")
+    return processed
+
+
+def export_submission(queue: WorkQueue, test_path: str, output_path: str):
+    """按测试集原顺序导出 "id output" 文件；尚未完成的条目写兜底输出并报告数量。"""
+    from output_format import DEFAULT_FALLBACK_OUTPUT
+
+    with open(test_path, 'r', encoding='utf-8') as f:
+        test_data = json.load(f)
+    results = queue.results()
+    missing = 0
+    with open(output_path, 'w', encoding='utf-8') as out_f:
+        for item in test_data:
+            output = results.get(str(item['id']))
+            if output is None:
+                missing += 1
+                output = DEFAULT_FALLBACK_OUTPUT
+            out_f.write(f"{item['id']} {output}\n")
+    print(f"已导出 {len(test_data)} 条到 '{output_path}'，其中 {missing} 条尚未完成、使用了兜底输出。")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite 推理工作队列")
+    parser.add_argument("command", choices=["init", "worker", "serve", "status", "export"])
+    parser.add_argument("--db", default=QUEUE_DB_PATH)
+    parser.add_argument("--test", default="./test1.json")
+    parser.add_argument("--output", default="./submission1.txt")
+    parser.add_argument("--server", help="队列替身服务地址，如 http://10.0.0.1:8765 (worker/status 使用)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--name", help="worker 名称，默认 主机名-进程号")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="每生成多少条续约一次租约")
+    parser.add_argument("--lease-seconds", type=float, default=LEASE_SECONDS)
+    parser.add_argument("--poll-seconds", type=float, default=POLL_SECONDS)
+    parser.add_argument("--prompt", default="full_v1")
+    parser.add_argument("--backend", default="4bit")
+    parser.add_argument("--standin", action="store_true", help="替身 worker，不加载模型")
+    parser.add_argument("--standin-latency", type=float, default=0.2, help="替身 worker 每个 batch 的平均耗时")
+    parser.add_argument("--crash-rate", type=float, default=0.0, help="替身 worker 每个 batch 的崩溃概率")
+    args = parser.parse_args()
+
+    # init / export / serve 直接操作数据库文件，只有 worker / status 可以经由替身服务
+    use_server = args.server and args.command in ("worker", "status")
+    queue = QueueClient(args.server) if use_server else WorkQueue(args.db)
+    if args.command == "init":
+        with open(args.test, 'r', encoding='utf-8') as f:
+            added = queue.enqueue(json.load(f))
+        print(f"新增 {added} 条待处理条目。")
+    elif args.command == "worker":
+        run_worker(queue, args)
+    elif args.command == "serve":
+        serve(queue, args.port)
+    elif args.command == "status":
+        print(format_summary(queue.summary()))
+    elif args.command == "export":
+        export_submission(queue, args.test, args.output)
+    queue.close()
+
+
+if __name__ == "__main__":
+    main()